@@ -0,0 +1,470 @@
+# Import the required modules
+from CmsLib.CounterManager import *
+from CmsLib.InvoiceManager import *
+
+# @brief This class is the asyncio counterpart of TokenManager, all the
+#        methods are coroutines taking an AsyncPySql object
+# @note  The statements, the checks and the token pool are the ones of
+#        TokenManager
+# @ref   TokenManager
+class AsyncTokenManager:
+
+    # @ref TokenManager.__add_tokens
+    @staticmethod
+    async def __add_tokens(pysql, count):
+        # Check if the number of tokens is valid
+        if count <= 0:
+            return 1
+
+        for attempt in range(ADD_TOKEN_ATTEMPTS):
+            # Get the lowest free token numbers
+            numbers = await token_pool.take_async(pysql, count)
+
+            # Check if the tokens to be added are out of limit
+            if numbers is None:
+                return 1
+
+            # Add the tokens in one statement
+            token_ids = [TokenPool.token_id(number) for number in numbers]
+            try:
+                async with pysql.transaction():
+                    await pysql.run_many(ADD_TOKEN_STMT, [(token_id, ) for token_id in token_ids])
+                return token_ids
+            except pysql.IntegrityError:
+                # Another process added one of the tokens, load the pool again
+                token_pool.invalidate()
+                if attempt == ADD_TOKEN_ATTEMPTS - 1:
+                    raise
+
+    # @ref TokenManager.__add_token
+    @staticmethod
+    async def __add_token(pysql):
+        token_ids = await AsyncTokenManager.__add_tokens(pysql, 1)
+
+        # Check if the token cannot be added
+        if token_ids == 1:
+            return 1
+
+        return token_ids[0]
+
+    # @ref TokenManager.__remove_token
+    @staticmethod
+    async def __remove_token(pysql, token_id):
+        # Get the token product and assignment status
+        has_products = await AsyncTokenManager.__token_has_products(pysql, token_id)
+        is_assigned = await AsyncTokenManager.__is_token_assigned(pysql, token_id)
+
+        # Check if token can be removed
+        code = check_remove_token(has_products, is_assigned)
+        if code:
+            return code
+
+        # Remove the token
+        await pysql.run(REMOVE_TOKEN_STMT, (token_id, ))
+
+        # Put the token number back in the token pool
+        token_pool.release(pysql, TokenPool.token_number(token_id))
+
+        return 0
+
+    # @ref TokenManager.__get_token
+    @staticmethod
+    async def __get_token(pysql):
+        # Lock the first unassigned token
+        await pysql.run(FREE_TOKEN_STMT)
+
+        # Get the first unassigned token
+        token_id = pysql.scalar_result
+
+        # If return value is none
+        if not token_id:
+            return None
+
+        # Update the token assigned status to true
+        await pysql.run(ASSIGN_TOKEN_STMT, (token_id, ))
+
+        return token_id
+
+    # @ref TokenManager.__put_token
+    @staticmethod
+    async def __put_token(pysql, token_id):
+        # Get the token product and assignment status
+        has_products = await AsyncTokenManager.__token_has_products(pysql, token_id)
+        is_assigned = await AsyncTokenManager.__is_token_assigned(pysql, token_id)
+
+        # Check if token can be put back
+        code = check_put_token(has_products, is_assigned)
+        if code:
+            return code
+
+        # Make the assigned status false and make the invoice id null
+        await pysql.run(PUT_TOKEN_STMT, (token_id, ))
+
+        return 0
+
+    # @ref TokenManager.__is_token_assigned
+    @staticmethod
+    async def __is_token_assigned(pysql, token_id):
+        await pysql.run(TOKEN_ASSIGNED_STMT, (token_id, ))
+
+        return pysql.scalar_result
+
+    # @ref TokenManager.__token_has_products
+    @staticmethod
+    async def __token_has_products(pysql, token_id):
+        await pysql.run(TOKEN_PRODUCTS_STMT, (token_id, ))
+
+        return pysql.scalar_result
+
+    # @ref TokenManager.__get_token_details
+    @staticmethod
+    async def __get_token_details(pysql, token_id):
+        await pysql.run(TOKEN_DETAILS_STMT, (token_id, ))
+
+        return pysql.result
+
+    # @ref TokenManager.__get_all_tokens_status
+    @staticmethod
+    async def __get_all_tokens_status(pysql):
+        await pysql.run(TOKENS_STATUS_STMT)
+
+        return pysql.result
+
+    # @ref __add_tokens
+    @staticmethod
+    async def add_tokens(pysql, count):
+        return await pysql.run_transaction(AsyncTokenManager.__add_tokens,
+                                           count)
+
+    # @ref __add_token
+    @staticmethod
+    async def add_token(pysql):
+        return await pysql.run_transaction(AsyncTokenManager.__add_token)
+
+    # @ref __remove_token
+    @staticmethod
+    async def remove_token(pysql, token_id):
+        return await pysql.run_transaction(AsyncTokenManager.__remove_token,
+                                           token_id)
+
+    # @ref __get_token
+    @staticmethod
+    async def get_token(pysql):
+        return await pysql.run_transaction(AsyncTokenManager.__get_token)
+
+    # @ref __put_token
+    @staticmethod
+    async def put_token(pysql, token_id):
+        return await pysql.run_transaction(AsyncTokenManager.__put_token,
+                                           token_id)
+
+    # @ref __is_token_assigned
+    @staticmethod
+    async def is_token_assigned(pysql, token_id):
+        return await pysql.run_transaction(AsyncTokenManager.__is_token_assigned,
+                                           token_id,
+                                           commit = False)
+
+    # @ref __token_has_products
+    @staticmethod
+    async def token_has_products(pysql, token_id):
+        return await pysql.run_transaction(AsyncTokenManager.__token_has_products,
+                                           token_id,
+                                           commit = False)
+
+    # @ref __get_all_tokens_status
+    @staticmethod
+    async def get_all_tokens_status(pysql):
+        return await pysql.run_transaction(AsyncTokenManager.__get_all_tokens_status,
+                                           commit = False)
+
+    # @ref __get_token_details
+    @staticmethod
+    async def get_token_details(pysql, token_id):
+        return await pysql.run_transaction(AsyncTokenManager.__get_token_details,
+                                           token_id,
+                                           commit = False)
+
+# @brief This class is the asyncio counterpart of CounterManager, all the
+#        methods are coroutines taking an AsyncPySql object
+# @note  The statements and the checks are the ones of CounterManager, the
+#        hot products are sold from the escrow slabs, the movements are
+#        logged through the transaction log buffer and notify the low stock
+#        listeners as in the other managers
+# @ref   CounterManager
+class AsyncCounterManager:
+
+    # @ref InventoryManager.__inventory_has_product
+    @staticmethod
+    async def __inventory_has_product(pysql, product_id):
+        await pysql.run(HAS_PRODUCT_STMT, (product_id, ))
+
+        return pysql.scalar_result
+
+    # @ref InventoryManager.__notify_low_stock
+    @staticmethod
+    async def __notify_low_stock(pysql, changes):
+        if not low_stock_listeners or not changes:
+            return
+
+        # Get the quantities after the movements
+        product_ids = list(changes)
+        await pysql.run(STORED_QUANTITIES_STMT.format(", ".join(["%s"] * len(product_ids))), product_ids)
+
+        notify_crossings(pysql, pysql.result, changes)
+
+    # @ref InventoryManager.__buffer_transactions
+    @staticmethod
+    async def __buffer_transactions(pysql, transactions):
+        # Get the transaction ids (in the order of the transactions)
+        numbers = await pysql.sequences.next_values("InventoryTransactions", len(transactions))
+
+        pysql.transaction_log.append_async(pysql, transaction_rows(numbers, transactions))
+
+    # @ref CounterManager.__add_counter_to_token
+    @staticmethod
+    async def __add_counter_to_token(pysql, token_id, product_id, quantity):
+        # Get the token assignment status and the product existence status
+        token_assigned = await AsyncTokenManager._AsyncTokenManager__is_token_assigned(pysql, token_id)
+        has_product = await AsyncCounterManager.__inventory_has_product(pysql, product_id)
+
+        # Check if the line can be added
+        code = check_counter_to_token(token_assigned, quantity, has_product)
+        if code:
+            return code
+
+        if pysql.escrow is not None and pysql.escrow.is_enabled(product_id):
+            # Sell the hot product from a slab of the process
+            sufficient = await pysql.escrow.take_async(pysql, product_id, quantity)
+        else:
+            # Remove from displayed quantity only if it is sufficient
+            await pysql.run(SUB_COUNTER_STMT, (quantity, product_id, quantity))
+            sufficient = pysql.rowcount != 0
+
+        # Check if quantity is sufficient
+        if not sufficient:
+            return 4
+
+        # Check if the token already has the product
+        await pysql.run(TOKEN_HAS_PRODUCT_STMT, (token_id, product_id))
+        product_present = pysql.scalar_result
+
+        if product_present:
+            # Update the product quantity if present already
+            await pysql.run(ADD_TOKEN_PRODUCT_STMT, (quantity, token_id, product_id))
+        else:
+            # Insert the product quantity if product not already present
+            await pysql.run(INSERT_TOKEN_PRODUCT_STMT, (token_id, product_id, quantity))
+
+        # Log the transaction
+        await AsyncCounterManager.__buffer_transactions(pysql, [("COUNTER_SUB", product_id, quantity)])
+
+        return 0
+
+    # @ref CounterManager.__add_inventory_to_counter
+    @staticmethod
+    async def __add_inventory_to_counter(pysql, product_id, quantity):
+        # Get the product existence status
+        has_product = await AsyncCounterManager.__inventory_has_product(pysql, product_id)
+
+        # Check if the quantity can be moved
+        code = check_inventory_to_counter(quantity, has_product)
+        if code:
+            return code
+
+        # Move from inventory to counter only if the stored quantity is
+        # sufficient
+        await pysql.run(INVENTORY_TO_COUNTER_STMT, (quantity, quantity, product_id, quantity))
+
+        # Check if quantity is sufficient
+        if pysql.rowcount == 0:
+            return 3
+
+        # Log the transaction
+        await AsyncCounterManager.__buffer_transactions(pysql, [("INVENTORY_TO_COUNTER", product_id, quantity)])
+
+        # Notify if the product went below its threshold
+        await AsyncCounterManager.__notify_low_stock(pysql, {product_id: -quantity})
+
+        return 0
+
+    # @ref CounterManager.__add_token_to_counter
+    @staticmethod
+    async def __add_token_to_counter(pysql, token_id, product_id):
+        # Get the current quantity of products in the token
+        await pysql.run(TOKEN_PRODUCT_QUANTITY_STMT, (token_id, product_id))
+        quantity = pysql.scalar_result
+
+        # End if quantity is none
+        if not quantity:
+            return 1
+
+        # Remove the product from the token
+        await pysql.run(REMOVE_TOKEN_PRODUCT_STMT, (token_id, product_id))
+
+        if await AsyncCounterManager.__inventory_has_product(pysql, product_id):
+            # Update the required quantity to the counter if already present
+            await pysql.run(ADD_COUNTER_STMT, (quantity, product_id))
+        else:
+            # Insert the the required quantity to the counter
+            await pysql.run(INSERT_COUNTER_STMT, (product_id, 0, quantity, 0))
+
+        # Log the transaction
+        await AsyncCounterManager.__buffer_transactions(pysql, [("COUNTER_ADD", product_id, quantity)])
+
+        return 0
+
+    # @ref __add_counter_to_token
+    @staticmethod
+    async def add_counter_to_token(pysql, token_id, product_id, quantity):
+        return await pysql.run_transaction(AsyncCounterManager.__add_counter_to_token,
+                                           token_id,
+                                           product_id,
+                                           quantity)
+
+    # @ref __add_inventory_to_counter
+    @staticmethod
+    async def add_inventory_to_counter(pysql, product_id, quantity):
+        return await pysql.run_transaction(AsyncCounterManager.__add_inventory_to_counter,
+                                           product_id,
+                                           quantity)
+
+    # @ref __add_token_to_counter
+    @staticmethod
+    async def add_token_to_counter(pysql, token_id, product_id):
+        return await pysql.run_transaction(AsyncCounterManager.__add_token_to_counter,
+                                           token_id,
+                                           product_id)
+
+# @brief This class is the asyncio counterpart of InvoiceManager, all the
+#        methods are coroutines taking an AsyncPySql object
+# @note  The statements and the checks are the ones of InvoiceManager
+# @ref   InvoiceManager
+class AsyncInvoiceManager:
+
+    # @ref InvoiceManager.__generate_invoice
+    @staticmethod
+    async def __generate_invoice(pysql, token_ids, payment_mode):
+        # Check if tokens are all assigned and the total is not null
+        invoice_has_products = 0
+        invoice_total = 0
+        for token in token_ids:
+            # Get the token assignment and product status
+            is_assigned = await AsyncTokenManager._AsyncTokenManager__is_token_assigned(pysql, token)
+            token_has_products = await AsyncTokenManager._AsyncTokenManager__token_has_products(pysql, token)
+
+            # Check if token is assigned
+            if not is_assigned:
+                return 1
+
+            if token_has_products:
+                # Update the total amount
+                await pysql.run(TOKEN_TOTAL_STMT, (token, ))
+                invoice_total += pysql.scalar_result
+
+            # Update the total product status
+            invoice_has_products = invoice_has_products or token_has_products
+
+        # If invoice does not have any products
+        if not invoice_has_products:
+            return 2
+
+        # Check the payment mode
+        if payment_mode not in PAYMENT_MODES:
+            return 3
+
+        # Create an invoice id
+        invoice_id = format_invoice_id(await pysql.sequences.next_value("Invoices"))
+
+        # Create an invoice
+        await pysql.run(INSERT_INVOICE_STMT, (invoice_id, invoice_total, payment_mode))
+
+        # Link the invoice with each of the token ids
+        await pysql.run_many(LINK_INVOICE_STMT, [(invoice_id, token) for token in token_ids])
+        token_ids = [(token, ) for token in token_ids]
+
+        # Add the invoice product details
+        await pysql.run(INVOICE_PRODUCTS_STMT, (invoice_id, ))
+        invoice_details = pysql.result
+
+        # Add these product details with the corresponding invoice
+        await pysql.run_many(INSERT_INVOICE_PRODUCTS_STMT, [(invoice_id, ) + tuple(details) for details in invoice_details])
+
+        # Reconcile the escrow slabs of the billed products once committed
+        if pysql.escrow is not None:
+            product_ids = [details[0] for details in invoice_details]
+            pysql.after_commit(lambda: pysql.escrow.reconcile(product_ids))
+
+        # Make the assigned status false and make the invoice id null
+        await pysql.run_many(PUT_TOKEN_STMT, token_ids)
+
+        # Remove all the products selected by this token
+        await pysql.run_many(CLEAR_TOKEN_STMT, token_ids)
+
+        return invoice_id
+
+    # @ref InvoiceManager.__give_additional_discount
+    @staticmethod
+    async def __give_additional_discount(pysql, invoice_id, discount):
+        # Check if invoice exists
+        await pysql.run(INVOICE_EXISTS_STMT, (invoice_id, ))
+
+        if not pysql.scalar_result:
+            return 1
+
+        # Check if discount is negative
+        if discount < 0:
+            return 2
+
+        # Update the discount value
+        await pysql.run(DISCOUNT_STMT, (discount, invoice_id))
+
+        return 0
+
+    # @ref InvoiceManager.__get_invoice_details
+    @staticmethod
+    async def __get_invoice_details(pysql, invoice_id):
+        # Get the invoice parameters
+        await pysql.run(INVOICE_STMT, (invoice_id, ))
+        invoice_parameters = pysql.first_result
+
+        # Get the invoice product details
+        await pysql.run(INVOICE_DETAILS_STMT, (invoice_id, ))
+        invoice_details = pysql.result
+
+        return invoice_parameters, invoice_details
+
+    # @ref InvoiceManager.__get_invoices_by_date
+    @staticmethod
+    async def __get_invoices_by_date(pysql, date):
+        await pysql.run(INVOICES_BY_DATE_STMT, (date, date))
+
+        return pysql.result
+
+    # @ref __generate_invoice
+    @staticmethod
+    async def generate_invoice(pysql, token_ids, payment_mode):
+        return await pysql.run_transaction(AsyncInvoiceManager.__generate_invoice,
+                                           token_ids,
+                                           payment_mode)
+
+    # @ref __give_additional_discount
+    @staticmethod
+    async def give_additional_discount(pysql, invoice_id, discount):
+        return await pysql.run_transaction(AsyncInvoiceManager.__give_additional_discount,
+                                           invoice_id,
+                                           discount)
+
+    # @ref __get_invoice_details
+    @staticmethod
+    async def get_invoice_details(pysql, invoice_id):
+        return await pysql.run_transaction(AsyncInvoiceManager.__get_invoice_details,
+                                           invoice_id,
+                                           commit = False)
+
+    # @ref __get_invoices_by_date
+    @staticmethod
+    async def get_invoices_by_date(pysql, date):
+        return await pysql.run_transaction(AsyncInvoiceManager.__get_invoices_by_date,
+                                           date,
+                                           commit = False)
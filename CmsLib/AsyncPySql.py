@@ -0,0 +1,350 @@
+# Import the required modules
+from CmsLib.InventoryEscrow import InventoryEscrow
+from CmsLib.PySql import PySql, TransactionError, RETRYABLE_ERRORS, CONNECTION_ERRORS, logger
+from CmsLib.QueryMetrics import QueryMetrics
+from CmsLib.SequenceAllocator import AsyncSequenceAllocator
+from CmsLib.StatementCache import StatementCache
+from CmsLib.TransactionLogBuffer import TransactionLogBuffer
+import asyncio
+import contextlib
+import contextvars
+import random
+import time
+import yaml
+
+# Connection, cursor, last result, manager method, transaction depth, hooks
+# and inventory transactions logged of the current asyncio task
+task_state = contextvars.ContextVar("task_state", default = None)
+
+# @brief This class is the asyncio counterpart of PySql, it runs the sql
+#        commands over a pool of aiomysql connections so that one process
+#        can serve many counter terminals without a thread per request
+# @note  The state of the transaction is stored per asyncio task. The
+#        escrow slab moves and the background writer of the transaction log
+#        run in threads over MySQLdb pools of their own, as for PySql.
+class AsyncPySql:
+
+    # Error raised by a statement which breaks a key or a constraint (set
+    # from the driver by open())
+    IntegrityError = None
+
+    # @brief This method initializes the AsyncPySql object
+    # @param path_to_yaml Path to the .yaml file
+    # @note  The pool is created by the open() coroutine
+    def __init__(self, path_to_yaml):
+        # Load the yaml file
+        db_details = yaml.load(open(path_to_yaml), Loader = yaml.FullLoader)
+        self.db_details = db_details
+
+        # Field to store the aiomysql pool
+        self.pool = None
+
+        # Create the allocator of the ids (its pool is created by open())
+        self.sequences = AsyncSequenceAllocator(db_details.get('sequence_block_size', 100))
+
+        # Create the statement cache and the query metrics
+        self.statements = StatementCache(db_details.get('statement_cache_size', 256))
+        slow_query_ms = db_details.get('slow_query_ms', 100)
+        self.metrics = QueryMetrics(slow_query_ms / 1000 if slow_query_ms is not None else None,
+                                    db_details.get('metrics_max_series', 500))
+
+        # Store the retry policy
+        self.retry_limit = db_details.get('retry_limit', 3)
+        self.retry_backoff = db_details.get('retry_backoff', 0.05)
+        self.retry_backoff_max = db_details.get('retry_backoff_max', 1.0)
+
+        # Arguments of MySQLdb.connect for the pools of the threads
+        connect_args = {"host": db_details['mysql_host'],
+                        "user": db_details['mysql_user'],
+                        "passwd": db_details['mysql_password'],
+                        "db": db_details['mysql_db']}
+
+        # Create the escrow of the hot products (optional) as in PySql
+        self.escrow = None
+        escrow = db_details.get('escrow')
+        if escrow:
+            self.escrow = InventoryEscrow(PySql._PySql__create_pool(connect_args, dict(db_details, pool_size = 2)),
+                                          escrow.get('products') or {},
+                                          shards = escrow.get('shards', 1),
+                                          refill_below = escrow.get('refill_below', 0.25),
+                                          holder = escrow.get('holder'),
+                                          retry_limit = self.retry_limit,
+                                          is_retryable = PySql._PySql__is_retryable,
+                                          backoff = self.__backoff)
+
+        # Create the buffer of the inventory transactions logged as in PySql
+        transaction_log = db_details.get('transaction_log', 'commit')
+        self.transaction_log = TransactionLogBuffer(transaction_log,
+                                                    pool = PySql._PySql__create_pool(connect_args, dict(db_details, pool_size = 1)) if transaction_log == 'background' else None,
+                                                    queue_size = db_details.get('transaction_log_queue_size', 1000))
+
+    # @brief This coroutine creates the pool of connections
+    async def open(self):
+        # Import the async driver only when it is used
+        import aiomysql
+
+        db_details = self.db_details
+        connect_args = {"host": db_details['mysql_host'],
+                        "user": db_details['mysql_user'],
+                        "password": db_details['mysql_password'],
+                        "db": db_details['mysql_db'],
+                        "pool_recycle": db_details.get('pool_max_lifetime', 3600),
+                        "autocommit": False}
+        self.IntegrityError = aiomysql.IntegrityError
+        self.pool = await aiomysql.create_pool(maxsize = db_details.get('pool_size', 8), **connect_args)
+        # The id reservations use a small pool of their own
+        self.sequences.pool = await aiomysql.create_pool(minsize = 1, maxsize = 2, **connect_args)
+
+    # @brief This coroutine closes the pool of connections, writes the queued
+    #        transaction log rows and returns the escrow slabs of the process
+    #        to the counter
+    async def close(self):
+        await asyncio.to_thread(self.transaction_log.close)
+        if self.transaction_log.pool is not None:
+            self.transaction_log.pool.close()
+        if self.escrow is not None:
+            await asyncio.to_thread(self.escrow.close)
+            self.escrow.pool.close()
+
+        for pool in (self.pool, self.sequences.pool):
+            pool.close()
+            await pool.wait_closed()
+
+    # @brief This method returns the transaction state of the current task
+    @staticmethod
+    def __state():
+        return task_state.get()
+
+    # @brief This coroutine executes a single sql query
+    # @param sql_stmt The sql statement to be executed (string)
+    # @param params The arguments for the sql_stmt (tuple)
+    async def run(self, sql_stmt, params = None):
+        state = AsyncPySql.__state()
+        sql_stmt = self.statements.get(sql_stmt, state["method"])
+        cursor = state["cursor"]
+
+        # Run the sql query
+        start = time.perf_counter()
+        await cursor.execute(sql_stmt, params)
+        # Fetch the result so that it can be read without awaiting
+        state["last_result"] = await cursor.fetchall() if cursor.description else ()
+        self.metrics.observe(state["method"], sql_stmt, time.perf_counter() - start, cursor.rowcount, params)
+
+    # @brief This coroutine executes the same sql query for each of the parameter
+    # @param sql_stmt The sql statement to be executed (string)
+    # @param params The arguments for the sql_stmt (list of tuples)
+    async def run_many(self, sql_stmt, params):
+        state = AsyncPySql.__state()
+        sql_stmt = self.statements.get(sql_stmt, state["method"])
+        cursor = state["cursor"]
+
+        # Run the sql query
+        start = time.perf_counter()
+        await cursor.executemany(sql_stmt, params)
+        state["last_result"] = ()
+        self.metrics.observe(state["method"], sql_stmt, time.perf_counter() - start, cursor.rowcount)
+
+    # @brief This property returns the result of the previous query
+    @property
+    def result(self):
+        return AsyncPySql.__state()["last_result"]
+
+    # @brief This property returns the scalar result (i.e. single element)
+    #        of the previous query
+    @property
+    def scalar_result(self):
+        try:
+            return self.result[0][0]
+        except IndexError:
+            return None
+
+    # @brief This property returns the first tuple of the result relation
+    @property
+    def first_result(self):
+        try:
+            return self.result[0]
+        except IndexError:
+            return None
+
+    # @brief This property returns the number of rows changed (or matched
+    #        by a select) by the previous query
+    @property
+    def rowcount(self):
+        return AsyncPySql.__state()["cursor"].rowcount
+
+    # @brief This property tells if the current task is in a transaction
+    @property
+    def in_transaction(self):
+        state = AsyncPySql.__state()
+        return state is not None and state["depth"] > 0
+
+    # @brief This property returns the inventory transactions logged by the
+    #        transaction of the current task (TransactionLogBuffer.append_async)
+    @property
+    def log_rows(self):
+        return AsyncPySql.__state()["log_rows"]
+
+    # @ref   PySql.before_commit
+    # @param callback Coroutine function called without arguments
+    # @note  The callback can only be registered in a transaction
+    def before_commit(self, callback):
+        if not self.in_transaction:
+            raise RuntimeError("before_commit called outside of a transaction")
+        AsyncPySql.__state()["before_commit"].append(callback)
+
+    # @ref PySql.after_commit
+    def after_commit(self, callback):
+        if self.in_transaction:
+            AsyncPySql.__state()["on_commit"].append(callback)
+        else:
+            AsyncPySql.__run_hooks([callback])
+
+    # @ref PySql.after_rollback
+    def after_rollback(self, callback):
+        if self.in_transaction:
+            AsyncPySql.__state()["on_rollback"].append(callback)
+
+    # @ref PySql.__run_hooks
+    @staticmethod
+    def __run_hooks(callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Transaction hook %r failed", callback)
+
+    # @brief This method checks if an error is one of the given mysql errors
+    # @param error The exception raised
+    # @param codes The mysql error codes (tuple)
+    @staticmethod
+    def __has_code(error, codes):
+        return len(getattr(error, "args", ())) > 0 and error.args[0] in codes
+
+    # @brief This method returns a context in which all the statements run
+    #        by the current task share one connection and one transaction
+    #        (async with pysql.transaction(): ...)
+    # @param commit Boolean to specify wether to commit or not
+    # @param method Name of the manager method tagged on the statements
+    # @ref PySql.transaction
+    @contextlib.asynccontextmanager
+    async def transaction(self, commit = True, method = None):
+        state = AsyncPySql.__state()
+
+        # Run the nested transaction in a savepoint
+        if state is not None and state["depth"]:
+            depth = state["depth"]
+            savepoint = "`SP_{}`".format(depth)
+            outer_method = state["method"]
+            before_commit = len(state["before_commit"])
+            on_commit = len(state["on_commit"])
+            on_rollback = len(state["on_rollback"])
+            await self.run("SAVEPOINT " + savepoint)
+            state["depth"] = depth + 1
+            state["method"] = method or outer_method
+
+            try:
+                yield self
+            except:
+                state["depth"] = depth
+                try:
+                    await self.run("ROLLBACK TO SAVEPOINT " + savepoint)
+                except Exception:
+                    pass
+                hooks = state["on_rollback"][on_rollback:]
+                del state["before_commit"][before_commit:]
+                del state["on_commit"][on_commit:]
+                del state["on_rollback"][on_rollback:]
+                AsyncPySql.__run_hooks(reversed(hooks))
+                raise
+            else:
+                state["depth"] = depth
+                await self.run("RELEASE SAVEPOINT " + savepoint)
+            finally:
+                state["method"] = outer_method
+            return
+
+        # Check out a connection for the task
+        connection = await self.pool.acquire()
+        state = {"connection": connection,
+                 "cursor": await connection.cursor(),
+                 "last_result": None,
+                 "method": method,
+                 "depth": 1,
+                 "before_commit": [],
+                 "on_commit": [],
+                 "on_rollback": [],
+                 "log_rows": []}
+        token = task_state.set(state)
+        # The connection is discarded unless the transaction ends cleanly
+        discard = True
+        committed = False
+
+        try:
+            yield self
+
+            # Commit the changes if specified, otherwise end the read only
+            # transaction
+            if commit:
+                # The callbacks may register more callbacks
+                i = 0
+                while i < len(state["before_commit"]):
+                    await state["before_commit"][i]()
+                    i += 1
+                await connection.commit()
+                committed = True
+            else:
+                await connection.rollback()
+            discard = False
+        except Exception as error:
+            # Rollback the changes
+            try:
+                await connection.rollback()
+                discard = AsyncPySql.__has_code(error, CONNECTION_ERRORS)
+            except Exception:
+                pass
+            self.metrics.rollback(method)
+
+            if isinstance(error, TransactionError):
+                raise
+            raise TransactionError(method, error, 0) from error
+        finally:
+            task_state.reset(token)
+            await state["cursor"].close()
+            if discard:
+                connection.close()
+            self.pool.release(connection)
+            if committed:
+                AsyncPySql.__run_hooks(state["on_commit"])
+            else:
+                AsyncPySql.__run_hooks(reversed(state["on_rollback"]))
+
+    # @brief This coroutine awaits a manager coroutine function inside a
+    #        transaction with the same failure policy as PySql.run_transaction
+    # @param function Coroutine function to be called
+    # @param args List of arguments to the function
+    # @param commit Boolean to specify wether to commit or not
+    # @retval Return value of the function
+    async def run_transaction(self, function, *args, commit = True):
+        method = PySql.method_name(function)
+
+        # Reuse the transaction of the current task
+        if self.in_transaction:
+            async with self.transaction(commit, method):
+                return await function(self, *args)
+
+        for attempt in range(self.retry_limit + 1):
+            try:
+                async with self.transaction(commit, method):
+                    # Execute the function
+                    return await function(self, *args)
+            except TransactionError as error:
+                # Surface the error if it cannot be retried
+                if not AsyncPySql.__has_code(error.error, RETRYABLE_ERRORS) or attempt == self.retry_limit:
+                    raise TransactionError(method, error.error, attempt) from error.error
+
+            # Wait before running the transaction again
+            await asyncio.sleep(self.__backoff(attempt))
+
+    # @ref PySql.__backoff
+    def __backoff(self, attempt):
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
@@ -0,0 +1,210 @@
+# Import the required modules
+import threading
+import time
+
+# @brief This exception is raised when no connection could be checked out
+#        of the pool within the configured timeout
+class PoolTimeoutError(Exception):
+    pass
+
+# @brief This exception is raised when a connection is checked out of a
+#        closed pool
+class PoolClosedError(Exception):
+    pass
+
+# @brief This class maintains a bounded pool of database connections which
+#        can be shared by all the threads of a process
+# @note  The pool does not depend on flask, so it can be used by the web
+#        application as well as by the batch scripts
+class ConnectionPool:
+
+    # @brief This method initializes the ConnectionPool object
+    # @param connect Function object which opens a new connection
+    # @param max_size Maximum number of connections open at a time (int)
+    # @param max_idle Seconds after which an idle connection is closed (float)
+    # @param max_lifetime Seconds after which a connection is recycled (float)
+    # @param timeout Seconds to wait for a free connection (float)
+    def __init__(self, connect, max_size = 8, max_idle = 300, max_lifetime = 3600, timeout = 30):
+        # Store the pool parameters
+        self.__connect = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+
+        # Condition used to wait for a connection to be checked in
+        self.__condition = threading.Condition()
+        # Idle connections as (connection, created, released) ordered by
+        # the release time (the most recently released is at the end)
+        self.__idle = []
+        # Creation time of every open connection (keyed by object id)
+        self.__created = {}
+        # Number of open connections (idle and checked out)
+        self.__size = 0
+        # Field to indicate that the pool has been closed
+        self.__closed = False
+
+        # Pool metrics
+        self.__stats = {"checkouts": 0,
+                        "connects": 0,
+                        "waits": 0,
+                        "wait_seconds": 0.0,
+                        "max_wait_seconds": 0.0,
+                        "timeouts": 0,
+                        "recycled": 0,
+                        "reaped": 0,
+                        "discarded": 0}
+
+    # @brief This method closes a connection ignoring any error
+    # @param connection Connection object
+    def __close(self, connection):
+        # Forget the creation time of the connection
+        self.__created.pop(id(connection), None)
+        self.__size -= 1
+
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    # @brief This method closes the connections which have been idle
+    #        for more than max_idle seconds
+    # @param now Current monotonic time (float)
+    # @note  The condition lock must be held by the caller
+    def __reap(self, now):
+        # The oldest released connections are at the start of the list
+        while self.__idle and now - self.__idle[0][2] > self.max_idle:
+            connection, _, _ = self.__idle.pop(0)
+            self.__close(connection)
+            self.__stats["reaped"] += 1
+
+    # @brief This method checks out a connection from the pool, opening a
+    #        new one if the pool is not yet full
+    # @retval connection Connection object
+    # @note  PoolTimeoutError is raised if no connection gets free in time,
+    #        PoolClosedError once the pool is closed (also to the threads
+    #        waiting for a connection)
+    def checkout(self):
+        # Get the time at which the wait started
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        with self.__condition:
+            while True:
+                if self.__closed:
+                    raise PoolClosedError("The connection pool is closed")
+
+                now = time.monotonic()
+                # Close the connections idle for too long
+                self.__reap(now)
+
+                # Reuse the most recently released connection
+                connection = None
+                while self.__idle:
+                    connection, created, _ = self.__idle.pop()
+                    # Recycle the connection if it has lived too long
+                    if now - created > self.max_lifetime:
+                        self.__close(connection)
+                        self.__stats["recycled"] += 1
+                        connection = None
+                        continue
+                    break
+                if connection is not None:
+                    break
+
+                # Reserve a slot for a new connection if the pool is not full
+                if self.__size < self.max_size:
+                    self.__size += 1
+                    break
+
+                # Wait for a connection to be checked in
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.__stats["timeouts"] += 1
+                    raise PoolTimeoutError("No connection available in {} seconds".format(self.timeout))
+                waited = True
+                self.__condition.wait(remaining)
+
+            # Update the wait metrics
+            wait_seconds = time.monotonic() - start
+            self.__stats["checkouts"] += 1
+            if waited:
+                self.__stats["waits"] += 1
+            self.__stats["wait_seconds"] += wait_seconds
+            self.__stats["max_wait_seconds"] = max(self.__stats["max_wait_seconds"], wait_seconds)
+
+        # Return the idle connection found
+        if connection is not None:
+            return connection
+
+        # Open a new connection outside the lock
+        try:
+            connection = self.__connect()
+        except:
+            # Release the reserved slot
+            with self.__condition:
+                self.__size -= 1
+                self.__condition.notify()
+            raise
+
+        with self.__condition:
+            self.__created[id(connection)] = time.monotonic()
+            self.__stats["connects"] += 1
+
+        return connection
+
+    # @brief This method returns a connection to the pool
+    # @param connection Connection object previously checked out
+    # @param discard Boolean to specify whether the connection is broken
+    #        and must be closed instead of being reused
+    def checkin(self, connection, discard = False):
+        with self.__condition:
+            now = time.monotonic()
+            created = self.__created.get(id(connection), now)
+
+            if discard or self.__closed:
+                # Close the broken connection
+                self.__close(connection)
+                self.__stats["discarded"] += 1
+            elif now - created > self.max_lifetime:
+                # Close the connection which has lived too long
+                self.__close(connection)
+                self.__stats["recycled"] += 1
+            else:
+                # Keep the connection for reuse
+                self.__idle.append((connection, created, now))
+
+            # Close the connections idle for too long
+            self.__reap(now)
+
+            # Wake up a waiting thread
+            self.__condition.notify()
+
+    # @brief This method closes the idle connections which have exceeded
+    #        max_idle seconds (can be called periodically)
+    def reap(self):
+        with self.__condition:
+            self.__reap(time.monotonic())
+
+    # @brief This method closes all the idle connections and makes the
+    #        pool close the connections checked in later
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            while self.__idle:
+                connection, _, _ = self.__idle.pop()
+                self.__close(connection)
+            self.__condition.notify_all()
+
+    # @brief This method returns the pool metrics
+    # @retval stats Pool metrics (dict)
+    def stats(self):
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats["size"] = self.__size
+            stats["idle"] = len(self.__idle)
+            stats["in_use"] = self.__size - len(self.__idle)
+            stats["max_size"] = self.max_size
+
+        return stats
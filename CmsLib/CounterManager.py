@@ -2,6 +2,87 @@
 from CmsLib.InventoryManager import *
 from CmsLib.TokenManager import *
 
+# @brief This exception rolls back the decrement of a basket when one of its
+#        products was sold by a concurrent sale after it was read
+class QuantityChangedError(Exception):
+    pass
+
+# Statements shared with AsyncCounterManager
+# Remove from displayed quantity only if it is sufficient, the check and the
+# decrement are one atomic statement so concurrent sales cannot oversell and
+# do not lock the row for longer than the update
+SUB_COUNTER_STMT = "UPDATE `Inventory` \
+                    SET `DisplayedQuantity` = `DisplayedQuantity` - %s \
+                    WHERE `ProductID` = %s \
+                    AND `DisplayedQuantity` >= %s"
+TOKEN_HAS_PRODUCT_STMT = "SELECT 1 \
+                          FROM `TokensSelectProducts` \
+                          WHERE `TokenID` = %s AND `ProductID` = %s"
+ADD_TOKEN_PRODUCT_STMT = "UPDATE `TokensSelectProducts` \
+                          SET `Quantity` = `Quantity` + %s \
+                          WHERE `TokenID` = %s AND `ProductID` = %s"
+INSERT_TOKEN_PRODUCT_STMT = "INSERT INTO `TokensSelectProducts` \
+                             VALUES (%s, %s, %s)"
+# Move from inventory to counter only if the stored quantity is sufficient
+# (checked atomically by the update)
+INVENTORY_TO_COUNTER_STMT = "UPDATE `Inventory` \
+                             SET `DisplayedQuantity` = `DisplayedQuantity` + %s, \
+                                 `StoredQuantity` = `StoredQuantity` - %s \
+                             WHERE `ProductID` = %s \
+                             AND `StoredQuantity` >= %s"
+TOKEN_PRODUCT_QUANTITY_STMT = "SELECT `Quantity` \
+                               FROM `TokensSelectProducts` \
+                               WHERE `TokenID` = %s AND `ProductID` = %s"
+REMOVE_TOKEN_PRODUCT_STMT = "DELETE FROM `TokensSelectProducts` \
+                             WHERE `TokenID` = %s AND `ProductID` = %s"
+ADD_COUNTER_STMT = "UPDATE `Inventory` \
+                    SET `DisplayedQuantity` = `DisplayedQuantity` + %s \
+                    WHERE `ProductID` = %s"
+INSERT_COUNTER_STMT = "INSERT INTO `Inventory` (`ProductID`, `StoredQuantity`, `DisplayedQuantity`, `StoreThreshold`) \
+                       VALUES (%s, %s, %s, %s)"
+
+# @brief This function checks if a quantity of a product can be added from
+#        the counter to a token (before the quantity on the counter)
+# @param token_assigned Assignment status of the token (None if not found)
+# @param quantity Product Quantity (float)
+# @param has_product Product existence status in the inventory
+# @retval 0 Line can be added
+# @retval 1 Token not found or is not assigned
+# @retval 2 Quantity negative
+# @retval 3 Product not found in inventory
+def check_counter_to_token(token_assigned, quantity, has_product):
+    # Check if token is assigned
+    if not token_assigned:
+        return 1
+
+    # Check if quantity is non zero and positive
+    if quantity <= 0:
+        return 2
+
+    # Get the product existence status
+    if not has_product:
+        return 3
+
+    return 0
+
+# @brief This function checks if a quantity of a product can be moved from
+#        the inventory to the counter (before the stored quantity)
+# @param quantity Product Quantity (float)
+# @param has_product Product existence status in the inventory
+# @retval 0 Quantity can be moved
+# @retval 1 Quantity negative
+# @retval 2 Product not found in inventory
+def check_inventory_to_counter(quantity, has_product):
+    # Check if quantity is non zero and positive
+    if quantity <= 0:
+        return 1
+
+    # Get the product existence status
+    if not has_product:
+        return 2
+
+    return 0
+
 # @brief This class is used to handle the counter management in CMS
 # @note  There is not need to create an object of this class as all
 #        methods in this class are static
@@ -25,56 +106,146 @@ class CounterManager:
         token_assigned = TokenManager._TokenManager__is_token_assigned(pysql, token_id)
         # Get the product existence status
         has_product = InventoryManager._InventoryManager__inventory_has_product(pysql, product_id)
-        # Get the product quantity from the inventory
-        displayed_quantity = InventoryManager._InventoryManager__get_displayed_quantity(pysql, product_id)
 
-        # Check if token is assigned
-        if not token_assigned:
-            return 1
+        # Check if the line can be added
+        code = check_counter_to_token(token_assigned, quantity, has_product)
+        if code:
+            return code
 
-        # Check if quantity is non zero and positive
-        if quantity <= 0:
-            return 2
-
-        # Get the product existence status
-        if not has_product:
-            return 3
+        if pysql.escrow is not None and pysql.escrow.is_enabled(product_id):
+            # Sell the hot product from the slab of this worker
+            sufficient = pysql.escrow.take(pysql, product_id, quantity)
+        else:
+            # Remove from displayed quantity only if it is sufficient
+            pysql.run(SUB_COUNTER_STMT, (quantity, product_id, quantity))
+            sufficient = pysql.rowcount != 0
 
         # Check if quantity is sufficient
-        if displayed_quantity < quantity:
+        if not sufficient:
             return 4
 
-        # Remove from displayed quantity
-        sql_stmt = "UPDATE `Inventory` \
-                    SET `DisplayedQuantity` = `DisplayedQuantity` - %s \
-                    WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (quantity, product_id))
-
         # Check if the token already has the product
-        sql_stmt = "SELECT 1 \
-                    FROM `TokensSelectProducts` \
-                    WHERE `TokenID` = %s AND `ProductID` = %s"
-        pysql.run(sql_stmt, (token_id, product_id))
+        pysql.run(TOKEN_HAS_PRODUCT_STMT, (token_id, product_id))
         # Get the result
         product_present = pysql.scalar_result
 
         if product_present:
             # Update the product quantity if present already
-            sql_stmt = "UPDATE `TokensSelectProducts` \
-                        SET `Quantity` = `Quantity` + %s \
-                        WHERE `TokenID` = %s AND `ProductID` = %s"
-            pysql.run(sql_stmt, (quantity, token_id, product_id))
+            pysql.run(ADD_TOKEN_PRODUCT_STMT, (quantity, token_id, product_id))
         else:
             # Insert the product quantity if product not already present
-            sql_stmt = "INSERT INTO `TokensSelectProducts` \
-                        VALUES (%s, %s, %s)"
-            pysql.run(sql_stmt, (token_id, product_id, quantity))
+            pysql.run(INSERT_TOKEN_PRODUCT_STMT, (token_id, product_id, quantity))
 
         # Log the transaction
-        InventoryManager._InventoryManager__log_transaction(pysql, "COUNTER_SUB", product_id, quantity)
+        InventoryManager._InventoryManager__buffer_transactions(pysql, [("COUNTER_SUB", product_id, quantity)])
 
         return 0
 
+    # @brief This method adds a basket of products from the counter to the
+    #        requesting token with a fixed number of statements (validation,
+    #        decrement, upsert and log of all the lines at once)
+    # @param pysql Pysql Object
+    # @param token_id TokenID (string)
+    # @param items (ProductID, Quantity) (list of tuples)
+    # @retval codes Code of each line (list of ints)
+    #         0 Line added successfully
+    #         1 Token not found or is not assigned
+    #         2 Quantity negative
+    #         3 Product not found in inventory
+    #         4 Quantity not sufficient in inventory
+    # @note  The valid lines are added even if some lines fail, the lines of
+    #        the same product are checked against the quantity left by the
+    #        previous lines. The products sold from escrow slabs are added
+    #        line by line.
+    @staticmethod
+    def __add_items_to_token(pysql, token_id, items):
+        # Check if token is assigned
+        if not TokenManager._TokenManager__is_token_assigned(pysql, token_id):
+            return [1] * len(items)
+
+        # Add the lines of the products sold from escrow slabs one at a time
+        if pysql.escrow is not None and any(pysql.escrow.is_enabled(product_id) for product_id, _ in items):
+            escrow_codes = {i: CounterManager.__add_counter_to_token(pysql, token_id, product_id, quantity)
+                            for i, (product_id, quantity) in enumerate(items) if pysql.escrow.is_enabled(product_id)}
+            codes = iter(CounterManager.__add_items_to_token(pysql, token_id, [line for i, line in enumerate(items) if i not in escrow_codes]))
+            return [escrow_codes[i] if i in escrow_codes else next(codes) for i in range(len(items))]
+
+        # Nothing to add
+        if not items:
+            return []
+
+        # Get the displayed quantity of all the products of the basket
+        product_ids = list({product_id for product_id, _ in items})
+        sql_stmt = "SELECT `ProductID`, `DisplayedQuantity` \
+                    FROM `Inventory` \
+                    WHERE `ProductID` IN ({})".format(", ".join(["%s"] * len(product_ids)))
+        pysql.run(sql_stmt, product_ids)
+        displayed_quantities = {product_id: float(quantity) for product_id, quantity in pysql.result}
+
+        # Validate the lines in order
+        codes = []
+        quantities = {}
+        for product_id, quantity in items:
+            # Check if quantity is non zero and positive
+            if quantity <= 0:
+                codes.append(2)
+            # Get the product existence status
+            elif product_id not in displayed_quantities:
+                codes.append(3)
+            # Check if quantity is sufficient
+            elif displayed_quantities[product_id] < quantity:
+                codes.append(4)
+            else:
+                codes.append(0)
+                displayed_quantities[product_id] -= quantity
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        # Nothing is valid
+        if not quantities:
+            return codes
+
+        # Remove from displayed quantity if every product still has the
+        # quantity (a concurrent sale may have taken it since the read)
+        cases = " ".join(["WHEN %s THEN %s"] * len(quantities))
+        sql_stmt = "UPDATE `Inventory` \
+                    SET `DisplayedQuantity` = `DisplayedQuantity` - CASE `ProductID` {0} END \
+                    WHERE `ProductID` IN ({1}) \
+                    AND `DisplayedQuantity` >= CASE `ProductID` {0} END".format(cases, ", ".join(["%s"] * len(quantities)))
+        case_params = [value for line in quantities.items() for value in line]
+        try:
+            with pysql.transaction():
+                pysql.run(sql_stmt, case_params + list(quantities) + case_params)
+                if pysql.rowcount != len(quantities):
+                    raise QuantityChangedError()
+        except QuantityChangedError:
+            # Remove the lines one at a time in order, failing the lines for
+            # which the product is no longer sufficient
+            quantities = {}
+            for i, (product_id, quantity) in enumerate(items):
+                if codes[i] != 0:
+                    continue
+                pysql.run(SUB_COUNTER_STMT, (quantity, product_id, quantity))
+                if pysql.rowcount == 0:
+                    codes[i] = 4
+                else:
+                    quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+            # Nothing is sufficient
+            if not quantities:
+                return codes
+
+        # Insert the product quantities, adding to the products already present
+        sql_stmt = "INSERT INTO `TokensSelectProducts` \
+                    VALUES (%s, %s, %s) \
+                    ON DUPLICATE KEY UPDATE `Quantity` = `Quantity` + VALUES(`Quantity`)"
+        pysql.run_many(sql_stmt, [(token_id, product_id, quantity) for product_id, quantity in quantities.items()])
+
+        # Log the transactions
+        InventoryManager._InventoryManager__buffer_transactions(pysql, [("COUNTER_SUB", product_id, quantity)
+                                                                        for (product_id, quantity), code in zip(items, codes) if code == 0])
+
+        return codes
+
     # @brief This method adds the specified quantity of the product from
     #        the stored inventory to the counter inventory and also logs
     #        the transaction
@@ -89,30 +260,25 @@ class CounterManager:
     def __add_inventory_to_counter(pysql, product_id, quantity):
         # Get the product existence status
         has_product = InventoryManager._InventoryManager__inventory_has_product(pysql, product_id)
-        # Get the product quantity from the inventory
-        stored_quantity = InventoryManager._InventoryManager__get_stored_quantity(pysql, product_id)
 
-        # Check if quantity is non zero and positive
-        if quantity <= 0:
-            return 1
+        # Check if the quantity can be moved
+        code = check_inventory_to_counter(quantity, has_product)
+        if code:
+            return code
 
-        # Get the product existence status
-        if not has_product:
-            return 2
+        # Move from inventory to counter only if the stored quantity is
+        # sufficient
+        pysql.run(INVENTORY_TO_COUNTER_STMT, (quantity, quantity, product_id, quantity))
 
         # Check if quantity is sufficient
-        if stored_quantity < quantity:
+        if pysql.rowcount == 0:
             return 3
 
-        # Remove from inventory
-        sql_stmt = "UPDATE `Inventory` \
-                    SET `DisplayedQuantity` = `DisplayedQuantity` + %s, \
-                        `StoredQuantity` = `StoredQuantity` - %s \
-                    WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (quantity, quantity, product_id))
-
         # Log the transaction
-        InventoryManager._InventoryManager__log_transaction(pysql, "INVENTORY_TO_COUNTER", product_id, quantity)
+        InventoryManager._InventoryManager__buffer_transactions(pysql, [("INVENTORY_TO_COUNTER", product_id, quantity)])
+
+        # Notify if the product went below its threshold
+        InventoryManager._InventoryManager__notify_low_stock(pysql, {product_id: -quantity})
 
         return 0
 
@@ -126,10 +292,7 @@ class CounterManager:
     @staticmethod
     def __add_token_to_counter(pysql, token_id, product_id):
         # Get the current quantity of products in the token
-        sql_stmt = "SELECT `Quantity` \
-                    FROM `TokensSelectProducts` \
-                    WHERE `TokenID` = %s AND `ProductID` = %s"
-        pysql.run(sql_stmt, (token_id, product_id))
+        pysql.run(TOKEN_PRODUCT_QUANTITY_STMT, (token_id, product_id))
 
         # Get the result quantity from the query
         quantity = pysql.scalar_result
@@ -139,32 +302,22 @@ class CounterManager:
             return 1
 
         # Remove the product from the product
-        sql_stmt = "DELETE FROM `TokensSelectProducts` \
-                    WHERE `TokenID` = %s AND `ProductID` = %s"
-        pysql.run(sql_stmt, (token_id, product_id))
+        pysql.run(REMOVE_TOKEN_PRODUCT_STMT, (token_id, product_id))
 
         # Check if the product is already in the inventory
-        sql_stmt = "SELECT 1 \
-                    FROM `Inventory` \
-                    WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (product_id, ))
+        pysql.run(HAS_PRODUCT_STMT, (product_id, ))
         # Get the result
         product_present = pysql.scalar_result
 
         if product_present:
             # Update the required quantity to the counter if already present
-            sql_stmt = "UPDATE `Inventory` \
-                        SET `DisplayedQuantity` = `DisplayedQuantity` + %s \
-                        WHERE `ProductID` = %s"
-            pysql.run(sql_stmt, (quantity, product_id))
+            pysql.run(ADD_COUNTER_STMT, (quantity, product_id))
         else:
             # Insert the the required quantity to the counter
-            sql_stmt = "INSERT INTO `Inventory` \
-                        VALUES (%s, %s, %s, %s)"
-            pysql.run(sql_stmt, (product_id, 0, quantity, 0))
+            pysql.run(INSERT_COUNTER_STMT, (product_id, 0, quantity, 0))
 
         # Log the transaction
-        InventoryManager._InventoryManager__log_transaction(pysql, "COUNTER_ADD", product_id, quantity)
+        InventoryManager._InventoryManager__buffer_transactions(pysql, [("COUNTER_ADD", product_id, quantity)])
 
         return 0
 
@@ -176,6 +329,13 @@ class CounterManager:
                                      product_id,
                                      quantity)
 
+    # @ref __add_items_to_token
+    @staticmethod
+    def add_items_to_token(pysql, token_id, items):
+        return pysql.run_transaction(CounterManager.__add_items_to_token,
+                                     token_id,
+                                     items)
+
     # @ref __add_inventory_to_counter
     @staticmethod
     def add_inventory_to_counter(pysql, product_id, quantity):
@@ -0,0 +1,338 @@
+# Import the required modules
+import itertools
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+# Logger of the errors of the background settlements
+logger = logging.getLogger("CmsLib")
+
+# Sell from the slab of a holder only if it is sufficient
+TAKE_STMT = "UPDATE `InventoryEscrow` \
+             SET `Quantity` = `Quantity` - %s \
+             WHERE `ProductID` = %s AND `HolderID` = %s AND `Quantity` >= %s"
+# Sell from the counter when the slab is not sufficient
+TAKE_COUNTER_STMT = "UPDATE `Inventory` \
+                     SET `DisplayedQuantity` = `DisplayedQuantity` - %s \
+                     WHERE `ProductID` = %s AND `DisplayedQuantity` >= %s"
+
+# @brief This class sells the hot products from slabs of the displayed
+#        quantity reserved by each worker (rows of InventoryEscrow keyed by
+#        product and holder), so that the concurrent sales of the same
+#        product update different rows instead of queuing on the single
+#        Inventory row. The slabs are topped up from the counter (or trimmed
+#        back to it when they hold more than their slab size, e.g. after the
+#        slab size was lowered) in the background, in short transactions of
+#        their own.
+# @note  The quantity in the slabs is still on the counter: it is counted in
+#        the displayed quantity returned by InventoryManager and is moved
+#        back to Inventory by return_slabs (e.g. when the process exits).
+#        Every path locks the slab row before the Inventory row of the
+#        product (a sale updates its slab first), so a sale and a
+#        settlement never wait on each other in a cycle.
+class InventoryEscrow:
+
+    # @brief This method initializes the InventoryEscrow object
+    # @param pool ConnectionPool of the primary used only for the slab moves
+    # @param products {ProductID: slab size} of the products sold from slabs (dict)
+    # @param shards Number of slabs of each product held by the process (int)
+    # @param refill_below Fraction of the slab size under which the slab is
+    #        topped up (float)
+    # @param holder Prefix of the holder ids (string, defaults to host:pid)
+    # @param retry_limit Times a slab move is run again on a deadlock or a
+    #        lock wait timeout (int)
+    # @param is_retryable Function telling if an error can be retried
+    # @param backoff Function returning the seconds to wait after a failed
+    #        attempt (from the attempt number)
+    def __init__(self, pool, products, shards = 1, refill_below = 0.25, holder = None,
+                 retry_limit = 3, is_retryable = None, backoff = None):
+        self.pool = pool
+        self.retry_limit = retry_limit
+        self.__is_retryable = is_retryable or (lambda error: False)
+        self.__backoff = backoff or (lambda attempt: 0.05 * 2 ** attempt)
+        self.products = dict(products)
+        self.shards = shards
+        self.refill_below = refill_below
+        self.holder = holder or "{}:{}".format(socket.gethostname(), os.getpid())
+        # Slab of each thread, assigned round robin
+        self.__shard = threading.local()
+        self.__next_shard = itertools.count()
+        # Estimated quantity left in the slabs keyed by (product, holder)
+        self.__remaining = {}
+        # Settlements waiting for the background thread
+        self.__queue = queue.Queue()
+        self.__pending = set()
+        self.__thread = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+        # Sales from the slabs and from the counter
+        self.__stats = {"slab_sales": 0, "counter_sales": 0, "settlements": 0, "settlement_failures": 0}
+
+    # @brief This method tells if the product is sold from slabs
+    # @param product_id ProductID (string)
+    def is_enabled(self, product_id):
+        return product_id in self.products
+
+    # @brief This method returns the holder id of the slab of the current thread
+    # @retval holder_id HolderID (string)
+    def __holder(self):
+        shard = getattr(self.__shard, 'index', None)
+        if shard is None:
+            shard = self.__shard.index = next(self.__next_shard) % self.shards
+        return "{}/{}".format(self.holder, shard)
+
+    # @brief This method sells the quantity of the product in the current
+    #        transaction, from the slab of the thread if it is sufficient and
+    #        from the counter otherwise
+    # @param pysql PySql object in a transaction
+    # @param product_id ProductID (string)
+    # @param quantity Product quantity (float)
+    # @retval True The quantity was sufficient
+    # @retval False The quantity was not sufficient
+    def take(self, pysql, product_id, quantity):
+        holder_id = self.__holder()
+
+        pysql.run(TAKE_STMT, (quantity, product_id, holder_id, quantity))
+        if pysql.rowcount:
+            return self.__sold(pysql, product_id, holder_id, quantity, True)
+
+        # The slab is empty, sell from the counter for now
+        pysql.run(TAKE_COUNTER_STMT, (quantity, product_id, quantity))
+        if not pysql.rowcount:
+            return False
+        return self.__sold(pysql, product_id, holder_id, quantity, False)
+
+    # @ref   take
+    # @param pysql AsyncPySql object in a transaction
+    # @note  The tasks share the thread, so each sale takes the next slab
+    #        round robin
+    async def take_async(self, pysql, product_id, quantity):
+        holder_id = "{}/{}".format(self.holder, next(self.__next_shard) % self.shards)
+
+        await pysql.run(TAKE_STMT, (quantity, product_id, holder_id, quantity))
+        if pysql.rowcount:
+            return self.__sold(pysql, product_id, holder_id, quantity, True)
+
+        # The slab is empty, sell from the counter for now
+        await pysql.run(TAKE_COUNTER_STMT, (quantity, product_id, quantity))
+        if not pysql.rowcount:
+            return False
+        return self.__sold(pysql, product_id, holder_id, quantity, False)
+
+    # @brief This method counts a sale and tops up the slab once the sale is
+    #        committed if it is low
+    # @param pysql PySql or AsyncPySql object in a transaction
+    # @param product_id ProductID (string)
+    # @param holder_id HolderID of the slab (string)
+    # @param quantity Product quantity (float)
+    # @param from_slab Boolean telling if the slab was sufficient
+    # @retval True The quantity was sufficient
+    def __sold(self, pysql, product_id, holder_id, quantity, from_slab):
+        key = (product_id, holder_id)
+        with self.__lock:
+            if from_slab:
+                self.__stats["slab_sales"] += 1
+                self.__remaining[key] = self.__remaining.get(key, 0) - quantity
+                low = self.__remaining[key] < self.products[product_id] * self.refill_below
+            else:
+                self.__stats["counter_sales"] += 1
+                low = True
+
+        # Top up the slab once the sale is committed
+        if low:
+            pysql.after_commit(lambda: self.settle(product_id, holder_id))
+        return True
+
+    # @brief This method reconciles the slabs of the process with the counter
+    #        after the products were billed, settling each slab to its slab
+    #        size in the background (a slab only shrinks with the sales, so
+    #        this tops it up)
+    # @param product_ids ProductIDs billed (list of strings)
+    def reconcile(self, product_ids):
+        for product_id in set(product_ids):
+            if self.is_enabled(product_id):
+                for shard in range(self.shards):
+                    self.settle(product_id, "{}/{}".format(self.holder, shard))
+
+    # @brief This method queues the settlement of a slab for the background
+    #        thread (once per slab until it has run)
+    # @param product_id ProductID (string)
+    # @param holder_id HolderID (string)
+    def settle(self, product_id, holder_id):
+        with self.__lock:
+            if (product_id, holder_id) in self.__pending:
+                return
+            self.__pending.add((product_id, holder_id))
+
+            # Start the background thread on first use
+            if self.__thread is None:
+                self.__thread = threading.Thread(target = self.__run, name = "InventoryEscrow", daemon = True)
+                self.__thread.start()
+
+        self.__queue.put((product_id, holder_id))
+
+    # @brief This method runs the settlements queued (background thread)
+    def __run(self):
+        while True:
+            key = self.__queue.get()
+            if key is None:
+                return
+
+            with self.__lock:
+                self.__pending.discard(key)
+            try:
+                self.__settle(*key)
+            except Exception:
+                logger.exception("Settlement of the slab %s of %s failed, queued again", key[1], key[0])
+                with self.__lock:
+                    self.__stats["settlement_failures"] += 1
+
+                # Queue the settlement again, after the others waiting
+                time.sleep(self.__backoff(self.retry_limit))
+                self.settle(*key)
+
+    # @brief This method runs a statement block in a short transaction on a
+    #        connection of the escrow pool, again with a backoff on a deadlock
+    #        or a lock wait timeout (at most retry_limit times)
+    # @param function Function called with the cursor
+    # @retval Return value of the function
+    def __run_transaction(self, function):
+        for attempt in range(self.retry_limit + 1):
+            try:
+                return self.__run_once(function)
+            except Exception as error:
+                if not self.__is_retryable(error) or attempt == self.retry_limit:
+                    raise
+
+            # Wait before running the transaction again
+            time.sleep(self.__backoff(attempt))
+
+    # @brief This method runs a statement block once in a short transaction
+    #        on a connection of the escrow pool
+    # @param function Function called with the cursor
+    # @retval Return value of the function
+    def __run_once(self, function):
+        connection = self.pool.checkout()
+        discard = True
+
+        try:
+            cursor = connection.cursor()
+            result = function(cursor)
+            cursor.close()
+            connection.commit()
+            discard = False
+        finally:
+            if discard:
+                try:
+                    connection.rollback()
+                    discard = False
+                except Exception:
+                    pass
+            self.pool.checkin(connection, discard)
+
+        return result
+
+    # @brief This method moves quantity between the counter and a slab so
+    #        that the slab holds its slab size (or what is left on the counter)
+    # @param product_id ProductID (string)
+    # @param holder_id HolderID (string)
+    def __settle(self, product_id, holder_id):
+        slab_size = self.products[product_id]
+
+        def settle(cursor):
+            # Lock the slab and then the counter (in the order of take)
+            cursor.execute("SELECT `Quantity` \
+                            FROM `InventoryEscrow` \
+                            WHERE `ProductID` = %s AND `HolderID` = %s \
+                            FOR UPDATE", (product_id, holder_id))
+            held = cursor.fetchone()
+            held = float(held[0]) if held else 0
+            cursor.execute("SELECT `DisplayedQuantity` \
+                            FROM `Inventory` \
+                            WHERE `ProductID` = %s \
+                            FOR UPDATE", (product_id, ))
+            row = cursor.fetchone()
+            if row is None:
+                return held
+
+            # Move the difference (negative to give back the excess)
+            moved = min(float(row[0]), slab_size - held)
+            if moved:
+                cursor.execute("UPDATE `Inventory` \
+                                SET `DisplayedQuantity` = `DisplayedQuantity` - %s \
+                                WHERE `ProductID` = %s", (moved, product_id))
+            if moved > 0:
+                cursor.execute("INSERT INTO `InventoryEscrow` \
+                                VALUES (%s, %s, %s) \
+                                ON DUPLICATE KEY UPDATE `Quantity` = `Quantity` + VALUES(`Quantity`)",
+                               (product_id, holder_id, moved))
+            elif moved < 0:
+                # Trim the slab (the quantity is unsigned)
+                cursor.execute("UPDATE `InventoryEscrow` \
+                                SET `Quantity` = `Quantity` + %s \
+                                WHERE `ProductID` = %s AND `HolderID` = %s", (moved, product_id, holder_id))
+            return held + moved
+
+        remaining = self.__run_transaction(settle)
+        with self.__lock:
+            self.__remaining[(product_id, holder_id)] = remaining
+            self.__stats["settlements"] += 1
+
+    # @brief This method moves the quantity of the slabs back to the counter
+    # @param product_id ProductID whose slabs are returned (None for all)
+    # @param all_holders Boolean to return the slabs of every process (e.g.
+    #        after a process exited without returning its slabs, a live
+    #        process sells from the counter and tops up its slabs again)
+    # @retval Quantity returned to the counter (float)
+    def return_slabs(self, product_id = None, all_holders = False):
+        conditions = []
+        params = []
+        if product_id is not None:
+            conditions.append("`ProductID` = %s")
+            params.append(product_id)
+        if not all_holders:
+            conditions.append("`HolderID` LIKE %s")
+            params.append(self.holder.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%")
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+        def return_slabs(cursor):
+            cursor.execute("SELECT `ProductID`, `Quantity` \
+                            FROM `InventoryEscrow` " + where + " \
+                            FOR UPDATE", params)
+            slabs = cursor.fetchall()
+            cursor.executemany("UPDATE `Inventory` \
+                                SET `DisplayedQuantity` = `DisplayedQuantity` + %s \
+                                WHERE `ProductID` = %s", [(quantity, product) for product, quantity in slabs])
+            cursor.execute("DELETE FROM `InventoryEscrow` " + where, params)
+            return sum(float(quantity) for _, quantity in slabs)
+
+        returned = self.__run_transaction(return_slabs)
+        with self.__lock:
+            for key in list(self.__remaining):
+                if product_id is None or key[0] == product_id:
+                    del self.__remaining[key]
+        return returned
+
+    # @brief This method stops the background thread and returns the slabs
+    #        of the process to the counter (once, the pool may be closed
+    #        after the first call)
+    def close(self):
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+            closed, self.__closed = self.__closed, True
+        if thread is not None:
+            self.__queue.put(None)
+            thread.join()
+
+        if not closed:
+            self.return_slabs()
+
+    # @brief This method returns the escrow metrics
+    # @retval stats {"slab_sales", "counter_sales", "settlements",
+    #         "settlement_failures", "pending"} (dict)
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats, pending = len(self.__pending))
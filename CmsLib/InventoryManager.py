@@ -1,7 +1,82 @@
-# This variable stores the next TransactionID integer
-next_transaction_id = None
-# This variable indicates whether the next_transaction_id has been initialized
-next_transaction_id_read = 0
+# Import the required modules
+import datetime
+import functools
+import logging
+import time
+
+# Logger of the inventory checkpoints
+checkpoint_log = logging.getLogger("CmsLib.checkpoint")
+
+# Longest wait for the transactions which may log movements at or before
+# the time of a checkpoint (seconds)
+CHECKPOINT_WAIT_SECONDS = 60
+
+# Net movements of the stored and displayed quantities of each product over
+# the log rows of a filter (formatted with the WHERE clause)
+MOVEMENTS_STMT = "SELECT `ProductID`, \
+                         SUM(CASE `TransactionType` \
+                             WHEN 'INVENTORY_ADD' THEN `Quantity` \
+                             WHEN 'INVENTORY_SUB' THEN -`Quantity` \
+                             WHEN 'INVENTORY_TO_COUNTER' THEN -`Quantity` \
+                             ELSE 0 END), \
+                         SUM(CASE `TransactionType` \
+                             WHEN 'COUNTER_ADD' THEN `Quantity` \
+                             WHEN 'COUNTER_SUB' THEN -`Quantity` \
+                             WHEN 'INVENTORY_TO_COUNTER' THEN `Quantity` \
+                             ELSE 0 END) \
+                  FROM `InventoryTransactions` \
+                  WHERE {} \
+                  GROUP BY `ProductID`"
+
+# Functions called with (ProductID, below threshold?, StoredQuantity,
+# StoreThreshold) once a transaction which moved the stored quantity of a
+# product across its threshold commits
+low_stock_listeners = []
+
+# Statement shared with AsyncCounterManager
+HAS_PRODUCT_STMT = "SELECT COUNT(*) \
+                    FROM `Inventory` \
+                    WHERE `ProductID` = %s"
+
+# Stored quantities and thresholds of products (formatted with the
+# placeholders of the ProductIDs)
+STORED_QUANTITIES_STMT = "SELECT `ProductID`, `StoredQuantity`, `StoreThreshold` \
+                          FROM `Inventory` \
+                          WHERE `ProductID` IN ({})"
+
+# @brief This function registers the notifications of the low stock
+#        listeners, run once the current transaction commits, of the
+#        products whose stored quantity crossed their threshold with the last
+#        movements
+# @param pysql PySql or AsyncPySql object in a transaction
+# @param rows (ProductID, StoredQuantity, StoreThreshold) after the
+#        movements (list of tuples)
+# @param changes {ProductID: change of the StoredQuantity} of the movements
+#        (dict)
+# @param old_thresholds {ProductID: StoreThreshold} before the movements
+#        when the thresholds were changed (dict)
+def notify_crossings(pysql, rows, changes, old_thresholds = None):
+    for product_id, stored_quantity, threshold in rows:
+        if threshold is None:
+            continue
+        old_threshold = (old_thresholds or {}).get(product_id, threshold)
+        # The changes are floats or Decimals (e.g. read from OrdersOfProducts)
+        was_below = old_threshold is not None and float(stored_quantity) - float(changes[product_id]) <= float(old_threshold)
+        is_below = stored_quantity <= threshold
+
+        # Notify the crossings only
+        if was_below != is_below:
+            for listener in list(low_stock_listeners):
+                pysql.after_commit(functools.partial(listener, product_id, is_below, stored_quantity, threshold))
+
+# @brief This function returns the rows of InventoryTransactions of
+#        validated transactions
+# @param numbers Integer ids taken from the sequence (list of ints)
+# @param transactions (TransactionType, ProductID, Quantity) (list of tuples)
+# @retval (TransactionID, TransactionType, ProductID, Quantity) (list of tuples)
+def transaction_rows(numbers, transactions):
+    return [("TRC-" + format(number, "010d"), ) + tuple(transaction)
+            for number, transaction in zip(numbers, transactions)]
 
 # @brief This class is used to handle the inventory management in CMS
 # @note  There is not need to create an object of this class as all
@@ -16,11 +91,14 @@ class InventoryManager:
     # @retval None For product not found
     @staticmethod
     def __get_displayed_quantity(pysql, product_id):
-        # Get the displayed quantity of the product
-        sql_stmt = "SELECT `DisplayedQuantity` \
+        # Get the displayed quantity of the product (including the quantity
+        # held in escrow slabs)
+        sql_stmt = "SELECT `DisplayedQuantity` + COALESCE((SELECT SUM(`Quantity`) \
+                                                            FROM `InventoryEscrow` \
+                                                            WHERE `ProductID` = %s), 0) \
                     FROM `Inventory` \
                     WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (product_id, ))
+        pysql.run(sql_stmt, (product_id, product_id))
 
         # Return the quantity
         quantity = pysql.scalar_result
@@ -56,7 +134,8 @@ class InventoryManager:
     @staticmethod
     def __is_below_threshold(pysql, product_id):
         # Check if the stored quantity is less than equal the store threshold
-        sql_stmt = "SELECT `StoredQuantity` <= `StoreThreshold` \
+        # (maintained by the generated column)
+        sql_stmt = "SELECT `BelowThreshold?` \
                     FROM `Inventory` \
                     WHERE `ProductID` = %s"
         pysql.run(sql_stmt, (product_id, ))
@@ -74,10 +153,7 @@ class InventoryManager:
     @staticmethod
     def __inventory_has_product(pysql, product_id):
         # Check if product id exists in the inventory
-        sql_stmt = "SELECT COUNT(*) \
-                    FROM `Inventory` \
-                    WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (product_id, ))
+        pysql.run(HAS_PRODUCT_STMT, (product_id, ))
 
         # Get the result status
         has_product = pysql.scalar_result
@@ -104,12 +180,23 @@ class InventoryManager:
         if not has_product:
             return 2
 
+        # Get the current threshold
+        sql_stmt = "SELECT `StoreThreshold` \
+                    FROM `Inventory` \
+                    WHERE `ProductID` = %s \
+                    FOR UPDATE"
+        pysql.run(sql_stmt, (product_id, ))
+        old_threshold = pysql.scalar_result
+
         # Set the value of threshold to the given argument
         sql_stmt = "UPDATE `Inventory` \
                     SET `StoreThreshold` = %s \
                     WHERE `ProductID` = %s"
         pysql.run(sql_stmt, (threshold, product_id))
 
+        # Notify if the product crossed the new threshold
+        InventoryManager.__notify_low_stock(pysql, {product_id: 0}, {product_id: old_threshold})
+
         return 0
 
     # @brief This method removes the specified product quantity from the
@@ -120,27 +207,37 @@ class InventoryManager:
     # @retval 0 Transaction successfull
     # @retval 1 Quantity not positive
     # @retval 2 Product not found
+    # @retval 3 Quantity not sufficient
     @staticmethod
     def __sub_product_from_inventory(pysql, product_id, quantity):
         # Get the product existence status
         has_product = InventoryManager._InventoryManager__inventory_has_product(pysql, product_id)
 
-        # Check if quantity is negative
-        if quantity < 0:
+        # Check if quantity is non zero and positive
+        if quantity <= 0:
             return 1
 
         # Check if product exists
         if not has_product:
             return 2
 
-        # Subtract the specified quantity of the product
+        # Subtract the specified quantity of the product only if it is
+        # sufficient (checked atomically by the update)
         sql_stmt = "UPDATE `Inventory` \
                     SET `StoredQuantity` = `StoredQuantity` - %s \
-                    WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (quantity, product_id))
+                    WHERE `ProductID` = %s \
+                    AND `StoredQuantity` >= %s"
+        pysql.run(sql_stmt, (quantity, product_id, quantity))
+
+        # Check if quantity is sufficient
+        if pysql.rowcount == 0:
+            return 3
 
         # Log the transaction
-        InventoryManager.__log_transaction(pysql, "INVENTORY_SUB", product_id, quantity)
+        InventoryManager.__buffer_transactions(pysql, [("INVENTORY_SUB", product_id, quantity)])
+
+        # Notify if the product went below its threshold
+        InventoryManager.__notify_low_stock(pysql, {product_id: -quantity})
 
         return 0
 
@@ -156,18 +253,6 @@ class InventoryManager:
     # @retval 3 Quantity negative
     @staticmethod
     def __log_transaction(pysql, transaction_type, product_id, quantity):
-        # Fetch the global variables
-        global next_transaction_id
-        global next_transaction_id_read
-
-        # Read the next transaction id if already filled with data
-        if not next_transaction_id_read:
-            sql_stmt = "SELECT COUNT(*) \
-                        FROM `InventoryTransactions`"
-            pysql.run(sql_stmt)
-            next_transaction_id = pysql.scalar_result
-            next_transaction_id_read = 1
-
         # Check if transaction type is valid
         if transaction_type not in ["COUNTER_ADD", "COUNTER_SUB", "INVENTORY_TO_COUNTER", "INVENTORY_ADD", "INVENTORY_SUB"]:
             return 1
@@ -183,19 +268,87 @@ class InventoryManager:
         if quantity <= 0:
             return 3
 
-        # Get the string transaction id
-        transaction_id = "TRC-" + format(next_transaction_id, "010d")
-
         # Enter the transaction in the inventory transactions
-        sql_stmt = "INSERT INTO `InventoryTransactions` \
-                    VALUES (%s, %s, %s, %s, (SELECT CURRENT_TIMESTAMP))"
-        pysql.run(sql_stmt, (transaction_id, transaction_type, product_id, quantity))
+        InventoryManager.__buffer_transactions(pysql, [(transaction_type, product_id, quantity)])
+
+        return 0
+
+    # @brief This method logs a batch of transactions with one statement
+    # @param pysql PySql object
+    # @param transactions (TransactionType, ProductID, Quantity) (list of tuples)
+    # @retval 0 Transactions successfull
+    # @retval 1 Transaction type invalid
+    # @retval 2 Product not found
+    # @retval 3 Quantity negative
+    # @note  Nothing is logged if any of the transactions is invalid
+    @staticmethod
+    def __log_transactions(pysql, transactions):
+        # Check if transaction types are valid
+        for transaction_type, product_id, quantity in transactions:
+            if transaction_type not in ["COUNTER_ADD", "COUNTER_SUB", "INVENTORY_TO_COUNTER", "INVENTORY_ADD", "INVENTORY_SUB"]:
+                return 1
+
+        # Nothing to log
+        if not transactions:
+            return 0
+
+        # Get the products found in the inventory
+        product_ids = list({product_id for _, product_id, _ in transactions})
+        sql_stmt = "SELECT `ProductID` \
+                    FROM `Inventory` \
+                    WHERE `ProductID` IN ({})".format(", ".join(["%s"] * len(product_ids)))
+        pysql.run(sql_stmt, product_ids)
+        found_products = {row[0] for row in pysql.result}
+
+        for transaction_type, product_id, quantity in transactions:
+            # Check if product exists
+            if product_id not in found_products:
+                return 2
+
+            # Check if quantity is positive
+            if quantity <= 0:
+                return 3
 
-        # Increment the global transaction id count
-        next_transaction_id += 1
+        # Enter the transactions in the inventory transactions
+        InventoryManager.__buffer_transactions(pysql, transactions)
 
         return 0
 
+    # @brief This method notifies the low stock listeners, once the current
+    #        transaction commits, of the products whose stored quantity
+    #        crossed their threshold with the last movements
+    # @param pysql PySql object in a transaction
+    # @param changes {ProductID: change of the StoredQuantity} of the
+    #        movements already applied (dict)
+    # @param old_thresholds {ProductID: StoreThreshold} before the movements
+    #        when the thresholds were changed (dict)
+    # @note  The managers call this method after each stored quantity
+    #        movement, the rows are already locked by the movements
+    @staticmethod
+    def __notify_low_stock(pysql, changes, old_thresholds = None):
+        if not low_stock_listeners or not changes:
+            return
+
+        # Get the quantities after the movements
+        product_ids = list(changes)
+        pysql.run(STORED_QUANTITIES_STMT.format(", ".join(["%s"] * len(product_ids))), product_ids)
+
+        notify_crossings(pysql, pysql.result, changes, old_thresholds)
+
+    # @brief This method gives ids to validated transactions and buffers them
+    #        to be written with the other transactions logged by the current
+    #        transaction (at its commit, with one multi-row insert)
+    # @param pysql PySql object
+    # @param transactions (TransactionType, ProductID, Quantity) (list of tuples)
+    # @note  The managers which have already checked the products and the
+    #        quantities log through this method to skip the checks
+    @staticmethod
+    def __buffer_transactions(pysql, transactions):
+        # Get the transaction ids (in the order of the transactions)
+        numbers = pysql.sequences.next_values("InventoryTransactions", len(transactions))
+
+        pysql.transaction_log.append(pysql, transaction_rows(numbers, transactions))
+
     # @brief This method returns the details of all the products
     #        in the inventory
     # @param pysql PySql object
@@ -203,8 +356,11 @@ class InventoryManager:
     @staticmethod
     def __get_inventory_details(pysql):
         # Get the product details of othe entire inventory
-        sql_stmt = "SELECT `ProductID`, `Name`, `StoredQuantity`, `DisplayedQuantity`, `StoreThreshold`, `UnitType` \
-                    FROM `Products` JOIN `Inventory` USING (`ProductID`)"
+        sql_stmt = "SELECT `ProductID`, `Name`, `StoredQuantity`, `DisplayedQuantity` + COALESCE(`EscrowQuantity`, 0), `StoreThreshold`, `UnitType` \
+                    FROM `Products` JOIN `Inventory` USING (`ProductID`) \
+                                    LEFT JOIN (SELECT `ProductID`, SUM(`Quantity`) AS `EscrowQuantity` \
+                                               FROM `InventoryEscrow` \
+                                               GROUP BY `ProductID`) AS `Escrow` USING (`ProductID`)"
         pysql.run(sql_stmt)
 
         # Get the results
@@ -232,11 +388,12 @@ class InventoryManager:
     # @retval (TransactionID, ProductID, Name, TransactionType, Quantity, UnitType, Timestamp) (list of tuples)
     @staticmethod
     def __get_transactions_by_date(pysql, date):
-        # Get the transactions made on that date
+        # Get the transactions made on that date (as a range of timestamps
+        # so that the index on Timestamp is used)
         sql_stmt = "SELECT `TransactionID`, `ProductID`, `Name`, `TransactionType`, `Quantity`, `UnitType`, TIME(`Timestamp`) \
                     FROM `InventoryTransactions` JOIN `Products` USING (`ProductID`) \
-                    WHERE DATE(`Timestamp`) = %s"
-        pysql.run(sql_stmt, (date, ))
+                    WHERE `Timestamp` >= CAST(%s AS DATE) AND `Timestamp` < CAST(%s AS DATE) + INTERVAL 1 DAY"
+        pysql.run(sql_stmt, (date, date))
 
         # Get the results
         transactions = pysql.result
@@ -252,16 +409,269 @@ class InventoryManager:
     @staticmethod
     def __get_transactions_of_product_by_date(pysql, product_id, date):
         # Get the transaction details of the products on the given date
+        # (using the index on ProductID and Timestamp)
         sql_stmt = "SELECT `TransactionID`, `TransactionType`, `Quantity`, TIME(`Timestamp`) \
                     FROM `InventoryTransactions` \
-                    WHERE `ProductID` = %s AND DATE(`Timestamp`) = %s"
-        pysql.run(sql_stmt, (product_id, date))
+                    WHERE `ProductID` = %s \
+                    AND `Timestamp` >= CAST(%s AS DATE) AND `Timestamp` < CAST(%s AS DATE) + INTERVAL 1 DAY"
+        pysql.run(sql_stmt, (product_id, date, date))
 
         # Get the result
         transactions = pysql.result
 
         return transactions
 
+    # @brief This method returns a page of the transactions in the order of
+    #        their ids, starting after the last transaction of the previous
+    #        page (keyset pagination, so every page costs the same)
+    # @param pysql PySql object
+    # @param after_id TransactionID of the last row of the previous page
+    #        (string, None for the first page)
+    # @param page_size Number of transactions in the page (int)
+    # @param transaction_type Only the transactions of this type (string enum,
+    #        None for all)
+    # @param product_id Only the transactions of this product (string, None for all)
+    # @retval (transactions, next_id) the (TransactionID, ProductID, Name,
+    #         TransactionType, Quantity, UnitType, Timestamp) of the page (list
+    #         of tuples) and the after_id of the next page (None on the last page)
+    @staticmethod
+    def __get_transactions_page(pysql, after_id, page_size, transaction_type, product_id):
+        conditions = []
+        params = []
+        if after_id is not None:
+            conditions.append("`TransactionID` > %s")
+            params.append(after_id)
+        if transaction_type is not None:
+            conditions.append("`TransactionType` = %s")
+            params.append(transaction_type)
+        if product_id is not None:
+            conditions.append("`ProductID` = %s")
+            params.append(product_id)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+        # Get one row more than the page to know if there is a next page
+        sql_stmt = "SELECT `TransactionID`, `ProductID`, `Name`, `TransactionType`, `Quantity`, `UnitType`, `Timestamp` \
+                    FROM `InventoryTransactions` JOIN `Products` USING (`ProductID`) \
+                    " + where + " \
+                    ORDER BY `TransactionID` \
+                    LIMIT %s"
+        pysql.run(sql_stmt, params + [page_size + 1])
+
+        # Get the results
+        transactions = pysql.result
+        next_id = transactions[page_size - 1][0] if len(transactions) > page_size else None
+
+        return transactions[:page_size], next_id
+
+    # @brief This method returns the start of the oldest transaction running
+    #        before the snapshot, whose movements may be logged at that time
+    #        or later
+    # @param pysql PySql object
+    # @retval (oldest, now) The start of the oldest transaction (None if no
+    #         transaction is running) and the time of the server (tuple)
+    @staticmethod
+    def __oldest_transaction(pysql):
+        pysql.run("SELECT MIN(`trx_started`), NOW() FROM `information_schema`.`INNODB_TRX`")
+        oldest, now = pysql.result[0]
+
+        return oldest, now
+
+    # @brief This method reads the stored and displayed quantities of all the
+    #        products from a consistent snapshot, without locking any row
+    # @param pysql PySql object
+    # @param oldest Return value of __oldest_transaction (tuple)
+    # @retval (created_at, window_start, stock, window_movements) The time of
+    #         the checkpoint (second), the start of the window of the log
+    #         rows which may still be committed at or before it, the stock
+    #         {ProductID: [StoredQuantity, DisplayedQuantity]} and the net
+    #         movements of the window seen by the snapshot (tuple)
+    # @note  The snapshot is read on a connection of its own, on which
+    #        START TRANSACTION WITH CONSISTENT SNAPSHOT is the first statement
+    @staticmethod
+    def __snapshot_stock(pysql, oldest):
+        oldest, before = oldest
+        # The log is stamped to the second when a statement starts
+        window_start = min(oldest or before, before) - datetime.timedelta(seconds = 1)
+
+        connection = pysql.pool.checkout()
+        discard = True
+        try:
+            cursor = connection.cursor()
+            # Read everything else from one snapshot
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            cursor.execute("SELECT NOW(6)")
+            created_at = cursor.fetchone()[0].replace(microsecond = 0)
+
+            # Get the quantities (the displayed quantity with the slabs)
+            sql_stmt = "SELECT `ProductID`, `StoredQuantity`, `DisplayedQuantity` + COALESCE(`EscrowQuantity`, 0) \
+                        FROM `Inventory` LEFT JOIN (SELECT `ProductID`, SUM(`Quantity`) AS `EscrowQuantity` \
+                                                    FROM `InventoryEscrow` \
+                                                    GROUP BY `ProductID`) AS `Escrow` USING (`ProductID`)"
+            cursor.execute(sql_stmt)
+            stock = {row[0]: [row[1], row[2]] for row in cursor.fetchall()}
+
+            # Get the movements of the window included in the snapshot
+            cursor.execute(MOVEMENTS_STMT.format("`Timestamp` >= %s AND `Timestamp` <= %s"), (window_start, created_at))
+            window_movements = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+            cursor.close()
+            connection.rollback()
+            discard = False
+        finally:
+            pysql.pool.checkin(connection, discard)
+
+        return created_at, window_start, stock, window_movements
+
+    # @brief This method tells if a transaction which may log movements at
+    #        or before a time is still running
+    # @param pysql PySql object
+    # @param created_at Time of the checkpoint (datetime)
+    # @retval True if the log up to that time may still change
+    @staticmethod
+    def __log_pending(pysql, created_at):
+        # A transaction started in the second after the checkpoint may still
+        # stamp its movements with that second
+        sql_stmt = "SELECT NOW() <= %s OR EXISTS (SELECT 1 \
+                                                  FROM `information_schema`.`INNODB_TRX` \
+                                                  WHERE `trx_started` <= %s \
+                                                  AND `trx_mysql_thread_id` <> CONNECTION_ID())"
+        settled_at = created_at + datetime.timedelta(seconds = 1)
+        pysql.run(sql_stmt, (settled_at, settled_at))
+        log_pending = bool(pysql.scalar_result)
+
+        return log_pending
+
+    # @brief This method writes a checkpoint: the stock of the snapshot with
+    #        the movements of the window committed after the snapshot
+    # @param pysql PySql object
+    # @param snapshot Return value of __snapshot_stock (tuple)
+    # @retval checkpoint_id CheckpointID (int)
+    @staticmethod
+    def __write_checkpoint(pysql, snapshot):
+        created_at, window_start, stock, window_movements = snapshot
+        # Copy the stock, the transaction may be run again
+        stock = {product_id: list(quantities) for product_id, quantities in stock.items()}
+
+        # Add the movements logged at or before the checkpoint which were not
+        # committed yet when the snapshot was read
+        pysql.run(MOVEMENTS_STMT.format("`Timestamp` >= %s AND `Timestamp` <= %s"), (window_start, created_at))
+        for product_id, stored_change, displayed_change in pysql.result:
+            seen_stored, seen_displayed = window_movements.get(product_id, (0, 0))
+            if stored_change != seen_stored or displayed_change != seen_displayed:
+                quantities = stock.setdefault(product_id, [0, 0])
+                quantities[0] += stored_change - seen_stored
+                quantities[1] += displayed_change - seen_displayed
+
+        # Get the last transaction logged (for reference, the replay uses the
+        # timestamps as the ids are reserved in blocks by each process)
+        pysql.run("SELECT MAX(`TransactionID`) FROM `InventoryTransactions`")
+        last_transaction_id = pysql.scalar_result
+
+        sql_stmt = "INSERT INTO `InventoryCheckpoints` (`CreatedAt`, `LastTransactionID`) \
+                    VALUES (%s, %s)"
+        pysql.run(sql_stmt, (created_at, last_transaction_id))
+        pysql.run("SELECT LAST_INSERT_ID()")
+        checkpoint_id = pysql.scalar_result
+
+        sql_stmt = "INSERT INTO `InventoryCheckpointStock` \
+                    VALUES (%s, %s, %s, %s)"
+        pysql.run_many(sql_stmt, [(checkpoint_id, product_id) + tuple(stock[product_id]) for product_id in sorted(stock)])
+
+        return checkpoint_id
+
+    # @brief This method returns the stock at a point in time, rebuilt from
+    #        the nearest checkpoint (before or after that time) and the
+    #        transactions logged between the checkpoint and that time
+    # @param pysql PySql object
+    # @param product_id ProductID (string, None for all the products)
+    # @param timestamp Point in time (datetime or string of format
+    #        "YYYY-MM-DD HH:MM:SS")
+    # @retval (StoredQuantity, DisplayedQuantity) Stock of the product (tuple)
+    # @retval None For product not found at that time
+    # @retval (ProductID, StoredQuantity, DisplayedQuantity) Stock of all the
+    #         products when product_id is None (list of tuples)
+    # @note  The transactions between the checkpoint and the time must not
+    #        be archived (PartitionManager), so the checkpoints should be
+    #        taken more often than the months are archived
+    @staticmethod
+    def __get_stock_as_of(pysql, product_id, timestamp):
+        if isinstance(timestamp, str):
+            timestamp = datetime.datetime.fromisoformat(timestamp)
+
+        # Get the last checkpoint before the time and the first one after it
+        sql_stmt = "(SELECT `CheckpointID`, `CreatedAt` \
+                     FROM `InventoryCheckpoints` \
+                     WHERE `CreatedAt` <= %s \
+                     ORDER BY `CreatedAt` DESC \
+                     LIMIT 1) \
+                    UNION ALL \
+                    (SELECT `CheckpointID`, `CreatedAt` \
+                     FROM `InventoryCheckpoints` \
+                     WHERE `CreatedAt` > %s \
+                     ORDER BY `CreatedAt` \
+                     LIMIT 1)"
+        pysql.run(sql_stmt, (timestamp, timestamp))
+        checkpoints = pysql.result
+
+        product_filter = "AND `ProductID` = %s" if product_id is not None else ""
+        product_params = (product_id, ) if product_id is not None else ()
+
+        stock = {}
+        if checkpoints:
+            # Start from the nearest checkpoint
+            checkpoint_id, created_at = min(checkpoints, key = lambda checkpoint: abs(checkpoint[1] - timestamp))
+            sql_stmt = "SELECT `ProductID`, `StoredQuantity`, `DisplayedQuantity` \
+                        FROM `InventoryCheckpointStock` \
+                        WHERE `CheckpointID` = %s " + product_filter
+            pysql.run(sql_stmt, (checkpoint_id, ) + product_params)
+            stock = {row[0]: [row[1], row[2]] for row in pysql.result}
+
+            # Replay the log forward from a checkpoint before the time, or
+            # backward from a checkpoint after it
+            if created_at <= timestamp:
+                start, end, sign = created_at, timestamp, 1
+            else:
+                start, end, sign = timestamp, created_at, -1
+            time_filter = "`Timestamp` > %s AND `Timestamp` <= %s"
+            time_params = (start, end)
+        else:
+            # Replay the whole log up to the time
+            sign = 1
+            time_filter = "`Timestamp` <= %s"
+            time_params = (timestamp, )
+
+        # Get the net movements of each product in the interval with one
+        # aggregate (using the index on ProductID and Timestamp, and only
+        # the partitions of the interval)
+        pysql.run(MOVEMENTS_STMT.format(time_filter + " " + product_filter), time_params + product_params)
+
+        for movement_product_id, stored_change, displayed_change in pysql.result:
+            quantities = stock.setdefault(movement_product_id, [0, 0])
+            quantities[0] += sign * stored_change
+            quantities[1] += sign * displayed_change
+
+        if product_id is not None:
+            return tuple(stock[product_id]) if product_id in stock else None
+
+        return [(each, ) + tuple(stock[each]) for each in sorted(stock)]
+
+    # @brief This method returns the products whose stored quantity is
+    #        below their threshold (from the index on the generated
+    #        BelowThreshold? column, so only the low products are read)
+    # @param pysql PySql object
+    # @retval (ProductID, Name, StoredQuantity, StoreThreshold, UnitType) (list of tuples)
+    @staticmethod
+    def __get_low_stock(pysql):
+        sql_stmt = "SELECT `ProductID`, `Name`, `StoredQuantity`, `StoreThreshold`, `UnitType` \
+                    FROM `Inventory` JOIN `Products` USING (`ProductID`) \
+                    WHERE `BelowThreshold?` = 1"
+        pysql.run(sql_stmt)
+
+        # Get the results
+        low_stock = pysql.result
+
+        return low_stock
+
     # @ref __get_displayed_quantity
     @staticmethod
     def get_displayed_quantity(pysql, product_id):
@@ -311,8 +721,13 @@ class InventoryManager:
         return pysql.run_transaction(InventoryManager.__log_transaction,
                                      transaction_type,
                                      product_id,
-                                     quantity,
-                                     commit = False)
+                                     quantity)
+
+    # @ref __log_transactions
+    @staticmethod
+    def log_transactions(pysql, transactions):
+        return pysql.run_transaction(InventoryManager.__log_transactions,
+                                     transactions)
 
     # @ref __get_inventory_details
     @staticmethod
@@ -326,6 +741,90 @@ class InventoryManager:
         return pysql.run_transaction(InventoryManager.__get_transactions,
                                      commit = False)
 
+    # @brief This method returns all the transactions one at a time without
+    #        loading the whole log in memory
+    # @param pysql PySql object
+    # @param batch_size Number of rows fetched at a time (int)
+    # @retval (TransactionID, ProductID, Name, TransactionType, Quantity, UnitType, Timestamp) (generator of tuples)
+    @staticmethod
+    def stream_transactions(pysql, batch_size = 1000):
+        sql_stmt = "SELECT `TransactionID`, `ProductID`, `Name`, `TransactionType`, `Quantity`, `UnitType`, `Timestamp` \
+                    FROM `InventoryTransactions` JOIN `Products` USING (`ProductID`)"
+        return pysql.stream(sql_stmt, batch_size = batch_size)
+
+    # @ref __get_low_stock
+    @staticmethod
+    def get_low_stock(pysql):
+        return pysql.run_transaction(InventoryManager.__get_low_stock,
+                                     commit = False)
+
+    # @brief This method registers a function called when the stored
+    #        quantity of a product crosses its threshold (after the commit)
+    # @param listener Function called with (ProductID, below threshold?,
+    #        StoredQuantity, StoreThreshold)
+    @staticmethod
+    def add_low_stock_listener(listener):
+        low_stock_listeners.append(listener)
+
+    # @brief This method unregisters a low stock listener
+    # @param listener Function registered by add_low_stock_listener
+    @staticmethod
+    def remove_low_stock_listener(listener):
+        low_stock_listeners.remove(listener)
+
+    # @brief This method snapshots the stored and displayed quantities of
+    #        all the products as a checkpoint of the transaction log
+    # @param pysql PySql object
+    # @retval checkpoint_id CheckpointID (int)
+    # @note  The quantities are read from a consistent snapshot, so no row is
+    #        locked and the movements never wait. The checkpoint holds every
+    #        movement logged at or before CreatedAt: the movements of the
+    #        transactions still running at the snapshot are added once they
+    #        have finished (CHECKPOINT_WAIT_SECONDS at most, waited outside
+    #        any transaction), from the log rows of the window they may be
+    #        stamped in. This reads information_schema.INNODB_TRX, which
+    #        needs the PROCESS privilege. RuntimeError is raised inside a
+    #        transaction, and in the background mode of the transaction log
+    #        (whose rows may still be queued when the log is read).
+    @staticmethod
+    def create_checkpoint(pysql):
+        if pysql.in_transaction:
+            raise RuntimeError("create_checkpoint called inside a transaction")
+        if pysql.transaction_log.mode != "commit":
+            raise RuntimeError("Checkpoints need the commit mode of the transaction log")
+
+        oldest = pysql.run_transaction(InventoryManager.__oldest_transaction)
+        snapshot = InventoryManager.__snapshot_stock(pysql, oldest)
+
+        # Wait for the transactions which may still log movements at or
+        # before the checkpoint, holding no lock
+        deadline = time.monotonic() + CHECKPOINT_WAIT_SECONDS
+        while pysql.run_transaction(InventoryManager.__log_pending, snapshot[0]):
+            if time.monotonic() > deadline:
+                checkpoint_log.warning("Transactions started before the checkpoint of %s are still running", snapshot[0])
+                break
+            time.sleep(0.1)
+
+        return pysql.run_transaction(InventoryManager.__write_checkpoint, snapshot)
+
+    # @ref __get_stock_as_of
+    @staticmethod
+    def get_stock_as_of(pysql, product_id, timestamp):
+        return pysql.run_transaction(InventoryManager.__get_stock_as_of,
+                                     product_id,
+                                     timestamp,
+                                     commit = False)
+
+    # @ref __get_transactions_page
+    @staticmethod
+    def get_transactions_page(pysql, after_id = None, page_size = 50, transaction_type = None, product_id = None):
+        return pysql.run_transaction(InventoryManager.__get_transactions_page,
+                                     after_id,
+                                     page_size,
+                                     transaction_type,
+                                     product_id,
+                                     commit = False)
+
     # @ref __get_transactions_by_date
     @staticmethod
     def get_transactions_by_date(pysql, date):
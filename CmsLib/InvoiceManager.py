@@ -1,10 +1,51 @@
 # Import the required libraries
 from CmsLib.TokenManager import *
 
-# This variable stores the next InvoiceID integer
-next_invoice_id = None
-# This variable indicates whether the next_invoice_id has been initialized
-next_invoice_id_read = 0
+# Payment modes of the invoices
+PAYMENT_MODES = ["cash", "card", "wallet"]
+
+# Statements shared with AsyncInvoiceManager
+TOKEN_TOTAL_STMT = "SELECT SUM(`Quantity` * `UnitPrice` * (1 - `CurrentDiscount` / 100)) \
+                    FROM `TokensSelectProducts` JOIN `Products` USING (`ProductID`) \
+                    WHERE `TokenID` = %s"
+INSERT_INVOICE_STMT = "INSERT INTO `Invoices`(`InvoiceID`,`InvoiceDate`, `InvoiceTotal`, `PaymentMode`) \
+                       VALUES (%s, (SELECT CURRENT_TIMESTAMP), %s, %s)"
+LINK_INVOICE_STMT = "UPDATE `Tokens` \
+                     SET `InvoiceID` = %s \
+                     WHERE `TokenID` = %s"
+INVOICE_PRODUCTS_STMT = "SELECT `ProductID`, `Name`, `SumQuantity`, `UnitPrice`, `SGST`, `CGST`, `CurrentDiscount` \
+                         FROM `Products` JOIN (SELECT `ProductID`, SUM(`Quantity`) AS `SumQuantity` \
+                                               FROM `TokensSelectProducts` \
+                                               WHERE `TokenID` IN (SELECT `TokenID` \
+                                                                   FROM `Tokens` \
+                                                                   WHERE `InvoiceID` = %s) \
+                                               GROUP BY `ProductID`) AS `ProductsQuantities` \
+                                         USING (`ProductID`)"
+INSERT_INVOICE_PRODUCTS_STMT = "INSERT INTO `ProductsInInvoices` \
+                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+CLEAR_TOKEN_STMT = "DELETE FROM `TokensSelectProducts` \
+                    WHERE `TokenID` = %s"
+INVOICE_EXISTS_STMT = "SELECT COUNT(*) \
+                       FROM `Invoices` \
+                       WHERE `InvoiceID` = %s"
+DISCOUNT_STMT = "UPDATE `Invoices` \
+                 SET `DiscountGiven` = %s \
+                 WHERE `InvoiceID` = %s"
+INVOICE_STMT = "SELECT * \
+                FROM `Invoices` \
+                WHERE `InvoiceID` = %s"
+INVOICE_DETAILS_STMT = "SELECT `ProductID`, `Name`, `Quantity`, `UnitPrice`, `SGST`, `CGST`, `Discount` \
+                        FROM `ProductsInInvoices` \
+                        WHERE `InvoiceID` = %s"
+INVOICES_BY_DATE_STMT = "SELECT `InvoiceID`, TIME(`InvoiceDate`), `InvoiceTotal`, `DiscountGiven`, `PaymentMode` \
+                         FROM `Invoices` \
+                         WHERE `InvoiceDate` >= CAST(%s AS DATE) AND `InvoiceDate` < CAST(%s AS DATE) + INTERVAL 1 DAY"
+
+# @brief This function returns the invoice id of a number of the sequence
+# @param number Integer id taken from the sequence (int)
+# @retval invoice_id InvoiceID (string)
+def format_invoice_id(number):
+    return "INV-" + format(number, "010d")
 
 # @brief This class is used to handle the invoice management in CMS
 # @note  There is not need to create an object of this class as all
@@ -21,18 +62,6 @@ class InvoiceManager:
     # @retval 3 Payment mode incorrect
     @staticmethod
     def __generate_invoice(pysql, token_ids, payment_mode):
-        # Get the global variables
-        global next_invoice_id
-        global next_invoice_id_read
-
-        # Read the next invoice id for once
-        if not next_invoice_id_read:
-            sql_stmt = "SELECT COUNT(*) \
-                        FROM `Invoices`"
-            pysql.run(sql_stmt)
-            next_invoice_id = pysql.scalar_result
-            next_invoice_id_read = 1
-
         # Check if tokens are all assigned and the total is not null
         invoice_has_products = 0
         invoice_total = 0
@@ -48,10 +77,7 @@ class InvoiceManager:
 
             if token_has_products:
                 # Update the total amount
-                sql_stmt = "SELECT SUM(`Quantity` * `UnitPrice` * (1 - `CurrentDiscount` / 100)) \
-                            FROM `TokensSelectProducts` JOIN `Products` USING (`ProductID`) \
-                            WHERE `TokenID` = %s"
-                pysql.run(sql_stmt, (token, ))
+                pysql.run(TOKEN_TOTAL_STMT, (token, ))
                 # Get the token total
                 token_total = pysql.scalar_result
                 invoice_total += token_total
@@ -64,55 +90,36 @@ class InvoiceManager:
             return 2
 
         # Check the payment mode
-        if payment_mode not in ["cash", "card", "wallet"]:
+        if payment_mode not in PAYMENT_MODES:
             return 3
 
         # Create an invoice id
-        invoice_id = "INV-" + format(next_invoice_id, "010d")
+        invoice_id = format_invoice_id(pysql.sequences.next_value("Invoices"))
 
         # Create an invoice
-        sql_stmt = "INSERT INTO `Invoices`(`InvoiceID`,`InvoiceDate`, `InvoiceTotal`, `PaymentMode`) \
-                    VALUES (%s, (SELECT CURRENT_TIMESTAMP), %s, %s)"
-        pysql.run(sql_stmt, (invoice_id, invoice_total, payment_mode))
+        pysql.run(INSERT_INVOICE_STMT, (invoice_id, invoice_total, payment_mode))
 
         # Link the invoice with each of the token ids
+        pysql.run_many(LINK_INVOICE_STMT, [(invoice_id, token) for token in token_ids])
         token_ids = [(token, ) for token in token_ids]
-        sql_stmt = "UPDATE `Tokens` \
-                    SET `InvoiceID` = '{}' \
-                    WHERE `TokenID` = %s".format(invoice_id)
-        pysql.run_many(sql_stmt, token_ids)
 
         # Add the invoice product details
-        sql_stmt = "SELECT `ProductID`, `Name`, `SumQuantity`, `UnitPrice`, `SGST`, `CGST`, `CurrentDiscount` \
-                    FROM `Products` JOIN (SELECT `ProductID`, SUM(`Quantity`) AS `SumQuantity` \
-                                          FROM `TokensSelectProducts` \
-                                          WHERE `TokenID` IN (SELECT `TokenID` \
-                                                              FROM `Tokens` \
-                                                              WHERE `InvoiceID` = %s) \
-                                          GROUP BY `ProductID`) AS `ProductsQuantities` \
-                                    USING (`ProductID`)"
-        pysql.run(sql_stmt, (invoice_id, ))
+        pysql.run(INVOICE_PRODUCTS_STMT, (invoice_id, ))
         invoice_details = pysql.result
 
         # Add these product details with the corresponding invoice
-        sql_stmt = "INSERT INTO `ProductsInInvoices` \
-                    VALUES ('{}', %s, %s, %s, %s, %s, %s, %s)".format(invoice_id)
-        pysql.run_many(sql_stmt, invoice_details)
+        pysql.run_many(INSERT_INVOICE_PRODUCTS_STMT, [(invoice_id, ) + tuple(details) for details in invoice_details])
+
+        # Reconcile the escrow slabs of the billed products once committed
+        if pysql.escrow is not None:
+            product_ids = [details[0] for details in invoice_details]
+            pysql.after_commit(lambda: pysql.escrow.reconcile(product_ids))
 
         # Make the assigned status false and make the invoice id null
-        sql_stmt = "UPDATE `Tokens` \
-                    SET `Assigned?` = false, \
-                        `InvoiceID` = NULL \
-                    WHERE `TokenID` = %s"
-        pysql.run_many(sql_stmt, token_ids)
+        pysql.run_many(PUT_TOKEN_STMT, token_ids)
 
         # Remove all the products selected by this token
-        sql_stmt = "DELETE FROM `TokensSelectProducts` \
-                    WHERE `TokenID` = %s"
-        pysql.run_many(sql_stmt, token_ids)
-
-        # Increment the global invoice id
-        next_invoice_id += 1
+        pysql.run_many(CLEAR_TOKEN_STMT, token_ids)
 
         # Return the invoice id
         return invoice_id
@@ -127,10 +134,7 @@ class InvoiceManager:
     @staticmethod
     def __give_additional_discount(pysql, invoice_id, discount):
         # Check if invoice exists
-        sql_stmt = "SELECT COUNT(*) \
-                    FROM `Invoices` \
-                    WHERE `InvoiceID` = %s"
-        pysql.run(sql_stmt, (invoice_id, ))
+        pysql.run(INVOICE_EXISTS_STMT, (invoice_id, ))
         invoice_present = pysql.scalar_result
 
         if not invoice_present:
@@ -141,10 +145,7 @@ class InvoiceManager:
             return 2
 
         # Update the discount value
-        sql_stmt = "UPDATE `Invoices` \
-                    SET `DiscountGiven` = %s \
-                    WHERE `InvoiceID` = %s"
-        pysql.run(sql_stmt, (discount, invoice_id))
+        pysql.run(DISCOUNT_STMT, (discount, invoice_id))
 
         return 0
 
@@ -155,17 +156,11 @@ class InvoiceManager:
     @staticmethod
     def __get_invoice_details(pysql, invoice_id):
         # Get the invoice parameters
-        sql_stmt = "SELECT * \
-                    FROM `Invoices` \
-                    WHERE `InvoiceID` = %s"
-        pysql.run(sql_stmt, (invoice_id, ))
+        pysql.run(INVOICE_STMT, (invoice_id, ))
         invoice_parameters = pysql.first_result
 
         # Get the invoice product details
-        sql_stmt = "SELECT `ProductID`, `Name`, `Quantity`, `UnitPrice`, `SGST`, `CGST`, `Discount` \
-                    FROM `ProductsInInvoices` \
-                    WHERE `InvoiceID` = %s"
-        pysql.run(sql_stmt, (invoice_id, ))
+        pysql.run(INVOICE_DETAILS_STMT, (invoice_id, ))
         invoice_details = pysql.result
 
         # Return the result
@@ -179,10 +174,7 @@ class InvoiceManager:
     @staticmethod
     def __get_invoices_by_date(pysql, date):
         # Get the invoice parameters on the specified date
-        sql_stmt = "SELECT `InvoiceID`, TIME(`InvoiceDate`), `InvoiceTotal`, `DiscountGiven`, `PaymentMode` \
-                    FROM `Invoices` \
-                    WHERE DATE(`InvoiceDate`) = %s"
-        pysql.run(sql_stmt, (date, ))
+        pysql.run(INVOICES_BY_DATE_STMT, (date, date))
 
         # Get the result invoice parameters
         invoices = pysql.result
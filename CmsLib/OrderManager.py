@@ -2,10 +2,8 @@
 from CmsLib.InventoryManager import *
 from CmsLib.ProductManager import *
 
-# This variable stores the next OrderID integer
-next_order_id = None
-# This variable indicates whether the next_order_id has been initialized
-next_order_id_read = 0
+# Highest number of order lines written by one INSERT statement
+MAX_ROWS_PER_STATEMENT = 1000
 
 # @brief This class is used to handle the order management in CMS
 # @note  There is not need to create an object of this class as all
@@ -21,47 +19,69 @@ class OrderManager:
     # @retval 2 One of the quantities was not positive
     @staticmethod
     def __place_order(pysql, products_quantities):
-        # Fetch the global variables
-        global next_order_id
-        global next_order_id_read
-
-        # Initialize the next order id
-        if not next_order_id_read:
-            sql_stmt = "SELECT COUNT(*) \
-                        FROM `Orders`"
-            pysql.run(sql_stmt)
-            next_order_id = pysql.scalar_result
-            next_order_id_read = 1
-
-        # Check for each product id and quantity
-        for product_id, quantity in products_quantities:
-            # Get the product existence status
-            product_exists = ProductManager._ProductManager__product_exists(pysql, product_id)
-            # If product not exists
-            if not product_exists:
-                return 1
-            # If quantity not positive
-            if quantity <= 0:
-                return 2
-
-        # Create the order id
-        order_id = "ORD-" + format(next_order_id, "010d")
-
-        # Create the new order
-        sql_stmt = "INSERT INTO `Orders` (`OrderID`, `OrderDate`) \
-                    VALUES (%s, (SELECT CURRENT_TIMESTAMP))"
-        pysql.run(sql_stmt, (order_id, ))
+        return OrderManager.__place_orders(pysql, [products_quantities])[0]
 
-        # Add the products for the order
-        sql_stmt = "INSERT INTO `OrdersOfProducts` \
-                    VALUES ('{}', %s, %s)".format(order_id)
-        pysql.run_many(sql_stmt, products_quantities)
+    # @brief This method places several orders at once, with a fixed number
+    #        of statements whatever the number of orders and lines
+    # @param pysql PySql object
+    # @param orders Products of each order, (ProductID, Quantity) (list of
+    #        lists of tuples)
+    # @retval results Result of each order (list)
+    #         order_id The OrderId (string)
+    #         1 One of the products not found
+    #         2 One of the quantities was not positive
+    # @note  The valid orders are placed even if some orders fail
+    @staticmethod
+    def __place_orders(pysql, orders):
+        # Get the products found among all the lines
+        product_ids = list({product_id for products_quantities in orders for product_id, _ in products_quantities})
+        found_products = set()
+        if product_ids:
+            sql_stmt = "SELECT `ProductID` \
+                        FROM `Products` \
+                        WHERE `ProductID` IN ({})".format(", ".join(["%s"] * len(product_ids)))
+            pysql.run(sql_stmt, product_ids)
+            found_products = {row[0] for row in pysql.result}
+
+        # Check each order, its lines in order
+        results = []
+        for products_quantities in orders:
+            result = 0
+            for product_id, quantity in products_quantities:
+                # If product not exists
+                if product_id not in found_products:
+                    result = 1
+                    break
+                # If quantity not positive
+                if quantity <= 0:
+                    result = 2
+                    break
+            results.append(result)
+
+        # Nothing is valid
+        valid = [i for i, result in enumerate(results) if result == 0]
+        if not valid:
+            return results
+
+        # Create the order ids
+        for i, order_id in zip(valid, pysql.sequences.next_values("Orders", len(valid))):
+            results[i] = "ORD-" + format(order_id, "010d")
+
+        # Create the new orders
+        sql_stmt = "INSERT INTO `Orders` (`OrderID`, `OrderDate`) \
+                    VALUES " + ", ".join(["(%s, CURRENT_TIMESTAMP)"] * len(valid))
+        pysql.run(sql_stmt, [results[i] for i in valid])
 
-        # Increment the global order id count
-        next_order_id += 1
+        # Add the products for the orders
+        lines = [(results[i], product_id, quantity) for i in valid for product_id, quantity in orders[i]]
+        for start in range(0, len(lines), MAX_ROWS_PER_STATEMENT):
+            chunk = lines[start:start + MAX_ROWS_PER_STATEMENT]
+            sql_stmt = "INSERT INTO `OrdersOfProducts` \
+                        VALUES " + ", ".join(["(%s, %s, %s)"] * len(chunk))
+            pysql.run(sql_stmt, [value for line in chunk for value in line])
 
-        # Return the currently created order id
-        return order_id
+        # Return the currently created order ids
+        return results
 
     # @brief This method gets the delivery status of the specified order
     # @param pysql PySql object
@@ -149,6 +169,16 @@ class OrderManager:
         pysql.run(sql_stmt, (order_id, ))
         quantities_products = pysql.result
 
+        # Get the products already in the inventory
+        product_ids = [product_id for _, product_id in quantities_products]
+        present_products = set()
+        if product_ids:
+            sql_stmt = "SELECT `ProductID` \
+                        FROM `Inventory` \
+                        WHERE `ProductID` IN ({})".format(", ".join(["%s"] * len(product_ids)))
+            pysql.run(sql_stmt, product_ids)
+            present_products = {row[0] for row in pysql.result}
+
         # Update the quantities of all the products that are already present
         sql_stmt = "UPDATE `Inventory` \
                     SET `StoredQuantity` = `StoredQuantity` + %s \
@@ -157,7 +187,7 @@ class OrderManager:
 
         # Insert the products in the inventory if not present by default
         # (set threshold to 10 percent of the order quantity)
-        sql_stmt = "INSERT INTO `Inventory` \
+        sql_stmt = "INSERT INTO `Inventory` (`ProductID`, `StoredQuantity`, `DisplayedQuantity`, `StoreThreshold`) \
                     (SELECT `ProductID`, `Quantity`, 0.0, `Quantity` * 0.1 \
                      FROM `OrdersOfProducts` \
                      WHERE `OrderID` = %s and `ProductID` NOT IN (SELECT `ProductID` \
@@ -171,8 +201,13 @@ class OrderManager:
         pysql.run(sql_stmt, (order_id, ))
 
         # Log the transactions
-        for quantity, product_id in quantities_products:
-            InventoryManager._InventoryManager__log_transaction(pysql, "INVENTORY_ADD", product_id, quantity)
+        InventoryManager._InventoryManager__buffer_transactions(pysql, [("INVENTORY_ADD", product_id, quantity)
+                                                                        for quantity, product_id in quantities_products])
+
+        # Notify the products restocked above their threshold
+        InventoryManager._InventoryManager__notify_low_stock(pysql, {product_id: quantity
+                                                                     for quantity, product_id in quantities_products
+                                                                     if product_id in present_products})
 
         return 0
 
@@ -221,10 +256,11 @@ class OrderManager:
     # @retval (OrderID, OrderDate, Delivered?, Cancelled?) (list of tuples)
     @staticmethod
     def __get_orders_between_date(pysql, start_date, end_date):
-        # Get all the orders between the given date
+        # Get all the orders between the given date (from the start of the
+        # first day up to the end of the last day)
         sql_stmt = "SELECT * \
                     FROM `Orders` \
-                    WHERE DATE(`OrderDate`) BETWEEN %s AND %s"
+                    WHERE `OrderDate` >= CAST(%s AS DATE) AND `OrderDate` < CAST(%s AS DATE) + INTERVAL 1 DAY"
         pysql.run(sql_stmt, (start_date, end_date))
 
         # Get the result
@@ -232,11 +268,61 @@ class OrderManager:
 
         return orders
 
+    # @brief This method returns a page of the orders in the order of their
+    #        ids, starting after the last order of the previous page (keyset
+    #        pagination, so every page costs the same)
+    # @param pysql PySql object
+    # @param after_id OrderID of the last row of the previous page (string,
+    #        None for the first page)
+    # @param page_size Number of orders in the page (int)
+    # @param status Only the orders "pending", "delivered" or "cancelled"
+    #        (string, None for all)
+    # @param product_id Only the orders of this product (string, None for all)
+    # @retval (orders, next_id) the (OrderID, OrderDate, Delivered?, Cancelled?)
+    #         of the page (list of tuples) and the after_id of the next page
+    #         (None on the last page)
+    @staticmethod
+    def __get_orders_page(pysql, after_id, page_size, status, product_id):
+        conditions = []
+        params = []
+        if after_id is not None:
+            conditions.append("`OrderID` > %s")
+            params.append(after_id)
+        if status == "pending":
+            conditions.append("`Delivered?` = 0 AND `Cancelled?` = 0")
+        elif status == "delivered":
+            conditions.append("`Delivered?` = 1")
+        elif status == "cancelled":
+            conditions.append("`Cancelled?` = 1")
+        if product_id is not None:
+            conditions.append("`OrderID` IN (SELECT `OrderID` FROM `OrdersOfProducts` WHERE `ProductID` = %s)")
+            params.append(product_id)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+        # Get one row more than the page to know if there is a next page
+        sql_stmt = "SELECT * \
+                    FROM `Orders` \
+                    " + where + " \
+                    ORDER BY `OrderID` \
+                    LIMIT %s"
+        pysql.run(sql_stmt, params + [page_size + 1])
+
+        # Get the result
+        orders = pysql.result
+        next_id = orders[page_size - 1][0] if len(orders) > page_size else None
+
+        return orders[:page_size], next_id
+
     # @ref __place_order
     @staticmethod
     def place_order(pysql, products_quantities):
         return pysql.run_transaction(OrderManager.__place_order,
                                      products_quantities)
+    # @ref __place_orders
+    @staticmethod
+    def place_orders(pysql, orders):
+        return pysql.run_transaction(OrderManager.__place_orders,
+                                     orders)
     # @ref __get_order_status
     @staticmethod
     def get_order_status(pysql, order_id):
@@ -260,6 +346,17 @@ class OrderManager:
         return pysql.run_transaction(OrderManager.__get_orders,
                                      commit = False)
 
+    # @brief This method returns all the orders one at a time without
+    #        loading all of them in memory
+    # @param pysql PySql object
+    # @param batch_size Number of rows fetched at a time (int)
+    # @retval (OrderID, OrderDate, Delivered?, Cancelled?) (generator of tuples)
+    @staticmethod
+    def stream_orders(pysql, batch_size = 1000):
+        sql_stmt = "SELECT * \
+                    FROM `Orders`"
+        return pysql.stream(sql_stmt, batch_size = batch_size)
+
     # @ref __get_order_details
     @staticmethod
     def get_order_details(pysql, order_id):
@@ -274,3 +371,13 @@ class OrderManager:
                                      start_date,
                                      end_date,
                                      commit = False)
+
+    # @ref __get_orders_page
+    @staticmethod
+    def get_orders_page(pysql, after_id = None, page_size = 50, status = None, product_id = None):
+        return pysql.run_transaction(OrderManager.__get_orders_page,
+                                     after_id,
+                                     page_size,
+                                     status,
+                                     product_id,
+                                     commit = False)
@@ -0,0 +1,145 @@
+# Import the required modules
+import datetime
+
+# Partitioned table of the inventory transactions
+TABLE = "InventoryTransactions"
+
+# @brief This function returns the first day of the month shifted by a
+#        number of months
+# @param day Date in the month (datetime.date)
+# @param months Number of months to shift (int, negative for the past)
+# @retval First day of the month (datetime.date)
+def month_start(day, months = 0):
+    month = day.year * 12 + day.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+# @brief This function returns the name of the partition of a month
+# @param start First day of the month (datetime.date)
+# @retval Partition name (string, e.g. p202611)
+def partition_name(start):
+    return "p" + start.strftime("%Y%m")
+
+# @brief This class is used to manage the monthly partitions of the
+#        InventoryTransactions table. Each month is a RANGE COLUMNS partition
+#        on Timestamp, between p_start (before the first month) and p_future
+#        (MAXVALUE), so the day and month reports only read the partitions
+#        of their range.
+# @note  There is not need to create an object of this class as all
+#        methods in this class are static. The partitions are changed with
+#        DDL statements, which commit on their own.
+class PartitionManager:
+
+    # @brief This method returns the partitions of InventoryTransactions
+    # @param pysql PySql object
+    # @retval (PartitionName, UpperBound, Rows) (list of tuples, the upper
+    #         bound is a datetime.date or None for MAXVALUE, the number of
+    #         rows is estimated)
+    @staticmethod
+    def __get_partitions(pysql):
+        sql_stmt = "SELECT `PARTITION_NAME`, `PARTITION_DESCRIPTION`, `TABLE_ROWS` \
+                    FROM `information_schema`.`PARTITIONS` \
+                    WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s \
+                    ORDER BY `PARTITION_ORDINAL_POSITION`"
+        pysql.run(sql_stmt, (TABLE, ))
+
+        partitions = []
+        for name, description, rows in pysql.result:
+            # The bounds are quoted datetimes, e.g. '2026-11-01 00:00:00'
+            bound = None if description in (None, "MAXVALUE") else datetime.date.fromisoformat(description.strip("'")[:10])
+            partitions.append((name, bound, rows))
+
+        return partitions
+
+    # @brief This method creates the monthly partitions up to a number of
+    #        months ahead, splitting them out of p_future (and starting from
+    #        the oldest row of p_future when there are no monthly partitions)
+    # @param pysql PySql object
+    # @param months_ahead Number of months after the current one (int)
+    # @retval Names of the partitions created (list of strings)
+    @staticmethod
+    def __create_partitions(pysql, months_ahead):
+        partitions = PartitionManager.__get_partitions(pysql)
+
+        # Check if the table is partitioned
+        if not partitions or partitions[0][0] is None:
+            return []
+
+        # First month not covered by a monthly partition
+        bounds = [bound for _, bound, _ in partitions if bound is not None]
+        start = max(bounds) if bounds else None
+        if len(bounds) <= 1:
+            # Only p_start, begin at the oldest row already in p_future
+            sql_stmt = "SELECT MIN(`Timestamp`) \
+                        FROM `InventoryTransactions` PARTITION (`p_future`)"
+            pysql.run(sql_stmt)
+            oldest = pysql.scalar_result
+            start = month_start(oldest.date() if oldest else datetime.date.today())
+
+        # Months from the first one not covered up to the last one required
+        end = month_start(datetime.date.today(), months_ahead + 1)
+        months = []
+        while start < end:
+            months.append(start)
+            start = month_start(start, 1)
+
+        if not months:
+            return []
+
+        # Split the new months out of p_future
+        definitions = ["PARTITION `{}` VALUES LESS THAN ('{}')".format(partition_name(month), month_start(month, 1))
+                       for month in months]
+        definitions.append("PARTITION `p_future` VALUES LESS THAN (MAXVALUE)")
+        pysql.run("ALTER TABLE `InventoryTransactions` \
+                   REORGANIZE PARTITION `p_future` INTO ({})".format(", ".join(definitions)))
+
+        return [partition_name(month) for month in months]
+
+    # @brief This method detaches the monthly partitions older than a number
+    #        of months, moving their rows to an archive table per month
+    #        (InventoryTransactions_YYYYMM) or dropping them
+    # @param pysql PySql object
+    # @param keep_months Number of months kept, including the current one (int)
+    # @param archive Boolean to specify whether to keep the rows in an
+    #        archive table
+    # @retval Names of the partitions detached (list of strings)
+    @staticmethod
+    def __archive_partitions(pysql, keep_months, archive):
+        cutoff = month_start(datetime.date.today(), 1 - keep_months)
+        detached = []
+
+        for name, bound, _ in PartitionManager.__get_partitions(pysql):
+            # Keep p_start, p_future and the recent months
+            if name in ("p_start", "p_future") or bound is None or bound > cutoff:
+                continue
+
+            if archive:
+                # Swap the partition with an empty table of the same structure
+                archive_table = "`InventoryTransactions_{}`".format(name[1:])
+                pysql.run("CREATE TABLE " + archive_table + " LIKE `InventoryTransactions`")
+                pysql.run("ALTER TABLE " + archive_table + " REMOVE PARTITIONING")
+                pysql.run("ALTER TABLE `InventoryTransactions` \
+                           EXCHANGE PARTITION `{}` WITH TABLE {}".format(name, archive_table))
+
+            pysql.run("ALTER TABLE `InventoryTransactions` DROP PARTITION `{}`".format(name))
+            detached.append(name)
+
+        return detached
+
+    # @ref __get_partitions
+    @staticmethod
+    def get_partitions(pysql):
+        return pysql.run_transaction(PartitionManager.__get_partitions,
+                                     commit = False)
+
+    # @ref __create_partitions
+    @staticmethod
+    def create_partitions(pysql, months_ahead = 3):
+        return pysql.run_transaction(PartitionManager.__create_partitions,
+                                     months_ahead)
+
+    # @ref __archive_partitions
+    @staticmethod
+    def archive_partitions(pysql, keep_months = 24, archive = True):
+        return pysql.run_transaction(PartitionManager.__archive_partitions,
+                                     keep_months,
+                                     archive)
@@ -0,0 +1,291 @@
+# Import the required modules
+import threading
+import time
+
+# @brief This class is the snapshot of the Products table held by the
+#        ProductCatalog (never changed once loaded)
+class CatalogSnapshot:
+
+    # @brief This method initializes the CatalogSnapshot object
+    # @param version Version of the catalog (int)
+    # @param products (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    def __init__(self, version, products):
+        self.version = version
+        self.products = products
+        self.by_id = {product[0]: product for product in products}
+        self.by_name = {product[1]: product for product in products}
+
+    # @brief This method returns a product from its ProductID
+    # @param product_id ProductID (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    def product(self, product_id):
+        return self.by_id.get(product_id)
+
+    # @brief This method returns a product from its name
+    # @param name Product name (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    def product_by_name(self, name):
+        return self.by_name.get(name)
+
+# @brief This class caches the Products table in the process so that the
+#        pages and the order checks do not read the whole table on every
+#        request. Every change of the products bumps the row "Products" of
+#        CatalogVersion in the same transaction, so a worker finds out
+#        that its snapshot is stale with one primary key read.
+# @note  The snapshot is loaded on first use and dropped when a transaction
+#        of the process which changed the products commits. The version is
+#        checked at most every check_interval seconds (and on every lookup
+#        which misses, so a product added by another worker is always
+#        found). The transactions which changed the products read the
+#        table directly until they end. When the PySql object has a
+#        SharedCatalog, the snapshot is kept there instead, once for all
+#        the workers of the host, and the process which changed the
+#        products publishes it after the commit. After a change committed by
+#        the process, the catalog is read from the primary until a snapshot
+#        of that version is loaded, as a lagging read replica would still
+#        return the catalog before the change.
+class ProductCatalog:
+
+    # @brief This method initializes the ProductCatalog object
+    # @param check_interval Seconds during which the snapshot is used
+    #        without checking the version (float)
+    def __init__(self, check_interval = 1.0):
+        self.check_interval = check_interval
+        # Current snapshot (None if not loaded)
+        self.__snapshot = None
+        # Time at which the version was last checked
+        self.__checked_at = None
+        # Version of the last change committed by the process
+        self.__min_version = 0
+        # Number of uncommitted changes of the products by each thread
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__stats = {"hits": 0, "loads": 0, "checks": 0}
+
+    # @brief This method runs a read in the transaction of the thread or in
+    #        a read only transaction of its own
+    # @param pysql PySql object
+    # @param function Function called with the pysql object
+    # @param primary Boolean to read from the primary instead of a replica
+    # @retval Return value of the function
+    @staticmethod
+    def __run(pysql, function, primary = False):
+        if pysql.in_transaction:
+            return function(pysql)
+        return pysql.run_transaction(function, commit = primary)
+
+    # @brief This method returns the version of the catalog
+    # @param pysql PySql object in a transaction
+    # @retval version Version (int)
+    @staticmethod
+    def __get_version(pysql):
+        sql_stmt = "SELECT `Version` \
+                    FROM `CatalogVersion` \
+                    WHERE `CatalogName` = 'Products'"
+        pysql.run(sql_stmt)
+        return pysql.scalar_result
+
+    # @brief This method reads the snapshot of the catalog
+    # @param pysql PySql object in a transaction
+    # @retval snapshot CatalogSnapshot object
+    @staticmethod
+    def __load(pysql):
+        # The version and the rows are read in the same transaction, so they
+        # belong to the same state of the table
+        version = ProductCatalog.__get_version(pysql)
+        sql_stmt = "SELECT * \
+                    FROM `Products` \
+                    ORDER BY `ProductID`"
+        pysql.run(sql_stmt)
+        return CatalogSnapshot(version, pysql.result)
+
+    # @brief This method reads one product from the table
+    # @param pysql PySql object in a transaction
+    # @param column Column searched, ProductID or Name (string)
+    # @param value Value searched (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    @staticmethod
+    def __find(pysql, column, value):
+        sql_stmt = "SELECT * \
+                    FROM `Products` \
+                    WHERE `{}` = %s".format(column)
+        pysql.run(sql_stmt, (value, ))
+        return pysql.first_result
+
+    # @brief This method tells if the transaction of the current thread has
+    #        changed the products
+    def __changing(self):
+        return getattr(self.__local, 'changes', 0) > 0
+
+    # @brief This method returns a current snapshot of the catalog
+    # @param pysql PySql object
+    # @param check Boolean to check the version even if it was checked less
+    #        than check_interval seconds ago
+    # @retval snapshot CatalogSnapshot object
+    def snapshot(self, pysql, check = False):
+        # Read the table as changed by the transaction of the thread
+        if self.__changing():
+            return ProductCatalog.__load(pysql)
+
+        # Use the catalog shared by the workers of the host if configured
+        shared = getattr(pysql, 'shared_catalog', None)
+        if shared is not None:
+            return self.__shared_snapshot(pysql, shared, check)
+
+        with self.__lock:
+            snapshot, checked_at, min_version = self.__snapshot, self.__checked_at, self.__min_version
+
+        now = time.monotonic()
+        if snapshot is not None and not check and now - checked_at < self.check_interval:
+            with self.__lock:
+                self.__stats["hits"] += 1
+            return snapshot
+
+        # Read from the primary until the last local change is loaded
+        primary = min_version > (snapshot.version if snapshot is not None else 0)
+
+        # Check the version of the snapshot (a replica behind the snapshot
+        # does not make it stale)
+        if snapshot is not None:
+            version = ProductCatalog.__run(pysql, ProductCatalog.__get_version, primary)
+            with self.__lock:
+                self.__stats["checks"] += 1
+                if version <= snapshot.version:
+                    self.__checked_at = now
+                    return snapshot
+
+        # Load the catalog again
+        snapshot = ProductCatalog.__run(pysql, ProductCatalog.__load, primary)
+        with self.__lock:
+            self.__stats["loads"] += 1
+            # Keep a newer snapshot loaded meanwhile by another thread
+            if self.__snapshot is None or self.__snapshot.version <= snapshot.version:
+                self.__snapshot, self.__checked_at = snapshot, now
+        return snapshot
+
+    # @brief This method returns the shared catalog, published again first
+    #        if it is older than the version of the database
+    # @param pysql PySql object
+    # @param shared SharedCatalog object
+    # @param check Boolean to check the version even if it was checked less
+    #        than check_interval seconds ago
+    # @retval shared SharedCatalog object
+    def __shared_snapshot(self, pysql, shared, check):
+        with self.__lock:
+            checked_at = self.__checked_at
+
+        now = time.monotonic()
+        if not check and checked_at is not None and now - checked_at < self.check_interval:
+            with self.__lock:
+                self.__stats["hits"] += 1
+            return shared
+
+        # Check the version of the shared catalog
+        version = ProductCatalog.__run(pysql, ProductCatalog.__get_version)
+        with self.__lock:
+            self.__stats["checks"] += 1
+        published = shared.version
+        if published is None or published < version:
+            self.__publish(pysql, shared, ProductCatalog.__run(pysql, ProductCatalog.__load))
+
+        with self.__lock:
+            self.__checked_at = now
+        return shared
+
+    # @brief This method publishes a snapshot to the shared catalog
+    # @param pysql PySql object
+    # @param shared SharedCatalog object
+    # @param snapshot CatalogSnapshot object
+    def __publish(self, pysql, shared, snapshot):
+        shared.publish(snapshot.version, snapshot.products)
+        with self.__lock:
+            self.__stats["loads"] += 1
+
+    # @brief This method returns all the products
+    # @param pysql PySql object
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    def products(self, pysql):
+        return self.snapshot(pysql).products
+
+    # @brief This method returns a product from its ProductID
+    # @param pysql PySql object
+    # @param product_id ProductID (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    def product(self, pysql, product_id):
+        if self.__changing():
+            return ProductCatalog.__find(pysql, "ProductID", product_id)
+
+        product = self.snapshot(pysql).product(product_id)
+        if product is None:
+            # Check that the product was not added since the last check
+            product = self.snapshot(pysql, check = True).product(product_id)
+        return product
+
+    # @brief This method returns a product from its name
+    # @param pysql PySql object
+    # @param name Product name (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    def product_by_name(self, pysql, name):
+        if self.__changing():
+            return ProductCatalog.__find(pysql, "Name", name)
+
+        product = self.snapshot(pysql).product_by_name(name)
+        if product is None:
+            product = self.snapshot(pysql, check = True).product_by_name(name)
+        return product
+
+    # @brief This method bumps the version of the catalog in the current
+    #        transaction, which changed the products
+    # @param pysql PySql object in a transaction
+    def changed(self, pysql):
+        sql_stmt = "UPDATE `CatalogVersion` \
+                    SET `Version` = `Version` + 1 \
+                    WHERE `CatalogName` = 'Products'"
+        pysql.run(sql_stmt)
+        version = ProductCatalog.__get_version(pysql)
+
+        # Read the table directly until the transaction ends, and drop the
+        # snapshot once the change is committed
+        self.__local.changes = getattr(self.__local, 'changes', 0) + 1
+        pysql.after_commit(lambda: self.__committed(pysql, version))
+        pysql.after_rollback(self.__rolled_back)
+
+    # @brief This method drops the snapshot after a change was committed,
+    #        and publishes the change to the shared catalog if configured
+    # @param pysql PySql object
+    # @param version Version of the catalog with the change (int)
+    def __committed(self, pysql, version):
+        self.__local.changes -= 1
+        with self.__lock:
+            self.__min_version = max(self.__min_version, version)
+        self.invalidate()
+
+        shared = getattr(pysql, 'shared_catalog', None)
+        if shared is not None:
+            # Read the change from the primary (not from a replica)
+            self.__publish(pysql, shared, pysql.run_transaction(ProductCatalog.__load))
+
+    # @brief This method forgets a change which was rolled back
+    def __rolled_back(self):
+        self.__local.changes -= 1
+
+    # @brief This method drops the snapshot so that it is loaded again on
+    #        the next use
+    def invalidate(self):
+        with self.__lock:
+            self.__snapshot = None
+            self.__checked_at = None
+
+    # @brief This method returns the cache metrics
+    # @retval stats {"hits", "loads", "checks", "version", "products"} (dict)
+    def stats(self):
+        with self.__lock:
+            snapshot = self.__snapshot
+            return dict(self.__stats,
+                        version = snapshot.version if snapshot else None,
+                        products = len(snapshot.products) if snapshot else 0)
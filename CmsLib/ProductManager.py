@@ -1,3 +1,35 @@
+# Import the required modules
+from CmsLib.ProductCatalog import ProductCatalog
+from CmsLib.ProductSearch import ProductSearch
+import csv
+import itertools
+import re
+import time
+
+# Cache of the Products table of the process
+product_catalog = ProductCatalog()
+
+# Search index of the product names, built from the catalog
+product_search = ProductSearch(product_catalog)
+
+# Reasons of the rows rejected by the bulk imports, by return code of the
+# product checks
+IMPORT_ERRORS = {1: "Product ID not valid",
+                 2: "Unit price not positive",
+                 3: "Unit type not valid",
+                 4: "SGST and CGST not valid",
+                 5: "Current discount not valid",
+                 6: "Product not found",
+                 7: "Name already used by another product",
+                 8: "Unit price too large",
+                 9: "Name or description too long"}
+
+# Largest values of the columns of Products (UnitPrice NUMERIC(9, 3), SGST,
+# CGST and CurrentDiscount NUMERIC(4, 2), Name and Description VARCHAR(64))
+MAX_UNIT_PRICE = 999999.999
+MAX_PERCENTAGE = 99.99
+MAX_TEXT_LENGTH = 64
+
 # @brief This class is used to handle the product management in CMS
 # @note  There is not need to create an object of this class as all
 #        methods in this class are static
@@ -29,6 +61,39 @@ class ProductManager:
         if product_exists:
             return 1
 
+        # Check the product details
+        retval = ProductManager.__check_product(unit_price, unit_type, sgst, cgst, discount)
+        if retval:
+            return retval
+
+        # Check if discount is specified
+        if discount:
+            sql_stmt = "INSERT INTO `Products` \
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+            pysql.run(sql_stmt, (product_id, name, description, unit_price, unit_type, sgst, cgst, discount))
+        else:
+            sql_stmt = "INSERT INTO `Products` (`ProductID`, `Name`, `Description`, `UnitPrice`, `UnitType`, `SGST`, `CGST`) \
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)"
+            pysql.run(sql_stmt, (product_id, name, description, unit_price, unit_type, sgst, cgst))
+
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
+        return 0
+
+    # @brief This method checks the details of a product added or imported
+    # @param unit_price Price per unit (float)
+    # @param unit_type Type of units (enum string)
+    # @param sgst SGST
+    # @param cgst CGST
+    # @param discount Discount in percentage (float)
+    # @retval 0 Details valid
+    # @retval 2 Unit price not positive
+    # @retval 3 Unit type not valid
+    # @retval 4 SGST and CGST not valid
+    # @retval 5 Current discount not valid
+    @staticmethod
+    def __check_product(unit_price, unit_type, sgst, cgst, discount):
         # Check if unit price is positive
         if unit_price <= 0:
             return 2
@@ -47,16 +112,6 @@ class ProductManager:
         if discount and discount < 0:
             return 5
 
-        # Check if discount is specified
-        if discount:
-            sql_stmt = "INSERT INTO `Products` \
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-            pysql.run(sql_stmt, (product_id, name, description, unit_price, unit_type, sgst, cgst, discount))
-        else:
-            sql_stmt = "INSERT INTO `Products` (`ProductID`, `Name`, `Description`, `UnitPrice`, `UnitType`, `SGST`, `CGST`) \
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)"
-            pysql.run(sql_stmt, (product_id, name, description, unit_price, unit_type, sgst, cgst))
-
         return 0
 
     # @brief This method updates the discount percentage of the product
@@ -85,6 +140,9 @@ class ProductManager:
                     WHERE `ProductID` = %s"
         pysql.run(sql_stmt, (discount, product_id))
 
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
         return 0
 
     # @brief This method updates the discount percentage of the product
@@ -113,6 +171,9 @@ class ProductManager:
                     WHERE `ProductID` = %s"
         pysql.run(sql_stmt, (price, product_id))
 
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
         return 0
 
     # @brief This method updates the discount percentage of the product
@@ -136,6 +197,9 @@ class ProductManager:
                     WHERE `ProductID` = %s"
         pysql.run(sql_stmt, (description, product_id))
 
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
         return 0
 
     # @brief This method updates the sgst and cgst
@@ -168,8 +232,208 @@ class ProductManager:
                     WHERE `ProductID` = %s"
         pysql.run(sql_stmt, (sgst, cgst, product_id))
 
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
         return 0
 
+    # @brief This method adds or updates a chunk of imported products with
+    #        one multi-row statement
+    # @param pysql PySql object
+    # @param products (line number, (ProductID, Name, Description, UnitPrice,
+    #        UnitType, SGST, CGST, CurrentDiscount)) (list of tuples), where a
+    #        CurrentDiscount of None keeps the discount of the product
+    # @retval (line number, reason) of the rows rejected (list of tuples)
+    # @note  The names are checked first, as a name used by another product
+    #        would make ON DUPLICATE KEY UPDATE overwrite that product
+    @staticmethod
+    def __upsert_products(pysql, products):
+        # Get the products already holding the names
+        names = list({product[1] for _, product in products})
+        sql_stmt = "SELECT `Name`, `ProductID` \
+                    FROM `Products` \
+                    WHERE `Name` IN ({}) \
+                    FOR UPDATE".format(", ".join(["%s"] * len(names)))
+        pysql.run(sql_stmt, names)
+        owners = dict(pysql.result)
+
+        errors = []
+        rows = []
+        for line, product in products:
+            # Check if the name belongs to another product (in the table or
+            # earlier in the chunk)
+            if owners.setdefault(product[1], product[0]) != product[0]:
+                errors.append((line, IMPORT_ERRORS[7]))
+            else:
+                rows.append(product)
+        if not rows:
+            return errors
+
+        # The rows without a discount keep the current discount of the
+        # product, so the runs of rows with and without one are written by
+        # statements of their own (in the order of the file)
+        for has_discount, run in itertools.groupby(rows, lambda row: row[7] is not None):
+            run = [row if has_discount else row[:7] for row in run]
+            ProductManager.__write_products(pysql, run, has_discount)
+
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
+        return errors
+
+    # @brief This method adds or updates products with one multi-row statement
+    # @param pysql PySql object
+    # @param rows (ProductID, Name, Description, UnitPrice, UnitType, SGST,
+    #        CGST[, CurrentDiscount]) (list of tuples)
+    # @param has_discount True if the rows set CurrentDiscount (bool)
+    @staticmethod
+    def __write_products(pysql, rows, has_discount):
+        columns = ["ProductID", "Name", "Description", "UnitPrice", "UnitType", "SGST", "CGST"]
+        if has_discount:
+            columns.append("CurrentDiscount")
+
+        sql_stmt = "INSERT INTO `Products` ({}) \
+                    VALUES {} \
+                    ON DUPLICATE KEY UPDATE {}".format(", ".join("`{}`".format(column) for column in columns),
+                                                       ", ".join(["({})".format(", ".join(["%s"] * len(columns)))] * len(rows)),
+                                                       ", ".join("`{0}` = VALUES(`{0}`)".format(column) for column in columns[1:]))
+        pysql.run(sql_stmt, [value for row in rows for value in row])
+
+    # @brief This method updates the unit prices of a chunk of products of a
+    #        price list with one statement
+    # @param pysql PySql object
+    # @param prices (line number, (ProductID, UnitPrice)) (list of tuples)
+    # @retval (line number, reason) of the rows rejected (list of tuples)
+    @staticmethod
+    def __update_prices(pysql, prices):
+        # Get the products found
+        product_ids = list({product_id for _, (product_id, _) in prices})
+        sql_stmt = "SELECT `ProductID` \
+                    FROM `Products` \
+                    WHERE `ProductID` IN ({}) \
+                    FOR UPDATE".format(", ".join(["%s"] * len(product_ids)))
+        pysql.run(sql_stmt, product_ids)
+        found_products = {row[0] for row in pysql.result}
+
+        errors = [(line, IMPORT_ERRORS[6]) for line, (product_id, _) in prices if product_id not in found_products]
+        # The last price of a product in the chunk is kept
+        new_prices = {product_id: price for _, (product_id, price) in prices if product_id in found_products}
+        if not new_prices:
+            return errors
+
+        sql_stmt = "UPDATE `Products` \
+                    SET `UnitPrice` = CASE `ProductID` {} END \
+                    WHERE `ProductID` IN ({})".format(" ".join(["WHEN %s THEN %s"] * len(new_prices)),
+                                                     ", ".join(["%s"] * len(new_prices)))
+        pysql.run(sql_stmt, [value for item in new_prices.items() for value in item] + list(new_prices))
+
+        # Refresh the cached catalogs
+        product_catalog.changed(pysql)
+
+        return errors
+
+    # @brief This method streams the rows of a CSV file, checks them and
+    #        writes them in chunks (each in a transaction of its own)
+    # @param pysql PySql object
+    # @param lines Lines of the CSV file, with a header row (file or iterable
+    #        of strings)
+    # @param parse Function returning (row, error code) from a row (dict)
+    # @param write Manager method writing a chunk of rows
+    # @param chunk_size Number of rows written by one statement (int)
+    # @retval report {"rows", "written", "errors", "seconds", "rows_per_second"}
+    #         where errors are the (line number, reason) of the rows rejected
+    #         (dict)
+    @staticmethod
+    def __import_csv(pysql, lines, parse, write, chunk_size):
+        start = time.perf_counter()
+        report = {"rows": 0, "written": 0, "errors": []}
+        chunk = []
+
+        # Write a chunk and report its rejected rows
+        def flush():
+            errors = pysql.run_transaction(write, chunk)
+            report["written"] += len(chunk) - len(errors)
+            report["errors"] += errors
+            chunk.clear()
+
+        reader = csv.DictReader(lines)
+        for row in reader:
+            report["rows"] += 1
+            try:
+                values, retval = parse(row)
+            except (KeyError, TypeError, ValueError) as error:
+                values, retval = None, "Row not valid ({})".format(error)
+            if retval:
+                report["errors"].append((reader.line_num, IMPORT_ERRORS.get(retval, retval)))
+                continue
+
+            chunk.append((reader.line_num, values))
+            if len(chunk) == chunk_size:
+                flush()
+        if chunk:
+            flush()
+
+        report["errors"].sort()
+        report["seconds"] = time.perf_counter() - start
+        report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0
+        return report
+
+    # @brief This method parses and checks a row of a product list
+    # @param row {"ProductID", "Name", "Description", "UnitPrice", "UnitType",
+    #        "SGST", "CGST", "CurrentDiscount" (optional)} (dict)
+    # @retval (product, 0) The row of Products (tuple) when the row is valid
+    # @retval (None, error code) When the row is not valid
+    @staticmethod
+    def __parse_product(row):
+        product_id = row["ProductID"].strip()
+        name = row["Name"].strip()
+        if not re.match("^[A-Z]{3}-[0-9]{2}$", product_id) or not name:
+            return None, 1
+
+        description = row["Description"].strip() or None
+        if len(name) > MAX_TEXT_LENGTH or (description and len(description) > MAX_TEXT_LENGTH):
+            return None, 9
+
+        unit_price = float(row["UnitPrice"])
+        unit_type = row["UnitType"].strip()
+        sgst, cgst = float(row["SGST"]), float(row["CGST"])
+        # A missing or empty discount keeps the discount of the product
+        discount = row.get("CurrentDiscount")
+        discount = float(discount) if discount and discount.strip() else None
+
+        retval = ProductManager.__check_product(unit_price, unit_type, sgst, cgst, discount)
+        if retval:
+            return None, retval
+
+        # Check the values against the columns (rounded as MySQL stores them),
+        # as a value out of range would fail the statement of the whole chunk
+        if not round(unit_price, 3) <= MAX_UNIT_PRICE:
+            return None, 8
+        if not (round(sgst, 2) <= MAX_PERCENTAGE and round(cgst, 2) <= MAX_PERCENTAGE):
+            return None, 4
+        if discount is not None and not round(discount, 2) <= MAX_PERCENTAGE:
+            return None, 5
+
+        return (product_id, name, description, unit_price, unit_type, sgst, cgst, discount), 0
+
+    # @brief This method parses and checks a row of a price list
+    # @param row {"ProductID", "UnitPrice"} (dict)
+    # @retval ((ProductID, UnitPrice), 0) When the row is valid
+    # @retval (None, error code) When the row is not valid
+    @staticmethod
+    def __parse_price(row):
+        product_id = row["ProductID"].strip()
+        if not re.match("^[A-Z]{3}-[0-9]{2}$", product_id):
+            return None, 1
+
+        unit_price = float(row["UnitPrice"])
+        if unit_price <= 0:
+            return None, 2
+        if not round(unit_price, 3) <= MAX_UNIT_PRICE:
+            return None, 8
+
+        return (product_id, unit_price), 0
+
     # @brief This method checks if the given product is already
     #        present in the Products relation
     # @param pysql PySql object
@@ -178,14 +442,8 @@ class ProductManager:
     # @retval 1 The product already present
     @staticmethod
     def __product_exists(pysql, product_id):
-        # Get the product id of the given product
-        sql_stmt = "SELECT COUNT(*) \
-                    FROM `Products` \
-                    WHERE `ProductID` = %s"
-        pysql.run(sql_stmt, (product_id, ))
-
-        # Get the result
-        product_exists = pysql.scalar_result
+        # Look up the product in the catalog
+        product_exists = int(product_catalog.product(pysql, product_id) is not None)
 
         return product_exists
 
@@ -194,13 +452,8 @@ class ProductManager:
     # @retval (ProductID, Name, Description, UnitPrice, UnitType, CurrentDiscount) (list of tuples)
     @staticmethod
     def __get_all_products(pysql):
-        # Get the product id of the given product
-        sql_stmt = "SELECT * \
-                    FROM `Products`"
-        pysql.run(sql_stmt)
-
-        # Get the result
-        products = pysql.result
+        # Get the products from the catalog
+        products = product_catalog.products(pysql)
 
         return products
 
@@ -210,14 +463,9 @@ class ProductManager:
     # @retval ProductID
     @staticmethod
     def __get_product_id_from_name(pysql, name):
-        # Get the product id of the given product
-        sql_stmt = "SELECT `ProductID` \
-                    FROM `Products` \
-                    WHERE `Name` = %s"
-        pysql.run(sql_stmt, (name, ))
-
-        # Get the result
-        product_id = pysql.scalar_result
+        # Look up the product in the catalog
+        product = product_catalog.product_by_name(pysql, name)
+        product_id = product[0] if product else None
 
         return product_id
 
@@ -234,6 +482,39 @@ class ProductManager:
                                      cgst,
                                      discount)
 
+    # @brief This method adds or updates the products of a CSV product list
+    #        (columns ProductID, Name, Description, UnitPrice, UnitType, SGST,
+    #        CGST and optionally CurrentDiscount), checked like add_product
+    #        and against the sizes of the columns. A missing or empty
+    #        CurrentDiscount keeps the discount of the product (0 when new).
+    # @param pysql PySql object
+    # @param lines Lines of the CSV file (file or iterable of strings)
+    # @param chunk_size Number of products written by one statement (int)
+    # @retval report {"rows", "written", "errors", "seconds", "rows_per_second"} (dict)
+    # @note  Each chunk is written in a transaction of its own, so the chunks
+    #        before an error which stops the import stay written
+    @staticmethod
+    def import_products(pysql, lines, chunk_size = 500):
+        return ProductManager.__import_csv(pysql,
+                                           lines,
+                                           ProductManager.__parse_product,
+                                           ProductManager.__upsert_products,
+                                           chunk_size)
+
+    # @brief This method updates the unit prices of a CSV price list
+    #        (columns ProductID and UnitPrice)
+    # @param pysql PySql object
+    # @param lines Lines of the CSV file (file or iterable of strings)
+    # @param chunk_size Number of prices written by one statement (int)
+    # @retval report {"rows", "written", "errors", "seconds", "rows_per_second"} (dict)
+    @staticmethod
+    def import_prices(pysql, lines, chunk_size = 500):
+        return ProductManager.__import_csv(pysql,
+                                           lines,
+                                           ProductManager.__parse_price,
+                                           ProductManager.__update_prices,
+                                           chunk_size)
+
     # @ref __update_product_discount
     @staticmethod
     def update_product_discount(pysql, product_id, discount):
@@ -263,22 +544,40 @@ class ProductManager:
                                      sgst,
                                      cgst)
 
-    # @ref __is_product_id_used
+    # @ref __product_exists
+    # @note The catalog reads the database only when its snapshot is stale
     @staticmethod
     def product_exists(pysql, product_id):
-        return pysql.run_transaction(ProductManager.__product_exists,
-                                     product_id,
-                                     commit = False)
+        return ProductManager.__product_exists(pysql, product_id)
 
     # @ref __get_all_products
     @staticmethod
     def get_all_products(pysql):
-        return pysql.run_transaction(ProductManager.__get_all_products,
-                                     commit = False)
+        return ProductManager.__get_all_products(pysql)
+
+    # @brief This method returns all the products information one at a time
+    #        without loading all of them in memory
+    # @param pysql PySql object
+    # @param batch_size Number of rows fetched at a time (int)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (generator of tuples)
+    @staticmethod
+    def stream_all_products(pysql, batch_size = 1000):
+        sql_stmt = "SELECT * \
+                    FROM `Products`"
+        return pysql.stream(sql_stmt, batch_size = batch_size)
 
     # @ref __get_product_id_from_name
     @staticmethod
     def get_product_id_from_name(pysql, name):
-        return pysql.run_transaction(ProductManager.__get_product_id_from_name,
-                                     name,
-                                     commit = False)
+        return ProductManager.__get_product_id_from_name(pysql, name)
+
+    # @brief This method searches the products by name for the autocomplete,
+    #        the names or words of names starting with the query first and
+    #        then the closest names (by shared trigrams, so that typos match)
+    # @param pysql PySql object
+    # @param query Text typed (string)
+    # @param limit Highest number of products (int)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    @staticmethod
+    def search_products(pysql, query, limit = 10):
+        return product_search.search(pysql, query, limit)
@@ -0,0 +1,171 @@
+# Import the required modules
+import bisect
+import collections
+import threading
+
+# Smallest share of trigrams (Jaccard) of a fuzzy match
+MIN_SIMILARITY = 0.3
+
+# @brief This function returns the trigrams of a text, padded so that the
+#        words also match on their first and last letters
+# @param text Lower case text (string)
+# @retval Trigrams (set of strings)
+def trigrams(text):
+    trigrams = set()
+    for word in text.split():
+        word = "  " + word + " "
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+# @brief This class is the search index of one version of the product
+#        catalog (never changed once built). The names are indexed by their
+#        lower case keys sorted for the prefix lookups (the whole name and
+#        every word of it), and by their trigrams for the fuzzy lookups.
+class SearchIndex:
+
+    # @brief This method builds the SearchIndex object
+    # @param version Version of the catalog (int)
+    # @param products (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    def __init__(self, version, products):
+        self.version = version
+        self.products = sorted(products, key = lambda product: product[1].lower())
+
+        # (key, product number) of the names and of the words of the names
+        keys = []
+        # Product numbers of each trigram
+        self.postings = collections.defaultdict(list)
+        # Number of trigrams of each name
+        self.sizes = []
+        for number, product in enumerate(self.products):
+            name = product[1].lower()
+            keys.append((name, number))
+            words = name.split()
+            keys += [(" ".join(words[start:]), number) for start in range(1, len(words))]
+            name_trigrams = trigrams(name)
+            for trigram in name_trigrams:
+                self.postings[trigram].append(number)
+            self.sizes.append(len(name_trigrams))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.numbers = [number for _, number in keys]
+
+    # @brief This method returns the products whose name or a word of the
+    #        name starts with the query, the names starting with it first
+    # @param query Lower case query (string)
+    # @param limit Highest number of products (int)
+    # @retval Product numbers (list of ints)
+    def __prefix(self, query, limit):
+        # The whole names sort with their words, so collect the matching
+        # range and put the names starting with the query first
+        names, words = [], []
+        seen = set()
+        start = bisect.bisect_left(self.keys, query)
+        for position in range(start, len(self.keys)):
+            key = self.keys[position]
+            if not key.startswith(query):
+                break
+            number = self.numbers[position]
+            if number in seen:
+                continue
+            seen.add(number)
+            if self.products[number][1].lower().startswith(query):
+                names.append(number)
+                if len(names) == limit:
+                    break
+            else:
+                words.append(number)
+        return (sorted(names) + sorted(words))[:limit]
+
+    # @brief This method returns the products whose name shares the most
+    #        trigrams with the query
+    # @param query Lower case query (string)
+    # @param limit Highest number of products (int)
+    # @param exclude Product numbers already found (set of ints)
+    # @retval Product numbers, the most similar first (list of ints)
+    def __fuzzy(self, query, limit, exclude):
+        query_trigrams = trigrams(query)
+        shared = collections.Counter()
+        for trigram in query_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+
+        scores = []
+        for number, count in shared.items():
+            if number in exclude:
+                continue
+            similarity = count / (len(query_trigrams) + self.sizes[number] - count)
+            if similarity >= MIN_SIMILARITY:
+                scores.append((-similarity, number))
+        scores.sort()
+        return [number for _, number in scores[:limit]]
+
+    # @brief This method searches the products by name, the prefix matches
+    #        first and then the closest fuzzy matches
+    # @param query Text typed (string)
+    # @param limit Highest number of products (int)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    def search(self, query, limit = 10):
+        query = " ".join(query.lower().split())
+        if not query or limit <= 0:
+            return []
+
+        numbers = self.__prefix(query, limit)
+        if len(numbers) < limit:
+            numbers += self.__fuzzy(query, limit - len(numbers), set(numbers))
+        return [self.products[number] for number in numbers]
+
+# @brief This class keeps the SearchIndex of a ProductCatalog in step with
+#        the catalog, building it again when the version of the catalog
+#        changes
+# @note  The index is built from the snapshot of the catalog (or from the
+#        shared catalog), so it is checked against the database as often as
+#        the catalog and costs nothing more per lookup.
+class ProductSearch:
+
+    # @brief This method initializes the ProductSearch object
+    # @param catalog ProductCatalog object
+    def __init__(self, catalog):
+        self.catalog = catalog
+        # Current index (None if not built)
+        self.__index = None
+        self.__lock = threading.Lock()
+        self.__stats = {"searches": 0, "builds": 0}
+
+    # @brief This method returns the index of the current catalog
+    # @param pysql PySql object
+    # @retval index SearchIndex object
+    def index(self, pysql):
+        snapshot = self.catalog.snapshot(pysql)
+        # Read the version first, a newer set of products is indexed again
+        # on the next lookup
+        version = snapshot.version
+        with self.__lock:
+            index = self.__index
+        if index is not None and index.version == version:
+            return index
+
+        index = SearchIndex(version, snapshot.products)
+        with self.__lock:
+            self.__stats["builds"] += 1
+            if self.__index is None or self.__index.version <= version:
+                self.__index = index
+        return index
+
+    # @brief This method searches the products by name
+    # @param pysql PySql object
+    # @param query Text typed (string)
+    # @param limit Highest number of products (int)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    def search(self, pysql, query, limit = 10):
+        products = self.index(pysql).search(query, limit)
+        with self.__lock:
+            self.__stats["searches"] += 1
+        return products
+
+    # @brief This method returns the index metrics
+    # @retval stats {"searches", "builds", "version", "products"} (dict)
+    def stats(self):
+        with self.__lock:
+            index = self.__index
+            return dict(self.__stats,
+                        version = index.version if index else None,
+                        products = len(index.products) if index else 0)
@@ -1,65 +1,306 @@
 # Import the required modules
-from flask_mysqldb import MySQL
+from CmsLib.ConnectionPool import ConnectionPool
+from CmsLib.InventoryEscrow import InventoryEscrow
+from CmsLib.QueryMetrics import QueryMetrics, fingerprint, format_sample, statement_hash
+from CmsLib.ReplicaRouter import ReplicaRouter
+from CmsLib.SequenceAllocator import SequenceAllocator
+from CmsLib.SharedCatalog import SharedCatalog
+from CmsLib.StatementCache import StatementCache
+from CmsLib.TransactionLogBuffer import TransactionLogBuffer
+import contextlib
+import logging
+import MySQLdb
+import MySQLdb.cursors
+import random
+import threading
+import time
 import yaml
-import sys
+
+# MySQL error codes after which the whole transaction can be run again
+# (lock wait timeout exceeded, deadlock found)
+RETRYABLE_ERRORS = (1205, 1213)
+# MySQL client error codes after which the connection cannot be reused
+# (server has gone away, lost connection)
+CONNECTION_ERRORS = (2006, 2013)
+
+# @brief This exception is raised when a transaction fails, it wraps the
+#        original error raised by the manager function or the database
+class TransactionError(Exception):
+
+    # @brief This method initializes the TransactionError object
+    # @param method Name of the manager method which failed (string)
+    # @param error The original exception
+    # @param retries Number of times the transaction was retried (int)
+    def __init__(self, method, error, retries):
+        super().__init__("{} failed after {} retries: {!r}".format(method, retries, error))
+        self.method = method
+        self.error = error
+        self.retries = retries
+
+# Logger of the errors raised by the commit and rollback hooks
+logger = logging.getLogger("CmsLib")
 
 # @brief This class can be used to connect python to sql and to run
 #        commands from python to make actual changes to the database
+# @note  The connections are taken from a bounded pool and the cursor is
+#        stored per thread, so one object can be shared by all the threads
+#        of a multi-threaded server or a batch script
 class PySql:
 
+    # Error raised by a statement which breaks a key or a constraint (so
+    # that the managers can catch it without importing the driver)
+    IntegrityError = MySQLdb.IntegrityError
+
     # @brief This method initializes the PySql object
-    # @param flask_app Flask object to be initialized
+    # @param flask_app Flask object to be initialized (None if not used)
     # @param path_to_yaml Path to the .yaml file
     def __init__(self, flask_app, path_to_yaml):
         # Load the yaml file
         db_details = yaml.load(open(path_to_yaml), Loader = yaml.FullLoader)
 
-        # Configure the flask object
-        flask_app.config['MYSQL_HOST'] = db_details['mysql_host']
-        flask_app.config['MYSQL_USER'] = db_details['mysql_user']
-        flask_app.config['MYSQL_PASSWORD'] = db_details['mysql_password']
-        flask_app.config['MYSQL_DB'] = db_details['mysql_db']
+        # Store the connection parameters
+        connect_args = {"host": db_details['mysql_host'],
+                        "user": db_details['mysql_user'],
+                        "passwd": db_details['mysql_password'],
+                        "db": db_details['mysql_db']}
+
+        # Create the connection pool of the primary
+        self.pool = PySql.__create_pool(connect_args, db_details)
+
+        # Create the connection pools of the read replicas (the connection
+        # parameters not given for a replica are the same as the primary)
+        replica_pools = {}
+        for replica in db_details.get('replicas') or []:
+            replica_args = dict(connect_args)
+            replica_args.update({"host": replica.get('mysql_host', connect_args['host']),
+                                 "user": replica.get('mysql_user', connect_args['user']),
+                                 "passwd": replica.get('mysql_password', connect_args['passwd']),
+                                 "db": replica.get('mysql_db', connect_args['db'])})
+            replica_pools[replica.get('name', replica_args['host'])] = PySql.__create_pool(replica_args, db_details)
+
+        # Create the allocator of the ids, with its own small pool so that a
+        # reservation never waits for the connections held by transactions
+        self.sequences = SequenceAllocator(PySql.__create_pool(connect_args, dict(db_details, pool_size = 2)),
+                                           block_size = db_details.get('sequence_block_size', 100))
+
+        # Store the retry policy
+        self.retry_limit = db_details.get('retry_limit', 3)
+        self.retry_backoff = db_details.get('retry_backoff', 0.05)
+        self.retry_backoff_max = db_details.get('retry_backoff_max', 1.0)
+
+        # Create the escrow of the hot products (optional), with its own
+        # small pool for the slab moves
+        self.escrow = None
+        escrow = db_details.get('escrow')
+        if escrow:
+            self.escrow = InventoryEscrow(PySql.__create_pool(connect_args, dict(db_details, pool_size = 2)),
+                                          escrow.get('products') or {},
+                                          shards = escrow.get('shards', 1),
+                                          refill_below = escrow.get('refill_below', 0.25),
+                                          holder = escrow.get('holder'),
+                                          retry_limit = self.retry_limit,
+                                          is_retryable = PySql.__is_retryable,
+                                          backoff = self.__backoff)
+
+        # Create the buffer of the inventory transactions logged (the
+        # background writer has a connection of its own)
+        transaction_log = db_details.get('transaction_log', 'commit')
+        self.transaction_log = TransactionLogBuffer(transaction_log,
+                                                    pool = PySql.__create_pool(connect_args, dict(db_details, pool_size = 1)) if transaction_log == 'background' else None,
+                                                    queue_size = db_details.get('transaction_log_queue_size', 1000))
 
-        # Create the mysql object
-        self.mysql = MySQL(flask_app)
-        # Set cursor to none
-        self.mysql_cursor = None
-        # Field to store the last select result
-        self.__last_result = None
+        # Map the product catalog shared by the workers of the host (optional)
+        self.shared_catalog = None
+        shared_catalog = db_details.get('shared_catalog')
+        if shared_catalog:
+            self.shared_catalog = SharedCatalog(shared_catalog['path'],
+                                                capacity = shared_catalog.get('capacity', 10000))
 
-    # @brief This function initializes the flask sql cursor
-    def init(self):
-        self.mysql_cursor = self.mysql.connection.cursor()
+        # Create the router of the read only transactions
+        self.replicas = None
+        if replica_pools:
+            self.replicas = ReplicaRouter(replica_pools,
+                                          max_lag = db_details.get('replica_max_lag', 5),
+                                          check_interval = db_details.get('replica_lag_check_interval', 1))
+
+        # Register the object with the flask application
+        if flask_app is not None:
+            flask_app.extensions['pysql'] = self
+
+        # Create the cache of the normalized statements
+        self.statements = StatementCache(db_details.get('statement_cache_size', 256))
+
+        # Create the query metrics (the slow query threshold is in ms)
+        slow_query_ms = db_details.get('slow_query_ms', 100)
+        self.metrics = QueryMetrics(slow_query_ms / 1000 if slow_query_ms is not None else None,
+                                    db_details.get('metrics_max_series', 500))
+
+        # Field to store the per thread connection, cursor and last result
+        self.__local = threading.local()
+
+        # Retries and failures per manager method
+        self.__retry_stats = {}
+        self.__retry_stats_lock = threading.Lock()
+
+    # @brief This method creates a connection pool
+    # @param connect_args Arguments of MySQLdb.connect (dict)
+    # @param db_details Details loaded from the .yaml file (dict)
+    # @retval ConnectionPool object
+    @staticmethod
+    def __create_pool(connect_args, db_details):
+        return ConnectionPool(lambda: MySQLdb.connect(**connect_args),
+                              max_size = db_details.get('pool_size', 8),
+                              max_idle = db_details.get('pool_max_idle', 300),
+                              max_lifetime = db_details.get('pool_max_lifetime', 3600),
+                              timeout = db_details.get('pool_timeout', 30))
+
+    # @brief This method checks out a connection from a replica within the
+    #        staleness bound for a read only transaction, or else from the
+    #        primary
+    # @param read_only Boolean to specify if only reads will be done
+    # @retval (pool, connection) The pool and the connection checked out
+    def __checkout(self, read_only):
+        if read_only and self.replicas is not None:
+            replica = self.replicas.choose()
+            if replica is not None:
+                name, pool = replica
+                try:
+                    return pool, pool.checkout()
+                except Exception:
+                    # Do not use the replica until it is measured again
+                    self.replicas.mark_failed(name)
+
+        return self.pool, self.pool.checkout()
+
+    # @brief This function checks out a connection and initializes the cursor
+    # @param read_only Boolean to specify if the connection can be taken
+    #        from a read replica
+    def init(self, read_only = False):
+        self.__local.pool, self.__local.connection = self.__checkout(read_only)
+        self.__local.cursor = self.__local.connection.cursor()
+        self.__local.last_result = None
+        # Manager method tagged on the statements run by this thread
+        self.__local.method = None
+        # Nesting depth of the transaction of this thread
+        self.__local.depth = 0
+        # Callbacks run before the transaction commits, and after it commits
+        # or rolls back
+        self.__local.before_commit = []
+        self.__local.on_commit = []
+        self.__local.on_rollback = []
+
+    # @brief This function closes the cursor and checks in the connection
+    # @param discard Boolean to specify whether the connection is broken
+    def deinit(self, discard = False):
+        try:
+            self.__local.cursor.close()
+        except MySQLdb.Error:
+            discard = True
+        self.__local.pool.checkin(self.__local.connection, discard)
+        self.__local.pool = None
+        self.__local.connection = None
+        self.__local.cursor = None
+        self.__local.depth = 0
 
-    # @brief This function deinitializes the flask sql cursor
-    def deinit(self):
-        self.mysql_cursor.close()
+    # @brief This method writes the queued transaction log, returns the
+    #        slabs of the escrow to the counter and closes all the pooled
+    #        connections
+    def close(self):
+        self.transaction_log.close()
+        if self.transaction_log.pool is not None:
+            self.transaction_log.pool.close()
+        if self.escrow is not None:
+            self.escrow.close()
+            self.escrow.pool.close()
+        if self.shared_catalog is not None:
+            self.shared_catalog.close()
+        self.pool.close()
+        self.sequences.pool.close()
+        if self.replicas is not None:
+            for pool in self.replicas.pools.values():
+                pool.close()
+
+    # @brief This property returns the cursor of the current thread
+    @property
+    def mysql_cursor(self):
+        return getattr(self.__local, 'cursor', None)
 
     # @brief This method executes a single sql query
     # @param sql_stmt The sql statement to be executed (string)
     # @param params The arguments for the sql_stmt (tuple)
     def run(self, sql_stmt, params = None):
+        sql_stmt = self.statements.get(sql_stmt, self.__local.method)
+        cursor = self.__local.cursor
+
         # Run the sql query
-        self.mysql_cursor.execute(sql_stmt, params)
+        start = time.perf_counter()
+        cursor.execute(sql_stmt, params)
+        self.metrics.observe(self.__local.method, sql_stmt, time.perf_counter() - start, cursor.rowcount, params)
 
     # @brief This method executes the same sql query for each of the parameter
     # @param sql_stmt The sql statement to be executed (string)
     # @param params The arguments for the sql_stmt (list of tuples)
     def run_many(self, sql_stmt, params):
+        sql_stmt = self.statements.get(sql_stmt, self.__local.method)
+        cursor = self.__local.cursor
+
         # Run the sql query
-        self.mysql_cursor.executemany(sql_stmt, params)
+        start = time.perf_counter()
+        cursor.executemany(sql_stmt, params)
+        self.metrics.observe(self.__local.method, sql_stmt, time.perf_counter() - start, cursor.rowcount)
+
+    # @brief This method runs a query with a server side cursor and returns
+    #        its rows one at a time, so that the memory used does not depend
+    #        on the size of the result
+    # @param sql_stmt The sql statement to be executed (string)
+    # @param params The arguments for the sql_stmt (tuple)
+    # @param batch_size Number of rows fetched from the server at a time (int)
+    # @retval rows Result rows (generator of tuples)
+    # @note  The query runs on its own pooled connection (outside of any
+    #        transaction of the thread, on a read replica if configured)
+    #        which is held until the generator is exhausted or closed
+    def stream(self, sql_stmt, params = None, batch_size = 1000):
+        sql_stmt = self.statements.get(sql_stmt, "PySql.stream")
+        pool, connection = self.__checkout(True)
+        # The connection is discarded if the rows are not all read, since
+        # the unread rows would otherwise have to be drained from the server
+        discard = True
+        rows = 0
+
+        try:
+            # Run the sql query
+            cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+            start = time.perf_counter()
+            cursor.execute(sql_stmt, params)
+            seconds = time.perf_counter() - start
+
+            # Yield the rows batch by batch
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows += len(batch)
+                yield from batch
+
+            # End the read only transaction
+            cursor.close()
+            connection.rollback()
+            discard = False
+            self.metrics.observe("PySql.stream", sql_stmt, seconds, rows, params)
+        finally:
+            pool.checkin(connection, discard)
 
     # @brief This method fetches the result of the previously ran sql query
     # @return last_result The result of the previously ran sql query
     def __result(self):
         try:
             # Fetch the result
-            self.__last_result = self.mysql_cursor.fetchall()
+            self.__local.last_result = self.__local.cursor.fetchall()
             # Save the result
-            return self.__last_result
-        except InterfaceError:
+            return self.__local.last_result
+        except MySQLdb.InterfaceError:
             # If result cannot be fetched then return the last result
-            return self.__last_result
+            return self.__local.last_result
 
     # @brief This property can be used as a normal field of the pysql object
     #        to get the result of a previous query
@@ -85,15 +326,285 @@ class PySql:
         except IndexError:
             return None
 
+    # @brief This property returns the number of rows changed (or matched
+    #        by a select) by the previous query
+    @property
+    def rowcount(self):
+        return self.__local.cursor.rowcount
+
     # @brief This method updates the remote database with the updates
     #        made to the local database
     def commit(self):
-         self.mysql.connection.commit()
+        self.__local.connection.commit()
 
     # @brief This method restores the local database with the remote
     #        database (hence ignoring any changes made to the local copy)
     def rollback(self):
-        self.mysql.connection.rollback()
+        self.__local.connection.rollback()
+
+    # @brief This method returns the name of the manager method for the
+    #        given function (e.g. CounterManager.add_counter_to_token)
+    # @param function Function object
+    # @retval name Method name (string)
+    @staticmethod
+    def method_name(function):
+        names = function.__qualname__.split(".")
+        names[-1] = names[-1].lstrip("_")
+        return ".".join(names)
+
+    # @brief This method checks if the transaction failed because of a
+    #        deadlock or a lock wait timeout and hence can be run again
+    # @param error The exception raised
+    # @retval True The transaction can be retried
+    @staticmethod
+    def __is_retryable(error):
+        return isinstance(error, MySQLdb.OperationalError) and len(error.args) > 0 and error.args[0] in RETRYABLE_ERRORS
+
+    # @brief This method checks if the connection is lost
+    # @param error The exception raised
+    # @retval True The connection must not be reused
+    @staticmethod
+    def __is_connection_error(error):
+        return isinstance(error, MySQLdb.OperationalError) and len(error.args) > 0 and error.args[0] in CONNECTION_ERRORS
+
+    # @brief This method rolls back the current transaction ignoring errors
+    # @retval True Rolled back successfully
+    # @retval False The connection is broken
+    def __try_rollback(self):
+        try:
+            self.rollback()
+        except MySQLdb.Error:
+            return False
+        return True
+
+    # @brief This method returns the jittered exponential backoff delay
+    # @param attempt The attempt which failed (int, starting at 0)
+    # @retval Seconds to wait before the next attempt (float)
+    def __backoff(self, attempt):
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+
+    # @brief This method increments a retry statistic of a manager method
+    # @param method Name of the manager method (string)
+    # @param key "retries" or "failures"
+    def __count(self, method, key):
+        with self.__retry_stats_lock:
+            stats = self.__retry_stats.setdefault(method, {"retries": 0, "failures": 0})
+            stats[key] += 1
+
+    # @brief This method returns the retries and failures per manager method
+    # @retval {method: {"retries": count, "failures": count}} (dict)
+    def retry_stats(self):
+        with self.__retry_stats_lock:
+            return {method: dict(stats) for method, stats in self.__retry_stats.items()}
+
+    # @brief This method returns the query, pool, retry and statement cache
+    #        metrics in prometheus text format
+    # @retval Metrics (string)
+    def render_metrics(self):
+        lines = self.metrics.render()
+
+        # Add the pool metrics
+        for key, value in sorted(self.pool.stats().items()):
+            lines.append("# TYPE cms_pool_{} gauge".format(key))
+            lines.append(format_sample("cms_pool_" + key, [], value))
+
+        # Add the retries and failures per method
+        lines += ["# HELP cms_transaction_retries_total Transactions retried on deadlock or lock wait timeout",
+                  "# TYPE cms_transaction_retries_total counter"]
+        retry_stats = sorted(self.retry_stats().items())
+        for method, stats in retry_stats:
+            lines.append(format_sample("cms_transaction_retries_total", [("method", method)], stats["retries"]))
+        lines += ["# HELP cms_transaction_failures_total Transactions failed with a TransactionError",
+                  "# TYPE cms_transaction_failures_total counter"]
+        for method, stats in retry_stats:
+            lines.append(format_sample("cms_transaction_failures_total", [("method", method)], stats["failures"]))
+
+        # Add the read replica routing
+        if self.replicas is not None:
+            replica_stats = self.replicas.stats()
+            lines += ["# HELP cms_replica_reads_total Read only transactions sent to each replica",
+                      "# TYPE cms_replica_reads_total counter"]
+            for name, count in sorted(replica_stats["reads"].items()):
+                lines.append(format_sample("cms_replica_reads_total", [("replica", name)], count))
+            lines += ["# HELP cms_replica_fallbacks_total Read only transactions sent to the primary",
+                      "# TYPE cms_replica_fallbacks_total counter",
+                      format_sample("cms_replica_fallbacks_total", [], replica_stats["fallbacks"]),
+                      "# HELP cms_replica_lag_seconds Last measured replication lag (-1 if unusable)",
+                      "# TYPE cms_replica_lag_seconds gauge"]
+            for name, lag in sorted(replica_stats["lags"].items()):
+                lines.append(format_sample("cms_replica_lag_seconds", [("replica", name)], -1 if lag is None else lag))
+
+        # Add the transaction log writes (the rows dropped by the background
+        # writer after WRITE_ATTEMPTS failures are lost from the log)
+        log_stats = self.transaction_log.stats()
+        lines += ["# HELP cms_transaction_log_rows_total Rows written to InventoryTransactions",
+                  "# TYPE cms_transaction_log_rows_total counter",
+                  format_sample("cms_transaction_log_rows_total", [], log_stats["rows"]),
+                  "# HELP cms_transaction_log_dropped_total Rows of InventoryTransactions dropped by the background writer",
+                  "# TYPE cms_transaction_log_dropped_total counter",
+                  format_sample("cms_transaction_log_dropped_total", [], log_stats["dropped"]),
+                  "# HELP cms_transaction_log_queued Batches waiting for the background writer",
+                  "# TYPE cms_transaction_log_queued gauge",
+                  format_sample("cms_transaction_log_queued", [], log_stats["queued"])]
+
+        # Add the statement cache hits and misses, summed by method and
+        # statement hash as in the query metrics
+        cache_stats = {}
+        for sql_stmt, methods in self.statements.stats().items():
+            statement = statement_hash(fingerprint(sql_stmt))
+            for method, stats in methods.items():
+                totals = cache_stats.setdefault((str(method), statement), {"hits": 0, "misses": 0})
+                totals["hits"] += stats["hits"]
+                totals["misses"] += stats["misses"]
+        lines += ["# HELP cms_statement_cache_total Statement cache lookups",
+                  "# TYPE cms_statement_cache_total counter"]
+        for (method, statement), stats in sorted(cache_stats.items()):
+            for result in ("hits", "misses"):
+                lines.append(format_sample("cms_statement_cache_total", [("method", method), ("statement", statement), ("result", result)], stats[result]))
+
+        return "\n".join(lines) + "\n"
+
+    # @brief This property tells if the current thread is in a transaction
+    @property
+    def in_transaction(self):
+        return getattr(self.__local, 'depth', 0) > 0
+
+    # @brief This method registers a callback run on the connection of the
+    #        transaction of the current thread just before it commits (e.g. to
+    #        write the rows buffered by the transaction), an error raised by
+    #        the callback rolls back the transaction
+    # @param callback Function called without arguments
+    # @note  Outside of a transaction the callback is run at once
+    def before_commit(self, callback):
+        if self.in_transaction:
+            self.__local.before_commit.append(callback)
+        else:
+            callback()
+
+    # @brief This method registers a callback run once the transaction of
+    #        the current thread has committed (e.g. to update an in process
+    #        cache only with committed data)
+    # @param callback Function called without arguments
+    # @note  Outside of a transaction the callback is run at once
+    def after_commit(self, callback):
+        if self.in_transaction:
+            self.__local.on_commit.append(callback)
+        else:
+            PySql.__run_hooks([callback])
+
+    # @brief This method registers a callback run if the changes made so far
+    #        by the transaction of the current thread are rolled back (by the
+    #        transaction or by the savepoint in which it is registered)
+    # @param callback Function called without arguments
+    # @note  Outside of a transaction the callback is never run
+    def after_rollback(self, callback):
+        if self.in_transaction:
+            self.__local.on_rollback.append(callback)
+
+    # @brief This method runs the commit or rollback callbacks, logging the
+    #        errors since the transaction has already ended
+    # @param callbacks Functions called without arguments (list)
+    @staticmethod
+    def __run_hooks(callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Transaction hook %r failed", callback)
+
+    # @brief This method returns a context in which all the statements run
+    #        by the current thread share one connection and one transaction
+    #        (with pysql.transaction(): ...)
+    # @param commit Boolean to specify wether to commit or not
+    # @param method Name of the manager method tagged on the statements
+    # @note  The outermost context checks out the connection and commits or
+    #        rolls back. A nested context (or a manager method called inside
+    #        a context) reuses the outer cursor and runs inside a SAVEPOINT,
+    #        which is rolled back if the nested block raises. An error which
+    #        leaves the outermost context is raised as a TransactionError.
+    @contextlib.contextmanager
+    def transaction(self, commit = True, method = None):
+        depth = getattr(self.__local, 'depth', 0)
+
+        # Run the nested transaction in a savepoint
+        if depth:
+            savepoint = "`SP_{}`".format(depth)
+            outer_method = self.__local.method
+            before_commit = len(self.__local.before_commit)
+            on_commit = len(self.__local.on_commit)
+            on_rollback = len(self.__local.on_rollback)
+            self.run("SAVEPOINT " + savepoint)
+            self.__local.depth = depth + 1
+            self.__local.method = method or outer_method
+
+            try:
+                yield self
+            except:
+                # Undo the changes of the nested transaction only (the
+                # savepoint is gone if the server rolled back everything)
+                self.__local.depth = depth
+                try:
+                    self.run("ROLLBACK TO SAVEPOINT " + savepoint)
+                except MySQLdb.Error:
+                    pass
+                # Forget the callbacks of the nested transaction
+                hooks = self.__local.on_rollback[on_rollback:]
+                del self.__local.before_commit[before_commit:]
+                del self.__local.on_commit[on_commit:]
+                del self.__local.on_rollback[on_rollback:]
+                PySql.__run_hooks(reversed(hooks))
+                raise
+            else:
+                self.__local.depth = depth
+                self.run("RELEASE SAVEPOINT " + savepoint)
+            finally:
+                self.__local.method = outer_method
+            return
+
+        # Initialize the pysql object (the read only transactions are sent
+        # to a read replica if configured)
+        self.init(read_only = not commit)
+        self.__local.depth = 1
+        self.__local.method = method
+        # The connection is discarded unless the transaction ends cleanly
+        discard = True
+        committed = False
+        on_commit = self.__local.on_commit
+        on_rollback = self.__local.on_rollback
+
+        try:
+            yield self
+
+            # Commit the changes is specified, otherwise end the read only
+            # transaction so that the pooled connection does not keep an
+            # old snapshot
+            if commit:
+                # The callbacks may register more callbacks
+                i = 0
+                while i < len(self.__local.before_commit):
+                    self.__local.before_commit[i]()
+                    i += 1
+                self.commit()
+                committed = True
+            else:
+                self.rollback()
+            discard = False
+        except Exception as error:
+            # Rollback the changes
+            discard = not self.__try_rollback() or PySql.__is_connection_error(error)
+            self.metrics.rollback(method)
+
+            if isinstance(error, TransactionError):
+                raise
+            raise TransactionError(method, error, 0) from error
+        finally:
+            # Deinitialize the pysql object
+            self.deinit(discard)
+            # Run the callbacks once the connection is back in the pool
+            if committed:
+                PySql.__run_hooks(on_commit)
+            else:
+                PySql.__run_hooks(reversed(on_rollback))
 
     # @brief This method calls a function wrapped around a try except block
     #        to provide robust error handling
@@ -101,28 +612,32 @@ class PySql:
     # @param args List of arguments to the function
     # @param commit Boolean to specify wether to commit or not
     # @retval Return value of the function
-    # @note This function will loop on forever in an error occurs
+    # @note  The transaction is run again with a jittered exponential
+    #        backoff on a deadlock or a lock wait timeout (at most
+    #        retry_limit times), any other error is raised as a
+    #        TransactionError. Inside an outer transaction the function
+    #        runs in a savepoint of the outer transaction, which decides
+    #        on the commit and the retries.
     def run_transaction(self, function, *args, commit = True):
-        try:
-            # Initialize the pysql object
-            self.init()
+        method = PySql.method_name(function)
 
-            # Execute the function
-            result = function(self, *args)
-        except:
-            # Rollback the changes
-            self.rollback()
+        # Reuse the transaction of the current thread
+        if self.in_transaction:
+            with self.transaction(commit, method):
+                return function(self, *args)
 
-            # Loop forever
-            while True:
-                pass
-        else:
-            # Commit the changes is specified
-            if commit:
-                self.commit()
+        for attempt in range(self.retry_limit + 1):
+            try:
+                with self.transaction(commit, method):
+                    # Execute the function
+                    return function(self, *args)
+            except TransactionError as error:
+                # Surface the error if it cannot be retried
+                if not PySql.__is_retryable(error.error) or attempt == self.retry_limit:
+                    self.__count(method, "failures")
+                    raise TransactionError(method, error.error, attempt) from error.error
 
-            # Return the resutl
-            return result
-        finally:
-            # Deinitialize the pysql object
-            self.deinit()
+                self.__count(method, "retries")
+
+            # Wait before running the transaction again
+            time.sleep(self.__backoff(attempt))
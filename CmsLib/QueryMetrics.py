@@ -0,0 +1,179 @@
+# Import the required modules
+import bisect
+import hashlib
+import logging
+import re
+import threading
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Logger used for the slow query log
+slow_query_log = logging.getLogger("CmsLib.slow_query")
+
+# (pattern, replacement) collapsing the parts of a statement which vary with
+# the number of its parameters: the savepoint names, the repeated rows of
+# VALUES, the repeated CASE branches and the lists of placeholders (IN lists)
+FINGERPRINT_RULES = [(re.compile(r"`SP_\d+`"), "`SP_?`"),
+                     (re.compile(r"(\((?:[^()]|\([^()]*\))*\))(?:\s*,\s*\1)+"), r"\1, ..."),
+                     (re.compile(r"(WHEN %s THEN %s)(?:\s+\1)+"), r"\1 ..."),
+                     (re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)"), "(...)")]
+
+# Statement label of the executions recorded once max_series series exist
+OTHER_STATEMENT = "other"
+
+# Highest number of normalized statements whose fingerprint and hash are
+# cached (the oldest is dropped first)
+FINGERPRINT_CACHE_SIZE = 1024
+
+# @brief This function returns the fingerprint of a statement, the same for
+#        every statement differing only by the number of its parameters
+# @param sql_stmt Normalized sql statement (string)
+# @retval Fingerprint (string)
+def fingerprint(sql_stmt):
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql_stmt = pattern.sub(replacement, sql_stmt)
+    return sql_stmt
+
+# @brief This function returns the short hash of a fingerprint used as the
+#        statement label
+# @param fingerprint Fingerprint of a statement (string)
+# @retval Hash (12 hexadecimal digits)
+def statement_hash(fingerprint):
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+# @brief This function escapes a prometheus label value
+# @param value Label value (string)
+# @retval Escaped label value (string)
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# @brief This function formats a prometheus sample line
+# @param name Metric name (string)
+# @param labels Label names and values (list of tuples)
+# @param value Sample value (number)
+# @retval Sample line (string)
+def format_sample(name, labels, value):
+    if labels:
+        labels = ",".join('{}="{}"'.format(label, escape_label(label_value)) for label, label_value in labels)
+        return "{}{{{}}} {}".format(name, labels, value)
+    return "{} {}".format(name, value)
+
+# @brief This class records the latency and the row counts of the sql
+#        statements tagged with the manager method which ran them, and the
+#        rollbacks of the manager methods
+# @note  The series are keyed by the method and the fingerprint of the
+#        statement, and labelled with the hash of the fingerprint (the text of
+#        each hash is returned by statements() and logged once), so the number
+#        of series does not grow with the sizes of the IN lists, multi-row
+#        inserts or savepoint depths. Past max_series series, the new
+#        statements of a method are recorded in its "other" series.
+class QueryMetrics:
+
+    # @brief This method initializes the QueryMetrics object
+    # @param slow_query_seconds Latency above which a statement is logged
+    #        in the slow query log (float, None to disable)
+    # @param max_series Maximum number of (method, statement) series (int)
+    def __init__(self, slow_query_seconds = 0.1, max_series = 500):
+        self.slow_query_seconds = slow_query_seconds
+        self.max_series = max_series
+        # [bucket counts, count, total seconds, total rows] keyed by
+        # (method, statement hash)
+        self.__statements = {}
+        # Fingerprints keyed by statement hash
+        self.__fingerprints = {}
+        # (fingerprint, statement hash) keyed by normalized statement
+        self.__hashes = {}
+        # Executions recorded in the "other" series
+        self.__overflow = 0
+        # Rollback counts keyed by method
+        self.__rollbacks = {}
+        self.__lock = threading.Lock()
+
+    # @brief This method records one execution of a statement
+    # @param method Manager method running the statement (string)
+    # @param sql_stmt Normalized sql statement (string)
+    # @param seconds Time taken by the statement (float)
+    # @param rows Number of rows returned or affected (int)
+    # @param params The arguments of the statement (logged if slow)
+    def observe(self, method, sql_stmt, seconds, rows, params = None):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        # Fingerprint the statement only the first time it is seen
+        cached = self.__hashes.get(sql_stmt)
+        if cached is None:
+            statement_fingerprint = fingerprint(sql_stmt)
+            cached = (statement_fingerprint, statement_hash(statement_fingerprint))
+        statement_fingerprint, statement = cached
+
+        with self.__lock:
+            if sql_stmt not in self.__hashes:
+                if len(self.__hashes) >= FINGERPRINT_CACHE_SIZE:
+                    del self.__hashes[next(iter(self.__hashes))]
+                self.__hashes[sql_stmt] = cached
+            record = self.__statements.get((method, statement))
+            if record is None:
+                if len(self.__statements) >= self.max_series:
+                    statement = OTHER_STATEMENT
+                    self.__overflow += 1
+                    record = self.__statements.get((method, statement))
+                elif statement not in self.__fingerprints:
+                    self.__fingerprints[statement] = statement_fingerprint
+                    slow_query_log.debug("Statement %s: %s", statement, statement_fingerprint)
+                if record is None:
+                    record = self.__statements[(method, statement)] = [[0] * (len(LATENCY_BUCKETS) + 1), 0, 0.0, 0]
+            record[0][bucket] += 1
+            record[1] += 1
+            record[2] += seconds
+            record[3] += max(rows, 0)
+
+        # Log the statement if it is slow
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            slow_query_log.warning("%.1f ms %s [%s]: %s %r", seconds * 1000, method, statement, sql_stmt, params)
+
+    # @brief This method returns the fingerprints of the statement labels
+    # @retval Fingerprints keyed by statement hash (dict)
+    def statements(self):
+        with self.__lock:
+            return dict(self.__fingerprints)
+
+    # @brief This method records the rollback of a failed transaction
+    # @param method Manager method which was rolled back (string)
+    def rollback(self, method):
+        with self.__lock:
+            self.__rollbacks[method] = self.__rollbacks.get(method, 0) + 1
+
+    # @brief This method returns the recorded metrics in prometheus text format
+    # @retval lines Lines of the prometheus text format (list of strings)
+    def render(self):
+        with self.__lock:
+            statements = {key: (list(record[0]), record[1], record[2], record[3]) for key, record in self.__statements.items()}
+            rollbacks = dict(self.__rollbacks)
+            overflow = self.__overflow
+
+        lines = ["# HELP cms_query_duration_seconds Latency of the sql statements",
+                 "# TYPE cms_query_duration_seconds histogram"]
+        for (method, statement), (buckets, count, seconds, _) in sorted(statements.items()):
+            labels = [("method", method), ("statement", statement)]
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(format_sample("cms_query_duration_seconds_bucket", labels + [("le", bound)], cumulative))
+            lines.append(format_sample("cms_query_duration_seconds_bucket", labels + [("le", "+Inf")], count))
+            lines.append(format_sample("cms_query_duration_seconds_sum", labels, seconds))
+            lines.append(format_sample("cms_query_duration_seconds_count", labels, count))
+
+        lines += ["# HELP cms_query_rows_total Rows returned or affected by the sql statements",
+                  "# TYPE cms_query_rows_total counter"]
+        for (method, statement), (_, _, _, rows) in sorted(statements.items()):
+            lines.append(format_sample("cms_query_rows_total", [("method", method), ("statement", statement)], rows))
+
+        lines += ["# HELP cms_query_series_overflow_total Statements recorded in the other series past max_series",
+                  "# TYPE cms_query_series_overflow_total counter",
+                  format_sample("cms_query_series_overflow_total", [], overflow)]
+
+        lines += ["# HELP cms_transaction_rollbacks_total Failed transactions rolled back",
+                  "# TYPE cms_transaction_rollbacks_total counter"]
+        for method, count in sorted(rollbacks.items()):
+            lines.append(format_sample("cms_transaction_rollbacks_total", [("method", method)], count))
+
+        return lines
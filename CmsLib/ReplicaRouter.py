@@ -0,0 +1,112 @@
+# Import the required modules
+import threading
+import time
+
+# @brief This class chooses the read replica on which a read only
+#        transaction is run, skipping the replicas which lag behind the
+#        primary by more than the staleness bound or which cannot be reached
+class ReplicaRouter:
+
+    # @brief This method initializes the ReplicaRouter object
+    # @param pools {name: ConnectionPool} of the replicas (dict)
+    # @param max_lag Maximum replication lag allowed in seconds (float)
+    # @param check_interval Seconds for which a lag measurement is reused (float)
+    def __init__(self, pools, max_lag = 5, check_interval = 1):
+        self.pools = pools
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # Names of the replicas in round robin order
+        self.__names = sorted(pools)
+        self.__next = 0
+        # (measured at, lag in seconds or None if unusable) keyed by name
+        self.__lags = {}
+        # Reads routed to each replica and to the primary
+        self.__reads = {name: 0 for name in self.__names}
+        self.__fallbacks = 0
+        self.__lock = threading.Lock()
+
+    # @brief This method measures the replication lag of a replica
+    # @param pool ConnectionPool of the replica
+    # @retval lag Seconds behind the primary (None if not replicating)
+    @staticmethod
+    def __measure_lag(pool):
+        connection = pool.checkout()
+        discard = True
+
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Exception:
+                # Servers older than MySQL 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            columns = [column[0] for column in cursor.description or ()]
+            status = cursor.fetchone()
+            cursor.close()
+            connection.rollback()
+            discard = False
+        finally:
+            pool.checkin(connection, discard)
+
+        # The server is not a replica
+        if not status:
+            return None
+
+        status = dict(zip(columns, status))
+        return status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+
+    # @brief This method returns the lag of a replica, measuring it again if
+    #        the last measurement is older than check_interval
+    # @param name Name of the replica (string)
+    # @retval lag Seconds behind the primary (None if unusable)
+    def __lag(self, name):
+        now = time.monotonic()
+        with self.__lock:
+            measured = self.__lags.get(name)
+        if measured and now - measured[0] < self.check_interval:
+            return measured[1]
+
+        try:
+            lag = ReplicaRouter.__measure_lag(self.pools[name])
+        except Exception:
+            lag = None
+
+        with self.__lock:
+            self.__lags[name] = (now, lag)
+        return lag
+
+    # @brief This method chooses a replica within the staleness bound
+    # @retval (name, pool) of the replica, or None to use the primary
+    def choose(self):
+        with self.__lock:
+            start = self.__next
+            self.__next = (self.__next + 1) % len(self.__names)
+
+        # Try the replicas in round robin order
+        for i in range(len(self.__names)):
+            name = self.__names[(start + i) % len(self.__names)]
+            lag = self.__lag(name)
+            if lag is not None and lag <= self.max_lag:
+                with self.__lock:
+                    self.__reads[name] += 1
+                return name, self.pools[name]
+
+        # Fall back to the primary
+        with self.__lock:
+            self.__fallbacks += 1
+        return None
+
+    # @brief This method marks a replica as unusable until it is measured
+    #        again (e.g. when a connection to it cannot be opened)
+    # @param name Name of the replica (string)
+    def mark_failed(self, name):
+        with self.__lock:
+            self.__lags[name] = (time.monotonic(), None)
+
+    # @brief This method returns the routing metrics
+    # @retval stats {"reads": {name: count}, "fallbacks": count, "lags": {name: lag}} (dict)
+    def stats(self):
+        with self.__lock:
+            return {"reads": dict(self.__reads),
+                    "fallbacks": self.__fallbacks,
+                    "lags": {name: measured[1] for name, measured in self.__lags.items()}}
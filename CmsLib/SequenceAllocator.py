@@ -0,0 +1,147 @@
+# Import the required modules
+import asyncio
+import threading
+
+# Reserve a block of values of a sequence (the new next value is returned
+# by LAST_INSERT_ID() on the same connection)
+RESERVE_STMT = "UPDATE `Sequences` SET `NextValue` = LAST_INSERT_ID(`NextValue` + %s) WHERE `SequenceName` = %s"
+RESERVED_STMT = "SELECT LAST_INSERT_ID()"
+
+# @brief This exception is raised when a sequence is not in the Sequences table
+class SequenceError(Exception):
+    pass
+
+# @brief This class hands out the integer ids of the InventoryTransactions,
+#        Orders and Invoices (hi/lo style). Blocks of ids are reserved from
+#        the Sequences table in a short transaction of their own, so every
+#        process (and thread) gets distinct ids without scanning the tables.
+# @note  The ids left in the block of a process are not used after it exits,
+#        so the ids have gaps but are never handed out twice
+class SequenceAllocator:
+
+    # @brief This method initializes the SequenceAllocator object
+    # @param pool ConnectionPool of the primary used only for the reservations
+    # @param block_size Number of ids reserved at a time (int)
+    def __init__(self, pool, block_size = 100):
+        self.pool = pool
+        self.block_size = block_size
+        # [next id, end of block] keyed by the sequence name
+        self.__blocks = {}
+        # Locks keyed by the sequence name
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+    # @brief This method reserves a block of ids of a sequence
+    # @param name Name of the sequence (string)
+    # @param size Number of ids reserved (int)
+    # @retval (start, end) The ids reserved are start to end - 1
+    def __reserve(self, name, size):
+        connection = self.pool.checkout()
+        discard = True
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute(RESERVE_STMT, (size, name))
+            if cursor.rowcount != 1:
+                raise SequenceError("Sequence {} not found".format(name))
+            cursor.execute(RESERVED_STMT)
+            end = cursor.fetchone()[0]
+            cursor.close()
+            connection.commit()
+            discard = False
+        finally:
+            if discard:
+                try:
+                    connection.rollback()
+                    discard = False
+                except Exception:
+                    pass
+            self.pool.checkin(connection, discard)
+
+        return end - size, end
+
+    # @brief This method returns the next ids of a sequence
+    # @param name Name of the sequence (string)
+    # @param count Number of ids required (int)
+    # @retval ids The ids in increasing order (list of ints)
+    def next_values(self, name, count):
+        with self.__lock:
+            lock = self.__locks.setdefault(name, threading.Lock())
+
+        with lock:
+            block = self.__blocks.setdefault(name, [0, 0])
+            ids = []
+
+            while len(ids) < count:
+                # Reserve a new block if the current one is used up
+                if block[0] == block[1]:
+                    block[0], block[1] = self.__reserve(name, max(self.block_size, count - len(ids)))
+
+                taken = min(count - len(ids), block[1] - block[0])
+                ids += range(block[0], block[0] + taken)
+                block[0] += taken
+
+        return ids
+
+    # @brief This method returns the next id of a sequence
+    # @param name Name of the sequence (string)
+    # @retval id The next id (int)
+    def next_value(self, name):
+        return self.next_values(name, 1)[0]
+
+# @brief This class is the asyncio counterpart of SequenceAllocator, it
+#        reserves the blocks over a pool of aiomysql connections
+# @ref   SequenceAllocator
+class AsyncSequenceAllocator:
+
+    # @brief This method initializes the AsyncSequenceAllocator object
+    # @param block_size Number of ids reserved at a time (int)
+    # @note  The pool is set by AsyncPySql.open()
+    def __init__(self, block_size = 100):
+        self.pool = None
+        self.block_size = block_size
+        self.__blocks = {}
+        self.__locks = {}
+
+    # @ref SequenceAllocator.__reserve
+    async def __reserve(self, name, size):
+        connection = await self.pool.acquire()
+
+        try:
+            cursor = await connection.cursor()
+            await cursor.execute(RESERVE_STMT, (size, name))
+            if cursor.rowcount != 1:
+                raise SequenceError("Sequence {} not found".format(name))
+            await cursor.execute(RESERVED_STMT)
+            end = (await cursor.fetchone())[0]
+            await cursor.close()
+            await connection.commit()
+        except:
+            await connection.rollback()
+            raise
+        finally:
+            self.pool.release(connection)
+
+        return end - size, end
+
+    # @ref SequenceAllocator.next_values
+    async def next_values(self, name, count):
+        lock = self.__locks.setdefault(name, asyncio.Lock())
+
+        async with lock:
+            block = self.__blocks.setdefault(name, [0, 0])
+            ids = []
+
+            while len(ids) < count:
+                if block[0] == block[1]:
+                    block[0], block[1] = await self.__reserve(name, max(self.block_size, count - len(ids)))
+
+                taken = min(count - len(ids), block[1] - block[0])
+                ids += range(block[0], block[0] + taken)
+                block[0] += taken
+
+        return ids
+
+    # @ref SequenceAllocator.next_value
+    async def next_value(self, name):
+        return (await self.next_values(name, 1))[0]
@@ -0,0 +1,262 @@
+# Import the required modules
+import contextlib
+import decimal
+import fcntl
+import mmap
+import struct
+import threading
+
+# Magic number and layout version of the file
+MAGIC = b"CMSC"
+LAYOUT = 1
+
+# Header of the file: magic, layout, capacity, active buffer, generation
+HEADER = struct.Struct("<4sIIIQ")
+GENERATION = struct.Struct("<Q")
+GENERATION_OFFSET = 16
+ACTIVE = struct.Struct("<I")
+ACTIVE_OFFSET = 12
+
+# Header of a buffer: catalog version (0 if never published), records
+BUFFER_HEADER = struct.Struct("<QI4x")
+
+# Record of a product: bitmask of the NULL columns, ProductID, Name,
+# Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount (the
+# numbers are scaled to integers, the strings are UTF-8 padded with NUL)
+RECORD = struct.Struct("<B6s256s256sq4sqqq")
+
+# Decimal places of the numeric columns (UnitPrice, SGST, CGST,
+# CurrentDiscount) as in the Products table
+SCALES = {3: 3, 5: 2, 6: 2, 7: 2}
+# Position of each nullable column in the bitmask
+NULLABLE = (2, 3, 4, 5, 6, 7)
+
+# Name index entry (record number of the products sorted by name)
+INDEX = struct.Struct("<I")
+
+# @brief This class publishes the product catalog to a memory mapped file
+#        shared by the worker processes of a host. The file holds two
+#        buffers of fixed width records sorted by ProductID (with an index
+#        sorted by name): a writer fills the inactive buffer and then makes
+#        it the active one, and the readers look up the active buffer in
+#        place without copying the catalog.
+# @note  The writers are serialized with an fcntl lock on the file. The
+#        generation counter in the header is odd while a buffer is being
+#        written and incremented again once the new buffer is active; a
+#        reader checks it after each lookup and reads again if the buffer
+#        it read was written meanwhile (which takes two publishes).
+class SharedCatalog:
+
+    # @brief This method initializes the SharedCatalog object, creating the
+    #        file if needed
+    # @param path Path of the file (string, e.g. /dev/shm/cms_catalog)
+    # @param capacity Highest number of products (int)
+    def __init__(self, path, capacity = 10000):
+        self.path = path
+        self.capacity = capacity
+        self.__buffer_size = BUFFER_HEADER.size + capacity * (RECORD.size + INDEX.size)
+        size = HEADER.size + 2 * self.__buffer_size
+
+        self.__file = open(path, "a+b")
+        self.__lock = threading.Lock()
+        with self.__locked():
+            # Create (or reset when the capacity changed) the file
+            self.__file.seek(0)
+            header = self.__file.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header)[:3] != (MAGIC, LAYOUT, capacity):
+                self.__file.truncate(0)
+                self.__file.truncate(size)
+                self.__file.seek(0)
+                self.__file.write(HEADER.pack(MAGIC, LAYOUT, capacity, 0, 0))
+                self.__file.flush()
+            self.__map = mmap.mmap(self.__file.fileno(), size)
+
+    # @brief This method returns a context holding the writer lock
+    @contextlib.contextmanager
+    def __locked(self):
+        with self.__lock:
+            fcntl.flock(self.__file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.__file, fcntl.LOCK_UN)
+
+    # @brief This method returns the offset of a buffer
+    # @param buffer Buffer number (0 or 1)
+    def __buffer(self, buffer):
+        return HEADER.size + buffer * self.__buffer_size
+
+    # @brief This method runs a lookup on the active buffer until it was not
+    #        overwritten while being read
+    # @param function Function called with the buffer offset and the number
+    #        of records
+    # @retval Return value of the function
+    def __read(self, function):
+        while True:
+            generation = GENERATION.unpack_from(self.__map, GENERATION_OFFSET)[0]
+            offset = self.__buffer(ACTIVE.unpack_from(self.__map, ACTIVE_OFFSET)[0])
+            try:
+                version, count = BUFFER_HEADER.unpack_from(self.__map, offset)
+                result = function(offset + BUFFER_HEADER.size, min(count, self.capacity)), version
+                error = None
+            except (struct.error, ValueError) as exception:
+                # Garbage read from a buffer being written
+                error = exception
+
+            # The active buffer is written again by the second publish only
+            if GENERATION.unpack_from(self.__map, GENERATION_OFFSET)[0] <= generation + 2 - generation % 2:
+                if error is not None:
+                    raise error
+                return result
+
+    # @brief This method decodes a record
+    # @param offset Offset of the record
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    def __decode(self, offset):
+        values = RECORD.unpack_from(self.__map, offset)
+        nulls = values[0]
+        product = []
+        for column, value in enumerate(values[1:]):
+            if column in NULLABLE and nulls & (1 << column):
+                value = None
+            elif column in SCALES:
+                value = decimal.Decimal(value).scaleb(-SCALES[column])
+            else:
+                value = value.rstrip(b"\0").decode()
+            product.append(value)
+        return tuple(product)
+
+    # @brief This method encodes a record
+    # @param product (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval record Record (bytes)
+    @staticmethod
+    def __encode(product):
+        nulls = 0
+        values = []
+        for column, value in enumerate(product):
+            if value is None:
+                nulls |= 1 << column
+                value = 0 if column in SCALES else b""
+            elif column in SCALES:
+                value = int(decimal.Decimal(value).scaleb(SCALES[column]).to_integral_value())
+            else:
+                value = str(value).encode()
+            values.append(value)
+        return RECORD.pack(nulls, *values)
+
+    # @brief This method returns the version of the catalog published
+    # @retval version Catalog version (int, None if nothing was published)
+    @property
+    def version(self):
+        return self.__read(lambda records, count: None)[1] or None
+
+    # @brief This method returns all the products
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    @property
+    def products(self):
+        return self.__read(lambda records, count: [self.__decode(records + i * RECORD.size)
+                                                   for i in range(count)])[0]
+
+    # @brief This method returns a product from its ProductID (binary search
+    #        of the records)
+    # @param product_id ProductID (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    def product(self, product_id):
+        key = product_id.encode()
+
+        def find(records, count):
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                offset = records + middle * RECORD.size
+                found = self.__map[offset + 1:offset + 7]
+                if found == key:
+                    return self.__decode(offset)
+                if found < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            return None
+
+        return self.__read(find)[0]
+
+    # @brief This method returns a product from its name (binary search of
+    #        the name index)
+    # @param name Product name (string)
+    # @retval (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (tuple)
+    # @retval None For product not found
+    def product_by_name(self, name):
+        key = name.encode()
+
+        def find(records, count):
+            index = records + self.capacity * RECORD.size
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                offset = records + INDEX.unpack_from(self.__map, index + middle * INDEX.size)[0] * RECORD.size
+                found = self.__map[offset + 7:offset + 263].rstrip(b"\0")
+                if found == key:
+                    return self.__decode(offset)
+                if found < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            return None
+
+        return self.__read(find)[0]
+
+    # @brief This method publishes a version of the catalog, unless a newer
+    #        one is already published
+    # @param version Catalog version (int)
+    # @param products (ProductID, Name, Description, UnitPrice, UnitType, SGST, CGST, CurrentDiscount) (list of tuples)
+    # @retval True The version was published
+    # @retval False A version at least as recent was already published
+    def publish(self, version, products):
+        if len(products) > self.capacity:
+            raise ValueError("{} products do not fit in the shared catalog of {}".format(len(products), self.capacity))
+
+        products = sorted(products, key = lambda product: product[0])
+        names = sorted(range(len(products)), key = lambda i: products[i][1].encode())
+
+        with self.__locked():
+            active = ACTIVE.unpack_from(self.__map, ACTIVE_OFFSET)[0]
+            published = BUFFER_HEADER.unpack_from(self.__map, self.__buffer(active))[0]
+            if version <= published:
+                return False
+
+            # Mark the inactive buffer as being written (it stays odd if a
+            # writer died while writing)
+            generation = GENERATION.unpack_from(self.__map, GENERATION_OFFSET)[0]
+            if generation % 2 == 0:
+                generation += 1
+                GENERATION.pack_into(self.__map, GENERATION_OFFSET, generation)
+
+            # Fill the inactive buffer
+            buffer = 1 - active
+            offset = self.__buffer(buffer)
+            records = offset + BUFFER_HEADER.size
+            self.__map[records:records + len(products) * RECORD.size] = b"".join(SharedCatalog.__encode(product) for product in products)
+            index = records + self.capacity * RECORD.size
+            self.__map[index:index + len(names) * INDEX.size] = b"".join(INDEX.pack(i) for i in names)
+            BUFFER_HEADER.pack_into(self.__map, offset, version, len(products))
+
+            # Swap the buffers
+            ACTIVE.pack_into(self.__map, ACTIVE_OFFSET, buffer)
+            GENERATION.pack_into(self.__map, GENERATION_OFFSET, generation + 1)
+
+        return True
+
+    # @brief This method unmaps and closes the file
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+    # @brief This method returns the state of the shared catalog
+    # @retval stats {"version", "products", "capacity", "generation"} (dict)
+    def stats(self):
+        (count, version) = self.__read(lambda records, count: count)
+        return {"version": version or None,
+                "products": count,
+                "capacity": self.capacity,
+                "generation": GENERATION.unpack_from(self.__map, GENERATION_OFFSET)[0]}
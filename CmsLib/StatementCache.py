@@ -0,0 +1,85 @@
+# Import the required modules
+from collections import OrderedDict
+import re
+import threading
+
+# Quoted strings and identifiers (kept as they are) or runs of whitespace
+# (collapsed to a single space)
+TOKEN_REGEX = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\s+""")
+
+# @brief This class caches the normalized text of the sql statements so that
+#        the same statement is always sent to the server with the same text
+#        and is normalized only once per process
+class StatementCache:
+
+    # @brief This method initializes the StatementCache object
+    # @param max_size Maximum number of statements cached (int)
+    def __init__(self, max_size = 256):
+        self.max_size = max_size
+        # Normalized statements keyed by the statement as written in the code
+        self.__statements = OrderedDict()
+        # Number of cached statements normalized to each normalized statement
+        self.__references = {}
+        # Hit and miss counts keyed by the normalized statement and the
+        # manager method running it
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    # @brief This method collapses the whitespace of a statement outside of
+    #        the quoted strings
+    # @param sql_stmt The sql statement (string)
+    # @retval The normalized sql statement (string)
+    @staticmethod
+    def normalize(sql_stmt):
+        return TOKEN_REGEX.sub(lambda match: match.group(1) or " ", sql_stmt).strip()
+
+    # @brief This method counts a lookup of a normalized statement
+    # @param normalized The normalized sql statement (string)
+    # @param method Manager method running the statement (string)
+    # @param result "hits" or "misses" (string)
+    # @note  The lock must be held by the caller
+    def __count(self, normalized, method, result):
+        stats = self.__stats.setdefault(normalized, {}).setdefault(method, {"hits": 0, "misses": 0})
+        stats[result] += 1
+
+    # @brief This method returns the normalized statement from the cache,
+    #        normalizing and caching it on a miss
+    # @param sql_stmt The sql statement (string)
+    # @param method Manager method running the statement (string, the
+    #        lookups are counted per method)
+    # @retval The normalized sql statement (string)
+    def get(self, sql_stmt, method = None):
+        with self.__lock:
+            normalized = self.__statements.get(sql_stmt)
+            if normalized is not None:
+                # Mark the statement as recently used
+                self.__statements.move_to_end(sql_stmt)
+                self.__count(normalized, method, "hits")
+                return normalized
+
+        # Normalize the statement outside the lock
+        normalized = StatementCache.normalize(sql_stmt)
+
+        with self.__lock:
+            if sql_stmt not in self.__statements:
+                self.__references[normalized] = self.__references.get(normalized, 0) + 1
+            self.__statements[sql_stmt] = normalized
+            self.__count(normalized, method, "misses")
+
+            # Evict the least recently used statement, and its counts once no
+            # cached statement is normalized to it
+            if len(self.__statements) > self.max_size:
+                evicted = self.__statements.popitem(last = False)[1]
+                self.__references[evicted] -= 1
+                if not self.__references[evicted]:
+                    del self.__references[evicted]
+                    self.__stats.pop(evicted, None)
+
+        return normalized
+
+    # @brief This method returns the hit and miss counts of the statements
+    # @retval {normalized statement: {method: {"hits", "misses"}}} (dict)
+    def stats(self):
+        with self.__lock:
+            return {normalized: {method: dict(counts) for method, counts in methods.items()}
+                    for normalized, methods in self.__stats.items()}
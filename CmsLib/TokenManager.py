@@ -1,41 +1,137 @@
+# Import the required modules
+from CmsLib.TokenPool import TokenPool
+
+# Index of the free token numbers shared by the threads of the process
+token_pool = TokenPool()
+
+# Number of times the tokens are added again after another process added
+# one of them
+ADD_TOKEN_ATTEMPTS = 3
+
+# Statements shared with AsyncTokenManager
+ADD_TOKEN_STMT = "INSERT INTO `Tokens` (`TokenID`) \
+                  VALUES (%s)"
+REMOVE_TOKEN_STMT = "DELETE \
+                     FROM `Tokens` \
+                     WHERE `TokenID` = %s"
+# Lock the first unassigned token, skipping the tokens locked by the
+# concurrent calls, so no two customers get the same token and no call waits
+# for another (the index on Assigned? avoids the scan). The token ids are
+# ordered by their number: the shorter ids first (TOK-99 before TOK-100),
+# as in the index
+FREE_TOKEN_STMT = "SELECT `TokenID` \
+                   FROM `Tokens` \
+                   WHERE `Assigned?` = 0 \
+                   ORDER BY CHAR_LENGTH(`TokenID`), `TokenID` \
+                   LIMIT 1 \
+                   FOR UPDATE SKIP LOCKED"
+ASSIGN_TOKEN_STMT = "UPDATE `Tokens` \
+                     SET `Assigned?` = true \
+                     WHERE `TokenID` = %s"
+PUT_TOKEN_STMT = "UPDATE `Tokens` \
+                  SET `Assigned?` = false, \
+                      `InvoiceID` = NULL \
+                  WHERE `TokenID` = %s"
+TOKEN_ASSIGNED_STMT = "SELECT `Assigned?` \
+                       FROM `Tokens` \
+                       WHERE `TokenID` = %s"
+TOKEN_PRODUCTS_STMT = "SELECT COUNT(*) \
+                       FROM `TokensSelectProducts` \
+                       WHERE `TokenID` = %s"
+TOKEN_DETAILS_STMT = "SELECT `ProductID`, `Quantity` \
+                      FROM `TokensSelectProducts` \
+                      WHERE `TokenID` = %s"
+TOKENS_STATUS_STMT = "SELECT `TokenID`, `Assigned?` \
+                      FROM `Tokens`"
+
+# @brief This function checks if a token can be removed
+# @param has_products Number of products linked with the token (int)
+# @param is_assigned Assignment status of the token (None if not found)
+# @retval 0 Token can be removed
+# @retval 1 Token has products
+# @retval 2 Token is already assigned
+# @retval 3 Token not found
+def check_remove_token(has_products, is_assigned):
+    # If token has products
+    if has_products:
+        return 1
+    # If token is already assigned
+    if is_assigned:
+        return 2
+    # Check if token exists
+    if is_assigned == None:
+        return 3
+    return 0
+
+# @brief This function checks if a token can be put back
+# @param has_products Number of products linked with the token (int)
+# @param is_assigned Assignment status of the token (None if not found)
+# @retval 0 Token can be put back
+# @retval 1 Token has products
+# @retval 2 Token is already not assigned
+# @retval 3 Token not found
+def check_put_token(has_products, is_assigned):
+    # If token has products
+    if has_products:
+        return 1
+    # If token is already not assigned
+    if is_assigned == 0:
+        return 2
+    # If token is not existing
+    if is_assigned == None:
+        return 3
+    return 0
+
 # @brief This class is used to handle the token management in CMS
 # @note  There is not need to create an object of this class as all
 #        methods in this class are static
 class TokenManager:
 
+    # @brief This method adds tokens to the list of tokens with default state,
+    #        taking the lowest free token numbers from the token pool
+    # @param pysql PySql object
+    # @param count Number of tokens to be added (int)
+    # @retval token_ids TokenIDs of the newly added tokens (list of strings)
+    # @retval 1 New tokens cannot be added
+    @staticmethod
+    def __add_tokens(pysql, count):
+        # Check if the number of tokens is valid
+        if count <= 0:
+            return 1
+
+        for attempt in range(ADD_TOKEN_ATTEMPTS):
+            # Get the lowest free token numbers
+            numbers = token_pool.take(pysql, count)
+
+            # Check if the tokens to be added are out of limit
+            if numbers is None:
+                return 1
+
+            # Add the tokens in one statement
+            token_ids = [TokenPool.token_id(number) for number in numbers]
+            try:
+                with pysql.transaction():
+                    pysql.run_many(ADD_TOKEN_STMT, [(token_id, ) for token_id in token_ids])
+                return token_ids
+            except pysql.IntegrityError:
+                # Another process added one of the tokens, load the pool again
+                token_pool.invalidate()
+                if attempt == ADD_TOKEN_ATTEMPTS - 1:
+                    raise
+
     # @brief This method adds a token to the list of tokens with default state
     # @param PySql object
     # @retval token_id TokenID of the newly added token
     # @retval 1 New token cannot be added
     @staticmethod
     def __add_token(pysql):
-        # Get all the current token ids
-        sql_stmt = "SELECT `TokenID` \
-                    FROM `Tokens`"
-        pysql.run(sql_stmt)
-        tokens = [int(token[0][4:]) for token in pysql.result]
-
-        # For every token in the existing list of tokens
-        token_i = 0
-        for token in tokens:
-            # If the token 'i' is not in the list
-            if token_i != token:
-                break
-            token_i += 1
-
-        # Check if token number to be added is out of limit
-        if token_i >= 100:
-            return 1
+        token_ids = TokenManager.__add_tokens(pysql, 1)
 
-        # Create the token id
-        token_id = "TOK-" + format(token_i, "02d")
-
-        # Add the token with number 'i'
-        sql_stmt = "INSERT INTO `Tokens` (`TokenID`) \
-                    VALUES (%s)"
-        pysql.run(sql_stmt, (token_id, ))
+        # Check if the token cannot be added
+        if token_ids == 1:
+            return 1
 
-        return token_id
+        return token_ids[0]
 
     # @brief This method removes a token from the list of tokens which
     #        is in default state only
@@ -52,36 +148,27 @@ class TokenManager:
         # Get the assignment status of token
         is_assigned = TokenManager._TokenManager__is_token_assigned(pysql, token_id)
 
-        # If token has products
-        if has_products:
-            return 1
-        # If token is already assigned
-        if is_assigned:
-            return 2
-        # Check if token exists
-        if is_assigned == None:
-            return 3
+        # Check if token can be removed
+        code = check_remove_token(has_products, is_assigned)
+        if code:
+            return code
 
         # Remove the token
-        sql_stmt = "DELETE \
-                    FROM `Tokens` \
-                    WHERE `TokenID` = %s"
-        pysql.run(sql_stmt, (token_id, ))
+        pysql.run(REMOVE_TOKEN_STMT, (token_id, ))
+
+        # Put the token number back in the token pool
+        token_pool.release(pysql, TokenPool.token_number(token_id))
 
         return 0
 
-    # @brief This method returns the first available unassigned token
+    # @brief This method assigns the first available unassigned token
     # @param pysql PySql object
     # @retval TokenID (string)
     # @retval None Free token not found
     @staticmethod
     def __get_token(pysql):
-        # Run the query to get the unassigned tokens
-        sql_stmt = "SELECT `TokenID` \
-                    FROM `Tokens` \
-                    WHERE `Assigned?` = 0 \
-                    LIMIT 1"
-        pysql.run(sql_stmt)
+        # Lock the first unassigned token
+        pysql.run(FREE_TOKEN_STMT)
 
         # Get the first unassigned token
         token_id = pysql.scalar_result
@@ -91,10 +178,7 @@ class TokenManager:
             return None
 
         # Update the token assigned status to true
-        sql_stmt = "UPDATE `Tokens` \
-                    SET `Assigned?` = true \
-                    WHERE `TokenID` = %s"
-        pysql.run(sql_stmt, (token_id, ))
+        pysql.run(ASSIGN_TOKEN_STMT, (token_id, ))
 
         # Return the token found
         return token_id
@@ -114,24 +198,33 @@ class TokenManager:
         # Get the assignment status of token
         is_assigned = TokenManager._TokenManager__is_token_assigned(pysql, token_id)
 
-        # If token has products
-        if has_products:
-            return 1
-        # If token is already not assigned
-        if is_assigned == 0:
-            return 2
-        # If token is not existing
-        if is_assigned == None:
-            return 3
+        # Check if token can be put back
+        code = check_put_token(has_products, is_assigned)
+        if code:
+            return code
+
+        # Make the assigned status false and make the invoice id null
+        pysql.run(PUT_TOKEN_STMT, (token_id, ))
+
+        return 0
 
+    # @brief This method puts all the assigned tokens without linked products
+    #        back to the default state (e.g. when the store closes)
+    # @param pysql PySql object
+    # @retval Number of tokens put back (int)
+    # @note  The tokens with products stay assigned
+    @staticmethod
+    def __reset_tokens(pysql):
         # Make the assigned status false and make the invoice id null
         sql_stmt = "UPDATE `Tokens` \
                     SET `Assigned?` = false, \
                         `InvoiceID` = NULL \
-                    WHERE `TokenID` = %s"
-        pysql.run(sql_stmt, (token_id, ))
+                    WHERE `Assigned?` = true \
+                    AND `TokenID` NOT IN (SELECT `TokenID` \
+                                          FROM `TokensSelectProducts`)"
+        pysql.run(sql_stmt)
 
-        return 0
+        return pysql.rowcount
 
     # @brief This method checks if the given token is assigned
     # @param pysql PySql object
@@ -142,10 +235,7 @@ class TokenManager:
     @staticmethod
     def __is_token_assigned(pysql, token_id):
         # Get the assignment status
-        sql_stmt = "SELECT `Assigned?` \
-                    FROM `Tokens` \
-                    WHERE `TokenID` = %s"
-        pysql.run(sql_stmt, (token_id, ))
+        pysql.run(TOKEN_ASSIGNED_STMT, (token_id, ))
 
         # Get the assignment status
         is_assigned = pysql.scalar_result
@@ -159,10 +249,7 @@ class TokenManager:
     @staticmethod
     def __token_has_products(pysql, token_id):
         # Get the product status
-        sql_stmt = "SELECT COUNT(*) \
-                    FROM `TokensSelectProducts` \
-                    WHERE `TokenID` = %s"
-        pysql.run(sql_stmt, (token_id, ))
+        pysql.run(TOKEN_PRODUCTS_STMT, (token_id, ))
 
         # Get the result
         no_of_products = pysql.scalar_result
@@ -177,10 +264,7 @@ class TokenManager:
     @staticmethod
     def __get_token_details(pysql, token_id):
         # Get the all the products of the given token
-        sql_stmt = "SELECT `ProductID`, `Quantity` \
-                    FROM `TokensSelectProducts` \
-                    WHERE `TokenID` = %s"
-        pysql.run(sql_stmt, (token_id, ))
+        pysql.run(TOKEN_DETAILS_STMT, (token_id, ))
 
         # Get the token product details
         token_details = pysql.result
@@ -193,16 +277,20 @@ class TokenManager:
     # @retval (TokenID, Assigned?) (list of tuples)
     @staticmethod
     def __get_all_tokens_status(pysql):
-        # Get the all the products of the given token
-        sql_stmt = "SELECT `TokenID`, `Assigned?` \
-                    FROM `Tokens`"
-        pysql.run(sql_stmt)
+        # Get the all the tokens
+        pysql.run(TOKENS_STATUS_STMT)
 
         # Get the token statuses
         token_status = pysql.result
 
         return token_status
 
+    # @ref __add_tokens
+    @staticmethod
+    def add_tokens(pysql, count):
+        return pysql.run_transaction(TokenManager.__add_tokens,
+                                     count)
+
     # @ref __add_token
     @staticmethod
     def add_token(pysql):
@@ -225,6 +313,11 @@ class TokenManager:
         return pysql.run_transaction(TokenManager.__put_token,
                                      token_id)
 
+    # @ref __reset_tokens
+    @staticmethod
+    def reset_tokens(pysql):
+        return pysql.run_transaction(TokenManager.__reset_tokens)
+
     # @ref __is_token_assigned
     @staticmethod
     def is_token_assigned(pysql, token_id):
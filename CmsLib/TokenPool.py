@@ -0,0 +1,153 @@
+# Import the required modules
+import heapq
+import threading
+import time
+
+# Highest number of tokens (the token ids have at most four digits)
+MAX_TOKENS = 10000
+
+# Token ids in use, from which the index is loaded
+USED_TOKENS_STMT = "SELECT `TokenID` \
+                    FROM `Tokens`"
+
+# @brief This class keeps the index of the free token numbers so that a
+#        token can be added without reading the whole Tokens table. The
+#        numbers below the high water mark which are not used are kept in
+#        a min-heap and every number from the high water mark up is free,
+#        so adding or removing a token is O(log n).
+# @note  The index is loaded from the Tokens table on first use, dropped
+#        when the transaction which changed it rolls back and loaded again
+#        every refresh_interval seconds to see the tokens removed by the
+#        other processes (a number added by another process is skipped on
+#        the duplicate key error)
+class TokenPool:
+
+    # @brief This method initializes the TokenPool object
+    # @param max_tokens Highest number of tokens (int)
+    # @param refresh_interval Seconds after which the index is loaded again (float)
+    def __init__(self, max_tokens = MAX_TOKENS, refresh_interval = 60):
+        self.max_tokens = max_tokens
+        self.refresh_interval = refresh_interval
+        # Min-heap of the free numbers below the high water mark
+        self.__free = []
+        # Every number from the high water mark up is free
+        self.__end = 0
+        # Time at which the index was loaded (None if not loaded)
+        self.__loaded_at = None
+        self.__lock = threading.Lock()
+
+    # @brief This method returns the token id of a token number
+    # @param number Token number (int)
+    # @retval token_id TokenID (string)
+    @staticmethod
+    def token_id(number):
+        return "TOK-" + format(number, "02d")
+
+    # @brief This method returns the token number of a token id
+    # @param token_id TokenID (string)
+    # @retval number Token number (int)
+    @staticmethod
+    def token_number(token_id):
+        return int(token_id[4:])
+
+    # @brief This method tells if the index must be loaded from the Tokens
+    #        table (not loaded or too old)
+    def __is_stale(self):
+        return self.__loaded_at is None or time.monotonic() - self.__loaded_at >= self.refresh_interval
+
+    # @brief This method loads the index from the token ids in use
+    # @param rows (TokenID, ) of the Tokens table (list of tuples)
+    def __load(self, rows):
+        used = {TokenPool.token_number(token[0]) for token in rows}
+
+        # The numbers in increasing order already form a heap
+        self.__end = max(used) + 1 if used else 0
+        self.__free = [number for number in range(self.__end) if number not in used]
+        self.__loaded_at = time.monotonic()
+
+    # @brief This method takes the lowest free token numbers from the index
+    # @param count Number of tokens to be added (int)
+    # @retval numbers Token numbers in increasing order (list of ints)
+    # @retval None Not enough free token numbers
+    def __take(self, count):
+        # Check if the tokens to be added are out of limit
+        if count > len(self.__free) + self.max_tokens - self.__end:
+            return None
+
+        numbers = [heapq.heappop(self.__free) for _ in range(min(count, len(self.__free)))]
+        numbers += range(self.__end, self.__end + count - len(numbers))
+        self.__end = max(self.__end, numbers[-1] + 1) if numbers else self.__end
+        return numbers
+
+    # @brief This method takes the lowest free token numbers
+    # @param pysql PySql object in a transaction
+    # @param count Number of tokens to be added (int)
+    # @retval numbers Token numbers in increasing order (list of ints)
+    # @retval None Not enough free token numbers
+    # @note  The Tokens table is read without holding the lock, the rows read
+    #        are dropped if another thread loaded the index meanwhile
+    def take(self, pysql, count):
+        rows = None
+        while True:
+            if rows is None and self.__is_stale():
+                pysql.run(USED_TOKENS_STMT)
+                rows = pysql.result
+
+            with self.__lock:
+                if rows is not None and self.__is_stale():
+                    self.__load(rows)
+                # Read the table again if the index was dropped meanwhile
+                if self.__loaded_at is not None:
+                    numbers = self.__take(count)
+                    break
+
+        # The numbers are not taken if the transaction rolls back
+        pysql.after_rollback(self.invalidate)
+        return numbers
+
+    # @ref   take
+    # @param pysql AsyncPySql object in a transaction
+    # @note  Holding the lock during the read would block the event loop
+    async def take_async(self, pysql, count):
+        rows = None
+        while True:
+            if rows is None and self.__is_stale():
+                await pysql.run(USED_TOKENS_STMT)
+                rows = pysql.result
+
+            with self.__lock:
+                if rows is not None and self.__is_stale():
+                    self.__load(rows)
+                # Read the table again if the index was dropped meanwhile
+                if self.__loaded_at is not None:
+                    numbers = self.__take(count)
+                    break
+
+        # The numbers are not taken if the transaction rolls back
+        pysql.after_rollback(self.invalidate)
+        return numbers
+
+    # @brief This method puts back the number of a removed token
+    # @param pysql PySql object in a transaction
+    # @param number Token number (int)
+    def release(self, pysql, number):
+        with self.__lock:
+            if self.__loaded_at is not None and number < self.__end:
+                heapq.heappush(self.__free, number)
+
+        pysql.after_rollback(self.invalidate)
+
+    # @brief This method drops the index so that it is loaded again on the
+    #        next use
+    def invalidate(self):
+        with self.__lock:
+            self.__loaded_at = None
+
+    # @brief This method returns the state of the index
+    # @retval stats {"loaded", "free", "high_water_mark", "max_tokens"} (dict)
+    def stats(self):
+        with self.__lock:
+            return {"loaded": self.__loaded_at is not None,
+                    "free": len(self.__free) + self.max_tokens - self.__end,
+                    "high_water_mark": self.__end,
+                    "max_tokens": self.max_tokens}
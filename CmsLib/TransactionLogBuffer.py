@@ -0,0 +1,269 @@
+# Import the required modules
+import logging
+import queue
+import threading
+import time
+
+# Logger of the errors of the background writer
+logger = logging.getLogger("CmsLib")
+
+# Highest number of rows written by one INSERT statement
+MAX_ROWS_PER_STATEMENT = 1000
+
+# Times a batch is written again by the background writer before it is
+# dropped (logged and counted in the "dropped" metric)
+WRITE_ATTEMPTS = 3
+
+# @brief This function returns the multi-row INSERT statements writing rows
+#        of InventoryTransactions
+# @param rows (TransactionID, TransactionType, ProductID, Quantity, Timestamp)
+#        (list of tuples, a Timestamp of None is the time of the insert)
+# @retval (statement, parameters) (list of tuples)
+def insert_statements(rows):
+    statements = []
+    for start in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+        chunk = rows[start:start + MAX_ROWS_PER_STATEMENT]
+        sql_stmt = "INSERT INTO `InventoryTransactions` \
+                    VALUES " + ", ".join(["(%s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))"] * len(chunk))
+        statements.append((sql_stmt, [value for row in chunk for value in row]))
+    return statements
+
+# @brief This function writes rows of InventoryTransactions with multi-row
+#        INSERT statements
+# @param run Function running a statement with its parameters
+# @param rows (TransactionID, TransactionType, ProductID, Quantity, Timestamp)
+#        (list of tuples, a Timestamp of None is the time of the insert)
+def write_rows(run, rows):
+    for sql_stmt, params in insert_statements(rows):
+        run(sql_stmt, params)
+
+# @brief This class buffers the InventoryTransactions logged by the current
+#        transaction of each thread and writes them with multi-row inserts,
+#        instead of one insert per movement
+# @note  In the "commit" mode the rows are written just before the
+#        transaction commits, so they are committed (or rolled back) with the
+#        movements they log. In the "background" mode they are handed to a
+#        writer thread after the commit through a bounded queue, which
+#        blocks the committing threads while it is full; the rows are
+#        stamped with the time of the server just before the transaction
+#        commits (as in the commit mode), then written shortly after the
+#        commit and lost if the process dies before they are written. The ids are
+#        taken when the rows are logged, so the order of the ids is the
+#        order of the movements in both modes. The rows logged by an
+#        asyncio task are kept in the state of its transaction instead
+#        (append_async), in the background mode the task blocks the event
+#        loop while the queue is full.
+class TransactionLogBuffer:
+
+    # @brief This method initializes the TransactionLogBuffer object
+    # @param mode "commit" or "background" (string)
+    # @param pool ConnectionPool used by the background writer
+    # @param queue_size Highest number of committed batches waiting for the
+    #        background writer (int)
+    def __init__(self, mode = "commit", pool = None, queue_size = 1000):
+        if mode not in ("commit", "background"):
+            raise ValueError("Invalid transaction log mode {}".format(mode))
+
+        self.mode = mode
+        self.pool = pool
+        # Rows logged by the current transaction of each thread
+        self.__local = threading.local()
+        # Batches waiting for the background writer
+        self.__queue = queue.Queue(queue_size)
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__stats = {"rows": 0, "statements": 0, "dropped": 0}
+
+    # @brief This method returns the rows logged by the current transaction
+    #        of the thread
+    def __rows(self):
+        rows = getattr(self.__local, 'rows', None)
+        if rows is None:
+            rows = self.__local.rows = []
+        return rows
+
+    # @brief This method buffers rows logged by the current transaction
+    # @param pysql PySql object in a transaction
+    # @param rows (TransactionID, TransactionType, ProductID, Quantity) (list of tuples)
+    def append(self, pysql, rows):
+        if not rows:
+            return
+        buffered = self.__rows()
+        self.__buffer(pysql, buffered, rows,
+                      lambda: self.__flush(pysql, buffered),
+                      lambda: self.__stamp(pysql, buffered))
+
+    # @ref   append
+    # @param pysql AsyncPySql object in a transaction
+    def append_async(self, pysql, rows):
+        if not rows:
+            return
+        buffered = pysql.log_rows
+        self.__buffer(pysql, buffered, rows,
+                      lambda: self.__flush_async(pysql, buffered),
+                      lambda: self.__stamp_async(pysql, buffered))
+
+    # @brief This method adds rows to the buffer of a transaction
+    # @param pysql PySql or AsyncPySql object in a transaction
+    # @param buffered Rows of the transaction (list)
+    # @param rows (TransactionID, TransactionType, ProductID, Quantity) (list of tuples)
+    # @param flush Function writing the rows just before the commit
+    # @param stamp Function stamping the rows just before the commit
+    def __buffer(self, pysql, buffered, rows, flush, stamp):
+        # Write the rows of the transaction when it commits
+        if not buffered:
+            if self.mode == "commit":
+                pysql.before_commit(flush)
+            else:
+                pysql.before_commit(stamp)
+                pysql.after_commit(lambda: self.__enqueue(buffered))
+            pysql.after_rollback(buffered.clear)
+
+        start = len(buffered)
+        buffered += [tuple(row) + (None, ) for row in rows]
+
+        # Drop the rows if the savepoint in which they are logged rolls back
+        pysql.after_rollback(lambda: buffered.__delitem__(slice(start, start + len(rows))))
+
+    # @brief This method takes the rows out of the buffer of a transaction
+    # @param buffered Rows of the transaction (list)
+    # @retval rows Rows of InventoryTransactions (list of tuples)
+    @staticmethod
+    def __take(buffered):
+        rows = buffered[:]
+        del buffered[:]
+        return rows
+
+    # @brief This method counts the rows written
+    # @param rows Rows of InventoryTransactions (list of tuples)
+    def __count(self, rows):
+        with self.__lock:
+            self.__stats["rows"] += len(rows)
+            self.__stats["statements"] += -(-len(rows) // MAX_ROWS_PER_STATEMENT)
+
+    # @brief This method writes the rows of the transaction on its connection
+    # @param pysql PySql object in a transaction
+    # @param buffered Rows of the transaction (list)
+    def __flush(self, pysql, buffered):
+        rows = TransactionLogBuffer.__take(buffered)
+        write_rows(pysql.run, rows)
+        self.__count(rows)
+
+    # @ref   __flush
+    # @param pysql AsyncPySql object in a transaction
+    async def __flush_async(self, pysql, buffered):
+        rows = TransactionLogBuffer.__take(buffered)
+        for sql_stmt, params in insert_statements(rows):
+            await pysql.run(sql_stmt, params)
+        self.__count(rows)
+
+    # @brief This method stamps the rows of the transaction with the time of
+    #        the server, read on its connection before it commits
+    # @param pysql PySql object in a transaction
+    # @param buffered Rows of the transaction (list)
+    @staticmethod
+    def __stamp(pysql, buffered):
+        pysql.run("SELECT NOW()")
+        now = pysql.scalar_result
+        buffered[:] = [row[:4] + (now, ) for row in buffered]
+
+    # @ref   __stamp
+    # @param pysql AsyncPySql object in a transaction
+    @staticmethod
+    async def __stamp_async(pysql, buffered):
+        await pysql.run("SELECT NOW()")
+        now = pysql.scalar_result
+        buffered[:] = [row[:4] + (now, ) for row in buffered]
+
+    # @brief This method hands the committed rows to the background writer,
+    #        waiting while its queue is full
+    # @param buffered Rows of the transaction (list)
+    def __enqueue(self, buffered):
+        rows = TransactionLogBuffer.__take(buffered)
+        if not rows:
+            return
+
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target = self.__run, name = "TransactionLogBuffer", daemon = True)
+                self.__thread.start()
+
+        self.__queue.put(rows)
+
+    # @brief This method writes the queued rows in batches (background thread)
+    def __run(self):
+        while True:
+            rows = self.__queue.get()
+            if rows is None:
+                self.__queue.task_done()
+                return
+
+            # Take the other batches already waiting, in order
+            batches = 1
+            while len(rows) < MAX_ROWS_PER_STATEMENT:
+                try:
+                    more = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    # Put back the stop request behind the rows
+                    self.__queue.task_done()
+                    self.__queue.put(None)
+                    break
+                rows += more
+                batches += 1
+
+            self.__write(rows)
+            for _ in range(batches):
+                self.__queue.task_done()
+
+    # @brief This method writes rows in a transaction of the writer pool
+    # @param rows Rows of InventoryTransactions (list of tuples)
+    def __write(self, rows):
+        for attempt in range(WRITE_ATTEMPTS):
+            connection = self.pool.checkout()
+            discard = True
+            try:
+                cursor = connection.cursor()
+                write_rows(cursor.execute, rows)
+                cursor.close()
+                connection.commit()
+                discard = False
+
+                self.__count(rows)
+                return
+            except Exception:
+                logger.exception("Writing %d transaction log rows failed (attempt %d)", len(rows), attempt + 1)
+                try:
+                    connection.rollback()
+                    discard = False
+                except Exception:
+                    pass
+            finally:
+                self.pool.checkin(connection, discard)
+
+            time.sleep(0.1 * 2 ** attempt)
+
+        # Give up on the rows
+        logger.error("Dropped the transaction log rows %s", [row[0] for row in rows])
+        with self.__lock:
+            self.__stats["dropped"] += len(rows)
+
+    # @brief This method waits until the background writer has written all
+    #        the rows queued
+    def flush(self):
+        self.__queue.join()
+
+    # @brief This method writes the queued rows and stops the background writer
+    def close(self):
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__queue.put(None)
+            thread.join()
+
+    # @brief This method returns the writer metrics
+    # @retval stats {"rows", "statements", "dropped", "queued"} (dict)
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats, queued = self.__queue.qsize())
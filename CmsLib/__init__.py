@@ -1,9 +1,15 @@
-from CmsLib.PySql import PySql
+from CmsLib.PySql import PySql, TransactionError
 from CmsLib.ProductManager import ProductManager
+from CmsLib.ProductCatalog import ProductCatalog
+from CmsLib.ProductSearch import ProductSearch
 from CmsLib.TokenManager import TokenManager
+from CmsLib.TokenPool import TokenPool
 from CmsLib.InventoryManager import InventoryManager
 from CmsLib.CounterManager import CounterManager
 from CmsLib.OrderManager import OrderManager
 from CmsLib.InvoiceManager import InvoiceManager
+from CmsLib.PartitionManager import PartitionManager
+from CmsLib.AsyncPySql import AsyncPySql
+from CmsLib.AsyncManagers import AsyncTokenManager, AsyncCounterManager, AsyncInvoiceManager
 
 print("Imported CMS module")
@@ -0,0 +1,103 @@
+# Benchmark of the day level reports of the inventory transactions on a
+# synthetic log of millions of rows, it times the old DATE(`Timestamp`) = day
+# filters against the half-open timestamp ranges used by InventoryManager.
+# The log is generated in a scratch copy of InventoryTransactions (with the
+# same indexes) which is dropped at the end.
+# > cd benchmarks
+# > python date_range_reports.py [rows] [days]
+
+# Import the required modules
+import datetime
+import random
+import sys
+import time
+sys.path += ["../"]
+from CmsLib import *
+
+# Scratch table of the synthetic log
+TABLE = "BenchInventoryTransactions"
+
+# Rows inserted from python before the table is doubled in sql
+SEED_ROWS = 1000
+
+# (name, old query, new query) of the reports timed, the parameters are
+# the product and the day
+QUERIES = [("transactions by date",
+            "SELECT COUNT(*) FROM " + TABLE + " WHERE DATE(`Timestamp`) = %(day)s",
+            "SELECT COUNT(*) FROM " + TABLE + " WHERE `Timestamp` >= CAST(%(day)s AS DATE) AND `Timestamp` < CAST(%(day)s AS DATE) + INTERVAL 1 DAY"),
+           ("transactions of product by date",
+            "SELECT COUNT(*) FROM " + TABLE + " WHERE `ProductID` = %(product)s AND DATE(`Timestamp`) = %(day)s",
+            "SELECT COUNT(*) FROM " + TABLE + " WHERE `ProductID` = %(product)s AND `Timestamp` >= CAST(%(day)s AS DATE) AND `Timestamp` < CAST(%(day)s AS DATE) + INTERVAL 1 DAY")]
+
+# @brief This function creates the synthetic log
+# @param pysql PySql object
+# @param rows Number of rows (int, rounded up to the seed rows times a power of two)
+# @param days Number of days covered by the log (int)
+def create_log(pysql, rows, days):
+    pysql.run("DROP TABLE IF EXISTS " + TABLE)
+    pysql.run("CREATE TABLE " + TABLE + " LIKE InventoryTransactions")
+
+    pysql.run("SELECT `ProductID` FROM `Products`")
+    product_ids = [row[0] for row in pysql.result]
+
+    # Insert the seed rows spread over the days
+    start = datetime.datetime.now() - datetime.timedelta(days = days)
+    seed = [("TRC-" + format(i, "010d"),
+             random.choice(["COUNTER_SUB", "COUNTER_ADD", "INVENTORY_TO_COUNTER", "INVENTORY_ADD", "INVENTORY_SUB"]),
+             random.choice(product_ids),
+             random.randint(1, 100),
+             start + datetime.timedelta(seconds = random.randrange(days * 86400))) for i in range(SEED_ROWS)]
+    pysql.run_many("INSERT INTO " + TABLE + " VALUES (%s, %s, %s, %s, %s)", seed)
+
+    # Double the rows, moving the copies to random times of the period
+    count = SEED_ROWS
+    while count < rows:
+        pysql.run("INSERT INTO " + TABLE + " \
+                   SELECT CONCAT('TRC-', LPAD(CAST(SUBSTRING(`TransactionID`, 5) AS UNSIGNED) + %s, 10, '0')), \
+                          `TransactionType`, `ProductID`, `Quantity`, \
+                          %s + INTERVAL FLOOR(RAND() * %s) SECOND \
+                   FROM " + TABLE, (count, start, days * 86400))
+        count *= 2
+
+    return product_ids, start, count
+
+# @brief This function times a query over the sample of days
+# @param pysql PySql object
+# @param sql_stmt The sql statement (string)
+# @param samples Parameters of the query (list of dicts)
+# @retval (mean milliseconds per query, rows examined of the first sample)
+def time_query(pysql, sql_stmt, samples):
+    start = time.perf_counter()
+    for params in samples:
+        pysql.run(sql_stmt, params)
+        pysql.result
+    milliseconds = (time.perf_counter() - start) * 1000 / len(samples)
+
+    pysql.run("EXPLAIN " + sql_stmt, samples[0])
+    columns = [column[0] for column in pysql.mysql_cursor.description]
+    plan = dict(zip(columns, pysql.first_result))
+
+    return milliseconds, plan["rows"], plan["key"]
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+
+    # Create the sql handle
+    pysql = PySql(None, "db.yaml")
+
+    start = time.perf_counter()
+    product_ids, first_day, rows = pysql.run_transaction(create_log, rows, days)
+    print("Generated {} rows over {} days in {:.1f} s".format(rows, days, time.perf_counter() - start))
+
+    # Query 20 random days (and products)
+    samples = [{"product": random.choice(product_ids),
+                "day": (first_day + datetime.timedelta(days = random.randrange(days))).strftime("%Y-%m-%d")} for _ in range(20)]
+
+    for name, old_stmt, new_stmt in QUERIES:
+        for label, sql_stmt in (("DATE()", old_stmt), ("range", new_stmt)):
+            milliseconds, examined, key = pysql.run_transaction(time_query, sql_stmt, samples, commit = False)
+            print("{:<32} {:>7}: {:9.2f} ms/query, ~{} rows examined, index {}".format(name, label, milliseconds, examined, key))
+
+    pysql.run_transaction(lambda pysql: pysql.run("DROP TABLE " + TABLE))
+    pysql.close()
@@ -0,0 +1,90 @@
+# Benchmark comparing the sales of a single hot product through the plain
+# conditional update of its Inventory row and through escrow slabs (one
+# slab per caller), it reports the sales/s and the InnoDB row lock waits of
+# each mode and checks that nothing was oversold. Like hot_product_sales.py
+# it runs only against a scratch database and sells its own product.
+# > cd benchmarks
+# > python escrow_contention.py <scratch_db.yaml> [callers] [units] [slab_size]
+
+# Import the required modules
+import os
+import sys
+import tempfile
+import threading
+import time
+import yaml
+sys.path += ["../"]
+from CmsLib import *
+from hot_product_sales import PRODUCT_ID, open_scratch_database, stock_counter, get_tokens, put_back, sell_units
+
+# @brief This function returns the InnoDB row lock counters of the server
+# @param pysql PySql object
+# @retval (waits, milliseconds waited) (tuple of ints)
+def get_row_lock_status(pysql):
+    pysql.run("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%'")
+    status = dict(pysql.result)
+    return int(status["Innodb_row_lock_waits"]), int(status["Innodb_row_lock_time"])
+
+# @brief This function sells all the units of the product from the callers
+# @param pysql PySql object
+# @param callers Number of concurrent callers (int)
+# @param units Units put on the counter (int)
+# @retval (units sold, units on the counter, seconds, lock waits,
+#         milliseconds waited)
+def run_sales(pysql, callers, units):
+    units = stock_counter(pysql, units)
+    token_ids = get_tokens(pysql, callers)
+
+    # Read the counters of the primary, where the sales run
+    waits, wait_time = pysql.run_transaction(get_row_lock_status)
+
+    # Sell from all the callers at once
+    sold = []
+    threads = [threading.Thread(target = sell_units, args = (pysql, token_id, PRODUCT_ID, sold)) for token_id in token_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    end_waits, end_wait_time = pysql.run_transaction(get_row_lock_status)
+
+    # Put the units and the tokens back
+    put_back(pysql, token_ids)
+
+    return sum(sold), units, seconds, end_waits - waits, end_wait_time - wait_time
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python escrow_contention.py <scratch_db.yaml> [callers] [units] [slab_size]")
+    path = sys.argv[1]
+    callers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    units = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    slab_size = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+
+    # Write the configuration of the escrow mode (a slab per caller)
+    db_details = yaml.load(open(path), Loader = yaml.FullLoader)
+    db_details["escrow"] = {"products": {PRODUCT_ID: slab_size}, "shards": callers}
+    escrow_yaml = tempfile.NamedTemporaryFile("w", suffix = ".yaml", delete = False)
+    yaml.dump(db_details, escrow_yaml)
+    escrow_yaml.close()
+
+    results = {}
+    for mode, mode_path in (("row update", path), ("escrow", escrow_yaml.name)):
+        # Create the sql handle with a connection per caller
+        pysql = open_scratch_database(mode_path, callers)
+
+        results[mode] = run_sales(pysql, callers, units)
+
+        # Return the slabs to the counter
+        if pysql.escrow is not None:
+            print("Escrow:", pysql.escrow.stats())
+        pysql.close()
+
+    os.unlink(escrow_yaml.name)
+
+    print("Callers:", callers)
+    for mode, (sold, units, seconds, waits, wait_time) in results.items():
+        print("{:>10}: sold {} of {:g} units in {:.3f} s ({:.0f} sales/s), {} row lock waits ({} ms), oversold {}".format(
+              mode, sold, units, seconds, sold / seconds, waits, wait_time, max(0, sold - units)))
@@ -0,0 +1,118 @@
+# Stress test of CounterManager.add_counter_to_token on a single hot
+# product, concurrent callers sell one unit at a time until the counter is
+# sold out, then it checks that no unit was oversold and reports the
+# sales/s. It runs only against a scratch database, whose .yaml file sets
+# benchmark_scratch: true, and sells a product of its own (BEN-01), which is
+# stocked and put back on the counter through the logged manager methods so
+# the transaction log stays consistent with the stock.
+# > cd benchmarks
+# > python hot_product_sales.py <scratch_db.yaml> [callers] [units]
+
+# Import the required modules
+import sys
+import threading
+import time
+import yaml
+sys.path += ["../"]
+from CmsLib import *
+
+# Product sold by the benchmarks (created in the scratch database)
+PRODUCT_ID = "BEN-01"
+PRODUCT_NAME = "Benchmark product"
+
+# @brief This function creates the sql handle of a scratch database
+# @param path Path to the .yaml file of the scratch database (string)
+# @param callers Number of concurrent callers, a connection each (int)
+# @retval pysql PySql object
+def open_scratch_database(path, callers):
+    db_details = yaml.load(open(path), Loader = yaml.FullLoader)
+    if not db_details.get("benchmark_scratch"):
+        sys.exit(path + " is not a scratch database (set benchmark_scratch: true in it)")
+
+    pysql = PySql(None, path)
+    pysql.pool.max_size = callers
+    return pysql
+
+# @brief This function puts at least the given units of the benchmark
+#        product on the counter, ordering the missing stock
+# @param pysql PySql object
+# @param units Units wanted on the counter (int)
+# @retval Units on the counter (float)
+def stock_counter(pysql, units):
+    if not ProductManager.product_exists(pysql, PRODUCT_ID):
+        ProductManager.add_product(pysql, PRODUCT_ID, PRODUCT_NAME, None, 1, "pcs", 0, 0)
+
+    missing = units - float(InventoryManager.get_displayed_quantity(pysql, PRODUCT_ID) or 0)
+    if missing > 0:
+        stored = float(InventoryManager.get_stored_quantity(pysql, PRODUCT_ID) or 0)
+        if stored < missing:
+            OrderManager.receive_order(pysql, OrderManager.place_order(pysql, [(PRODUCT_ID, missing - stored)]))
+        CounterManager.add_inventory_to_counter(pysql, PRODUCT_ID, missing)
+
+    return float(InventoryManager.get_displayed_quantity(pysql, PRODUCT_ID))
+
+# @brief This function gets a token per caller
+# @param pysql PySql object
+# @param callers Number of concurrent callers (int)
+# @retval token_ids TokenIDs (list of strings)
+def get_tokens(pysql, callers):
+    token_ids = [TokenManager.get_token(pysql) for _ in range(callers)]
+    if None in token_ids:
+        print("Not enough free tokens for", callers, "callers")
+        sys.exit(1)
+    return token_ids
+
+# @brief This function puts the units sold back on the counter and the
+#        tokens back
+# @param pysql PySql object
+# @param token_ids TokenIDs of the callers (list of strings)
+def put_back(pysql, token_ids):
+    for token_id in token_ids:
+        CounterManager.add_token_to_counter(pysql, token_id, PRODUCT_ID)
+        TokenManager.put_token(pysql, token_id)
+
+# @brief This function sells one unit at a time until the counter is empty
+# @param pysql PySql object
+# @param token_id TokenID of the caller (string)
+# @param product_id ProductID (string)
+# @param sold List to which the number of units sold is appended
+def sell_units(pysql, token_id, product_id, sold):
+    units = 0
+    while CounterManager.add_counter_to_token(pysql, token_id, product_id, 1) == 0:
+        units += 1
+    sold.append(units)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python hot_product_sales.py <scratch_db.yaml> [callers] [units]")
+    callers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    units = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    # Create the sql handle with a connection per caller
+    pysql = open_scratch_database(sys.argv[1], callers)
+
+    # Put the units on the counter and get a token per caller
+    units = stock_counter(pysql, units)
+    token_ids = get_tokens(pysql, callers)
+
+    # Sell from all the callers at once
+    sold = []
+    threads = [threading.Thread(target = sell_units, args = (pysql, token_id, PRODUCT_ID, sold)) for token_id in token_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    left = InventoryManager.get_displayed_quantity(pysql, PRODUCT_ID)
+    print("Callers:", callers)
+    print("Sold: {} of {:g} units in {:.3f} s ({:.0f} sales/s)".format(sum(sold), units, seconds, sum(sold) / seconds))
+    print("Left on counter:", left)
+    print("Oversold:", max(0, sum(sold) - units))
+    print("Retries:", pysql.retry_stats().get("CounterManager.add_counter_to_token", {}).get("retries", 0))
+
+    # Put the units and the tokens back
+    put_back(pysql, token_ids)
+
+    pysql.close()
@@ -0,0 +1,54 @@
+# Benchmark of TokenManager.get_token with many concurrent callers, it
+# issues all the free tokens, checks that no token was issued twice and
+# puts the tokens back
+# > cd benchmarks
+# > python token_issuance.py [callers]
+
+# Import the required modules
+import sys
+import threading
+import time
+sys.path += ["../"]
+from CmsLib import *
+
+# @brief This function issues tokens until none is free
+# @param pysql PySql object
+# @param issued List to which the issued tokens are appended
+def issue_tokens(pysql, issued):
+    while True:
+        token_id = TokenManager.get_token(pysql)
+        if token_id is None:
+            return
+        issued.append(token_id)
+
+if __name__ == "__main__":
+    callers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+
+    # Create the sql handle with a connection per caller
+    pysql = PySql(None, "db.yaml")
+    pysql.pool.max_size = callers
+
+    # Get the number of free tokens
+    free_tokens = [token_id for token_id, assigned in TokenManager.get_all_tokens_status(pysql) if not assigned]
+    print("Free tokens:", len(free_tokens))
+
+    # Issue the tokens from all the callers at once
+    issued = []
+    threads = [threading.Thread(target = issue_tokens, args = (pysql, issued)) for _ in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    print("Callers:", callers)
+    print("Issued: {} tokens in {:.3f} s ({:.0f} tokens/s)".format(len(issued), seconds, len(issued) / seconds))
+    print("Duplicates:", len(issued) - len(set(issued)))
+    print("Retries:", pysql.retry_stats().get("TokenManager.get_token", {}).get("retries", 0))
+
+    # Put the tokens back
+    for token_id in issued:
+        TokenManager.put_token(pysql, token_id)
+
+    pysql.close()
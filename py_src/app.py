@@ -1,9 +1,10 @@
 # Import the required libraries
-from flask import Flask, render_template, request, redirect, session
+from flask import Flask, Response, render_template, request, redirect, session
 import sys
 from decimal import Decimal
 import pdfkit
 import re
+import json
 sys.path.append('../')
 from CmsLib import *
 
@@ -19,6 +20,33 @@ invoice_id_global = ""
 # Create the pysql object for database programming
 pysql = PySql(app, 'db.yaml')
 
+# Products returned by the autocomplete and the largest number allowed
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+# Rows shown in a page of the logs and the largest page allowed
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# @brief This function returns the page size requested (bounded)
+# @retval page_size Number of rows in the page (int)
+def get_page_size():
+    try:
+        page_size = int(request.args.get('PageSize', PAGE_SIZE))
+    except ValueError:
+        page_size = PAGE_SIZE
+    return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+# Failed transaction handler
+@app.errorhandler(TransactionError)
+def transaction_error(error):
+    return "Could not complete {}. Please try again.".format(error.method), 503
+
+# Metrics page (prometheus text format)
+@app.route('/metrics')
+def metrics():
+    return Response(pysql.render_metrics(), mimetype = 'text/plain; version=0.0.4')
+
 # Index page
 @app.route('/', methods = ['GET', 'POST'])
 def index():
@@ -37,6 +65,7 @@ def inventory_manager():
                    "ViewProducts",
                    "OrderDetails",
                    "OrdersBetweenDates",
+                   "ViewOrders",
                    "TransactionLog",
                    "ProductDateTransactionLog"]
 
@@ -236,15 +265,49 @@ def inventory_manager_orders_between_dates():
         return render_template('/InventoryManager/inventory_manager_orders_between_dates.html')
 
 
-# Transaction log page
+# View orders page (one page at a time)
+@app.route('/InventoryManager/ViewOrders', methods = ['GET', 'POST'])
+def inventory_manager_view_orders():
+    # Get the cursor and the filters of the page
+    after_id = request.args.get('After') or None
+    status = request.args.get('Status') or None
+    product_id = request.args.get('ProductID') or None
+    page_size = get_page_size()
+
+    # Get the orders of the page
+    orders, next_id = OrderManager.get_orders_page(pysql, after_id, page_size, status, product_id)
+    # If no orders
+    if not orders and after_id is None:
+        return render_template('InventoryManager/inventory_manager_alert.html', result="No orders found")
+
+    # Get the products for the filter
+    products = ProductManager.get_all_products(pysql)
+    return render_template('/InventoryManager/inventory_manager_view_orders.html', orders=orders, next_id=next_id,
+                           status=status, product_id=product_id, page_size=page_size,
+                           products=[(each[0], each[1]) for each in products])
+
+
+# Transaction log page (one page at a time)
 @app.route('/InventoryManager/TransactionLog', methods = ['GET', 'POST'])
 def inventory_manager_transaction_log():
-    # Get the transactions
-    transactions = InventoryManager.get_transactions(pysql)
+    # Get the cursor and the filters of the page
+    after_id = request.args.get('After') or None
+    transaction_type = request.args.get('TransactionType') or None
+    product_id = request.args.get('ProductID') or None
+    page_size = get_page_size()
+
+    # Get the transactions of the page
+    transactions, next_id = InventoryManager.get_transactions_page(pysql, after_id, page_size, transaction_type, product_id)
     # If no transactions
-    if not transactions:
+    if not transactions and after_id is None:
         return render_template('InventoryManager/inventory_manager_alert.html', result="No transactions found")
-    return render_template('/InventoryManager/inventory_manager_transaction_log.html', transactions=transactions)
+
+    # Get the products for the filter
+    products = ProductManager.get_all_products(pysql)
+    return render_template('/InventoryManager/inventory_manager_transaction_log.html', transactions=transactions, next_id=next_id,
+                           transaction_type=transaction_type, product_id=product_id, page_size=page_size,
+                           products=[(each[0], each[1]) for each in products],
+                           transaction_types=["COUNTER_ADD", "COUNTER_SUB", "INVENTORY_TO_COUNTER", "INVENTORY_ADD", "INVENTORY_SUB"])
 
 
 # Product date transaction page
@@ -441,6 +504,21 @@ def counter_operator_add_products_to_token():
     else:
         return render_template('/CounterOperator/counter_operator_add_products_to_token.html')
 
+# Product name autocomplete (JSON)
+@app.route('/CounterOperator/SearchProducts')
+def counter_operator_search_products():
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('Limit', SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+    except ValueError:
+        limit = SEARCH_LIMIT
+
+    products = [{"ProductID": product[0],
+                 "Name": product[1],
+                 "UnitPrice": str(product[3]),
+                 "UnitType": product[4]} for product in ProductManager.search_products(pysql, query, limit)]
+    return Response(json.dumps(products), mimetype = 'application/json')
+
 # Add products from inventory to counter
 @app.route('/CounterOperator/AddInventoryToCounter', methods=['GET', 'POST'])
 def counter_operator_add_inventory_to_counter():
@@ -0,0 +1,38 @@
+# Bulk import of a CSV product list (columns ProductID, Name, Description,
+# UnitPrice, UnitType, SGST, CGST and optionally CurrentDiscount) or, with
+# --prices, of a CSV price list (columns ProductID and UnitPrice). The file
+# is streamed and written in chunks of chunk_size rows, each in a
+# transaction of its own, and the rows rejected are reported with their
+# line number.
+# > cd py_src
+# > python import_products.py <csv_file> [--prices] [chunk_size]
+
+# Import the required modules
+import sys
+sys.path += ["../"]
+from CmsLib import *
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--prices"]
+    if not args:
+        sys.exit("Usage: python import_products.py <csv_file> [--prices] [chunk_size]")
+    prices = "--prices" in sys.argv
+    chunk_size = int(args[1]) if len(args) > 1 else 500
+
+    # Create the sql handle
+    pysql = PySql(None, "db.yaml")
+
+    with open(args[0], newline = "") as csv_file:
+        if prices:
+            report = ProductManager.import_prices(pysql, csv_file, chunk_size)
+        else:
+            report = ProductManager.import_products(pysql, csv_file, chunk_size)
+
+    for line, reason in report["errors"]:
+        print("Line {}: {}".format(line, reason))
+    print("Wrote {} of {} rows in {:.2f} s ({:.0f} rows/s)".format(report["written"],
+                                                                  report["rows"],
+                                                                  report["seconds"],
+                                                                  report["rows_per_second"]))
+
+    pysql.close()
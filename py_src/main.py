@@ -7,24 +7,25 @@ from CmsLib import *
 # > sudo mysql
 # > sourece ./cms_ddl.sql
 
-# Create the sql handle
-pysql = PySql("bhaskar", "biggy", "CMS")
-pysql.connect_py_sql()
+# Create the sql handle (the connections are pooled, no flask app needed)
+pysql = PySql(None, "db.yaml")
 
 # Add few products
 ProductManager.add_product(pysql, "JBL-83", "Jalebi", "Damn Good", 35.1, "kg", 2.51)
 ProductManager.add_product(pysql, "GOL-12", "Dunno", "Too sweet", 70.8, "kg", 6.37)
 ProductManager.add_product(pysql, "PIP-88", "PeePee", "Too hard", 10.0, "pcs", 0.9)
 
-# Initialize the inventory
-pysql.run("INSERT INTO Inventory VALUES ('JBL-83', 2000, 800, 600)")
-pysql.run("INSERT INTO Inventory VALUES ('GOL-12', 1000, 300, 100)")
+# @brief This function initializes the inventory and adds the tokens
+# @param pysql PySql object
+def init_store(pysql):
+    # Initialize the inventory
+    pysql.run("INSERT INTO Inventory (ProductID, StoredQuantity, DisplayedQuantity, StoreThreshold) VALUES ('JBL-83', 2000, 800, 600)")
+    pysql.run("INSERT INTO Inventory (ProductID, StoredQuantity, DisplayedQuantity, StoreThreshold) VALUES ('GOL-12', 1000, 300, 100)")
 
-# Add the tokens (100 tokens)
-token_ids = []
-for i in range(0, 100):
-    token_ids.append(("TOK-" + format(i, "02d"), ))
-pysql.run_many("INSERT INTO Tokens (TokenID) VALUES (%s)", token_ids)
+    # Add the tokens (100 tokens)
+    TokenManager.add_tokens(pysql, 100)
+
+pysql.run_transaction(init_store)
 
 # Get tokens for two customers
 tok1 = TokenManager.get_token(pysql)
@@ -44,12 +45,20 @@ CounterManager.add_inventory_to_counter(pysql, "PIP-88", 200)
 # Place orders for chaklis and pedha
 ord_id = OrderManager.place_order(pysql, [("JBL-83", 1000), ("GOL-12", 3000)])
 
-# Asshuming tokens 1 and 2 generate a same invoice
-inv_id = InvoiceManager.generate_invoice(pysql, [tok1, tok2], "wallet")
-InvoiceManager.give_additional_discount(pysql, inv_id, 200)
+# Asshuming tokens 1 and 2 generate a same invoice (the invoice and its
+# discount are committed together as one transaction)
+with pysql.transaction():
+    inv_id = InvoiceManager.generate_invoice(pysql, [tok1, tok2], "wallet")
+    InvoiceManager.give_additional_discount(pysql, inv_id, 200)
 # Replace the tokens 1 and 2
 TokenManager.put_token(pysql, tok1)
 TokenManager.put_token(pysql, tok2)
 
 # Asshuming the orders arrived
 OrderManager.receive_order(pysql, ord_id)
+
+# Put back the tokens left assigned when the store closes
+TokenManager.reset_tokens(pysql)
+
+# Close the pooled connections
+pysql.close()
@@ -0,0 +1,44 @@
+# Maintenance job of the monthly partitions of InventoryTransactions, it
+# returns the escrow slabs left by the processes which did not exit cleanly,
+# takes an inventory checkpoint, creates the partitions of the coming months
+# and moves the partitions older than the months kept to archive tables
+# (InventoryTransactions_YYYYMM). Run it daily (e.g. from cron) so that the
+# next months always exist and the stock at any time is rebuilt from a
+# checkpoint of the same day.
+# > cd py_src
+# > python maintenance.py [months_ahead] [keep_months]
+
+# Import the required modules
+import sys
+sys.path += ["../"]
+from CmsLib import *
+from CmsLib.InventoryEscrow import InventoryEscrow
+
+if __name__ == "__main__":
+    months_ahead = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    keep_months = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+
+    # Create the sql handle
+    pysql = PySql(None, "db.yaml")
+
+    # Return the slabs of every holder to the counter (the slabs of the
+    # processes which crashed are stranded otherwise)
+    escrow = pysql.escrow or InventoryEscrow(pysql.pool, {})
+    print("Returned slabs", escrow.return_slabs(all_holders = True))
+
+    # Snapshot the inventory (the rows of the background log may still be
+    # queued in the other processes)
+    if pysql.transaction_log.mode == "commit":
+        print("Created checkpoint", InventoryManager.create_checkpoint(pysql))
+    else:
+        print("Skipped the checkpoint, the transaction log is written in the background")
+
+    # Create the partitions of the coming months
+    for name in PartitionManager.create_partitions(pysql, months_ahead):
+        print("Created partition", name)
+
+    # Archive the partitions of the old months
+    for name in PartitionManager.archive_partitions(pysql, keep_months):
+        print("Archived partition", name)
+
+    pysql.close()
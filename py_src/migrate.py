@@ -0,0 +1,125 @@
+# Applies the pending migrations of sql_src/migrations in order of their
+# version. MySQL commits every DDL statement (CREATE, ALTER, DROP, ...) on
+# its own, so a migration is not transactional: each statement applied is
+# recorded in SchemaMigrationSteps as soon as it has run, and a migration
+# which failed half way resumes at the failed statement when this is run
+# again (the SET statements of the session are run again every time).
+# > cd py_src
+# > python migrate.py
+
+# Import the required modules
+import glob
+import os
+import re
+import sys
+sys.path += ["../"]
+from CmsLib import *
+
+# Directory of the migration scripts (named <version>_<description>.sql)
+MIGRATIONS_DIR = "../sql_src/migrations"
+
+# Statements setting the state of the session, which are not recorded as
+# steps as they must be run again on the connection of every attempt
+SESSION_REGEX = re.compile(r"^SET\s", re.IGNORECASE)
+
+# @brief This function creates the table of the migration steps applied
+#        (the migrations record their steps from the first one)
+# @param pysql PySql object
+def create_steps_table(pysql):
+    sql_stmt = "CREATE TABLE IF NOT EXISTS SchemaMigrationSteps ( \
+                       `Version`   INT UNSIGNED, \
+                       `Step`      INT UNSIGNED, \
+                       `AppliedAt` DATETIME DEFAULT CURRENT_TIMESTAMP, \
+                       CONSTRAINT `SchemaMigrationSteps_PK` PRIMARY KEY (Version, Step) \
+                )"
+    pysql.run(sql_stmt)
+
+# @brief This function returns the versions of the migrations already applied
+# @param pysql PySql object
+# @retval versions Applied versions (set of ints)
+# @note  Run it on the primary (commit = True), a replica may lag behind the
+#        migrations just applied
+def get_applied_versions(pysql):
+    sql_stmt = "SELECT `Version` \
+                FROM `SchemaMigrations`"
+    try:
+        pysql.run(sql_stmt)
+    except Exception:
+        # The database predates the migrations
+        return set()
+
+    return {row[0] for row in pysql.result}
+
+# @brief This function returns the steps of a migration already applied
+# @param pysql PySql object
+# @param version Version of the migration (int)
+# @retval steps Applied steps (set of ints)
+def get_applied_steps(pysql, version):
+    sql_stmt = "SELECT `Step` \
+                FROM `SchemaMigrationSteps` \
+                WHERE `Version` = %s"
+    pysql.run(sql_stmt, (version, ))
+
+    return {row[0] for row in pysql.result}
+
+# @brief This function runs the statements of a migration script not yet
+#        applied, recording each one once it has run
+# @param pysql PySql object
+# @param version Version of the migration (int)
+# @param statements The sql statements (list of strings)
+# @note  The statements run on one connection, so the SET statements hold
+#        for the whole migration. A statement which ran just before the
+#        process died without recording its step is run again, so check the
+#        schema by hand if that statement then fails.
+def apply_migration(pysql, version, statements):
+    applied_steps = get_applied_steps(pysql, version)
+
+    for step, sql_stmt in enumerate(statements, 1):
+        if SESSION_REGEX.match(sql_stmt):
+            pysql.run(sql_stmt)
+            continue
+        if step in applied_steps:
+            continue
+
+        pysql.run(sql_stmt)
+        sql_stmt = "INSERT INTO `SchemaMigrationSteps` (`Version`, `Step`) \
+                    VALUES (%s, %s)"
+        pysql.run(sql_stmt, (version, step))
+        # Record the step at once (a DDL statement is already committed)
+        pysql.commit()
+
+# @brief This function splits a migration script into its statements
+# @param path Path of the script
+# @retval statements The sql statements (list of strings)
+def read_statements(path):
+    # Remove the comment lines
+    lines = [line for line in open(path) if not line.strip().startswith("--")]
+    # Split at the semicolons ending a line
+    statements = re.split(r";\s*$", "".join(lines), flags = re.MULTILINE)
+
+    return [sql_stmt.strip() for sql_stmt in statements if sql_stmt.strip()]
+
+if __name__ == "__main__":
+    # Create the sql handle
+    pysql = PySql(None, "db.yaml")
+
+    # Read the applied versions from the primary
+    pysql.run_transaction(create_steps_table)
+    applied_versions = pysql.run_transaction(get_applied_versions)
+
+    # Apply the pending migrations in order of their version
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        version = int(os.path.basename(path).split("_")[0])
+        if version in applied_versions:
+            continue
+
+        print("Applying", os.path.basename(path))
+        try:
+            pysql.run_transaction(apply_migration, version, read_statements(path))
+        except TransactionError as error:
+            print("Migration", version, "stopped:", error.error)
+            print("The statements before the failed one stay applied, run migrate.py again once fixed")
+            pysql.close()
+            sys.exit(1)
+
+    pysql.close()
@@ -13,6 +13,13 @@ DROP TABLE IF EXISTS Orders;
 DROP TABLE IF EXISTS TokensSelectProducts;
 DROP TABLE IF EXISTS OrdersOfProducts;
 DROP TABLE IF EXISTS ProductsInInvoices;
+DROP TABLE IF EXISTS InventoryEscrow;
+DROP TABLE IF EXISTS InventoryCheckpointStock;
+DROP TABLE IF EXISTS InventoryCheckpoints;
+DROP TABLE IF EXISTS Sequences;
+DROP TABLE IF EXISTS CatalogVersion;
+DROP TABLE IF EXISTS SchemaMigrations;
+DROP TABLE IF EXISTS SchemaMigrationSteps;
 
 -- Create the schemas
 
@@ -37,16 +44,18 @@ CREATE TABLE IF NOT EXISTS Invoices (
        `DiscountGiven` NUMERIC(9, 3) UNSIGNED DEFAULT 0,
        `PaymentMode`   ENUM ("cash", "card", "wallet"),
        CONSTRAINT `Invoices_PK_FMT` CHECK (InvoiceID REGEXP "^INV-[0-9]{10}$"),
-       CONSTRAINT `Invoices_PK` PRIMARY KEY (InvoiceID)
+       CONSTRAINT `Invoices_PK` PRIMARY KEY (InvoiceID),
+       INDEX `Invoices_Date` (InvoiceDate)
 );
 
 CREATE TABLE IF NOT EXISTS Tokens (
-       `TokenID`   CHAR(6),
+       `TokenID`   CHAR(8),
        `Assigned?` BOOLEAN DEFAULT FALSE,
        `InvoiceID` CHAR(14) DEFAULT NULL,
-       CONSTRAINT `Tokens_PK_FMT` CHECK (TokenID REGEXP "^TOK-[0-9]{2}$"),
+       CONSTRAINT `Tokens_PK_FMT` CHECK (TokenID REGEXP "^TOK-[0-9]{2,4}$"),
        CONSTRAINT `Tokens_PK` PRIMARY KEY (TokenID),
-       CONSTRAINT `Tokens_FK` FOREIGN KEY (InvoiceID) REFERENCES Invoices (InvoiceID)
+       CONSTRAINT `Tokens_FK` FOREIGN KEY (InvoiceID) REFERENCES Invoices (InvoiceID),
+       INDEX `Tokens_Assigned` (`Assigned?`, (CHAR_LENGTH(TokenID)), TokenID)
 );
 
 CREATE TABLE IF NOT EXISTS Inventory (
@@ -54,8 +63,10 @@ CREATE TABLE IF NOT EXISTS Inventory (
        `StoredQuantity`    NUMERIC(9, 3) UNSIGNED,
        `DisplayedQuantity` NUMERIC(9, 3) UNSIGNED,
        `StoreThreshold`    NUMERIC(9, 3) UNSIGNED,
+       `BelowThreshold?`   BOOLEAN AS (`StoredQuantity` <= `StoreThreshold`) STORED,
        CONSTRAINT `Inventory_PK` PRIMARY KEY (ProductID),
-       CONSTRAINT `Inventory_FK` FOREIGN KEY (ProductID) REFERENCES Products (ProductID)
+       CONSTRAINT `Inventory_FK` FOREIGN KEY (ProductID) REFERENCES Products (ProductID),
+       INDEX `Inventory_BelowThreshold` (`BelowThreshold?`, ProductID)
 );
 
 CREATE TABLE IF NOT EXISTS Orders (
@@ -64,7 +75,8 @@ CREATE TABLE IF NOT EXISTS Orders (
        `Delivered?` BOOLEAN DEFAULT FALSE,
        `Cancelled?` BOOLEAN DEFAULT FALSE,
        CONSTRAINT `Orders_PK_FMT` CHECK (OrderID REGEXP "^ORD-[0-9]{10}$"),
-       CONSTRAINT `Orders_PK` PRIMARY KEY (OrderID)
+       CONSTRAINT `Orders_PK` PRIMARY KEY (OrderID),
+       INDEX `Orders_Date` (OrderDate)
 );
 
 CREATE TABLE IF NOT EXISTS InventoryTransactions (
@@ -72,10 +84,17 @@ CREATE TABLE IF NOT EXISTS InventoryTransactions (
        `TransactionType` ENUM ("COUNTER_SUB", "COUNTER_ADD", "INVENTORY_SUB", "INVENTORY_ADD", "INVENTORY_TO_COUNTER"),
        `ProductID`       CHAR(6),
        `Quantity`        NUMERIC(9, 3) UNSIGNED,
-       `Timestamp`       DATETIME,
+       `Timestamp`       DATETIME NOT NULL,
        CONSTRAINT `InventoryTransactions_PK_FMT` CHECK (TransactionID REGEXP "^TRC-[0-9]{10}$"),
-       CONSTRAINT `InventoryTransactions_PK` PRIMARY KEY (TransactionID),
-       CONSTRAINT `InventoryTransactions_FK` FOREIGN KEY (ProductID) REFERENCES Products (ProductID)
+       CONSTRAINT `InventoryTransactions_PK` PRIMARY KEY (TransactionID, `Timestamp`),
+       INDEX `InventoryTransactions_Product_Time` (ProductID, `Timestamp`),
+       INDEX `InventoryTransactions_Time` (`Timestamp`)
+)
+-- Monthly partitions (created by py_src/maintenance.py) between p_start
+-- and p_future, a partitioned table cannot have foreign keys
+PARTITION BY RANGE COLUMNS (`Timestamp`) (
+       PARTITION `p_start` VALUES LESS THAN ('2000-01-01'),
+       PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
 );
 
 CREATE TABLE IF NOT EXISTS OrdersOfProducts (
@@ -88,7 +107,7 @@ CREATE TABLE IF NOT EXISTS OrdersOfProducts (
 );
 
 CREATE TABLE IF NOT EXISTS TokensSelectProducts (
-       `TokenID`   CHAR(6),
+       `TokenID`   CHAR(8),
        `ProductID` CHAR(6),
        `Quantity`  NUMERIC(9, 3) UNSIGNED,
        CONSTRAINT `TokensSelectProducts_PK` PRIMARY KEY (TokenID, ProductID),
@@ -110,3 +129,70 @@ CREATE TABLE IF NOT EXISTS ProductsInInvoices (
        CONSTRAINT `ProductsInInvoices_FK2` FOREIGN KEY (ProductID) REFERENCES Products (ProductID)
 );
 
+-- Displayed quantity of the hot products reserved in slabs by each worker
+-- (moved to and from Inventory by the InventoryEscrow)
+CREATE TABLE IF NOT EXISTS InventoryEscrow (
+       `ProductID` CHAR(6),
+       `HolderID`  VARCHAR(64),
+       `Quantity`  NUMERIC(9, 3) UNSIGNED NOT NULL DEFAULT 0,
+       CONSTRAINT `InventoryEscrow_PK` PRIMARY KEY (ProductID, HolderID),
+       CONSTRAINT `InventoryEscrow_FK` FOREIGN KEY (ProductID) REFERENCES Inventory (ProductID)
+);
+
+-- Snapshots of the stored and displayed quantities (with the escrow
+-- slabs) used to rebuild the stock at a point in time
+CREATE TABLE IF NOT EXISTS InventoryCheckpoints (
+       `CheckpointID`      INT UNSIGNED AUTO_INCREMENT,
+       `CreatedAt`         DATETIME NOT NULL,
+       `LastTransactionID` CHAR(14),
+       CONSTRAINT `InventoryCheckpoints_PK` PRIMARY KEY (CheckpointID),
+       INDEX `InventoryCheckpoints_Time` (CreatedAt)
+);
+
+CREATE TABLE IF NOT EXISTS InventoryCheckpointStock (
+       `CheckpointID`      INT UNSIGNED,
+       `ProductID`         CHAR(6),
+       `StoredQuantity`    NUMERIC(9, 3) UNSIGNED,
+       `DisplayedQuantity` NUMERIC(9, 3) UNSIGNED,
+       CONSTRAINT `InventoryCheckpointStock_PK` PRIMARY KEY (CheckpointID, ProductID),
+       CONSTRAINT `InventoryCheckpointStock_FK` FOREIGN KEY (CheckpointID) REFERENCES InventoryCheckpoints (CheckpointID) ON DELETE CASCADE
+);
+
+-- Next ids of the InventoryTransactions, Orders and Invoices (reserved in
+-- blocks by the SequenceAllocator)
+CREATE TABLE IF NOT EXISTS Sequences (
+       `SequenceName` VARCHAR(32),
+       `NextValue`    BIGINT UNSIGNED NOT NULL DEFAULT 0,
+       CONSTRAINT `Sequences_PK` PRIMARY KEY (SequenceName)
+);
+
+INSERT INTO Sequences (SequenceName) VALUES ("InventoryTransactions"), ("Orders"), ("Invoices");
+
+-- Version of the product catalog (bumped by every change of Products, so
+-- that the cached catalogs of the workers are refreshed)
+CREATE TABLE IF NOT EXISTS CatalogVersion (
+       `CatalogName` VARCHAR(32),
+       `Version`     BIGINT UNSIGNED NOT NULL DEFAULT 0,
+       CONSTRAINT `CatalogVersion_PK` PRIMARY KEY (CatalogName)
+);
+
+INSERT INTO CatalogVersion (CatalogName) VALUES ("Products");
+
+-- Versions of the migrations in sql_src/migrations already applied (a
+-- fresh database created by this script is at the latest version)
+CREATE TABLE IF NOT EXISTS SchemaMigrations (
+       `Version`   INT UNSIGNED,
+       `AppliedAt` DATETIME DEFAULT CURRENT_TIMESTAMP,
+       CONSTRAINT `SchemaMigrations_PK` PRIMARY KEY (Version)
+);
+
+INSERT INTO SchemaMigrations (Version) VALUES (1), (2), (3), (4), (5), (6), (7), (8), (9), (10);
+
+-- Statements of the migrations applied, recorded one by one as MySQL
+-- commits every DDL statement on its own
+CREATE TABLE IF NOT EXISTS SchemaMigrationSteps (
+       `Version`   INT UNSIGNED,
+       `Step`      INT UNSIGNED,
+       `AppliedAt` DATETIME DEFAULT CURRENT_TIMESTAMP,
+       CONSTRAINT `SchemaMigrationSteps_PK` PRIMARY KEY (Version, Step)
+);
@@ -0,0 +1,23 @@
+-- Migration 1: Sequences table for the InventoryTransactions, Orders and
+-- Invoices ids, seeded after the largest id already used
+
+CREATE TABLE IF NOT EXISTS SchemaMigrations (
+       `Version`   INT UNSIGNED,
+       `AppliedAt` DATETIME DEFAULT CURRENT_TIMESTAMP,
+       CONSTRAINT `SchemaMigrations_PK` PRIMARY KEY (Version)
+);
+
+CREATE TABLE IF NOT EXISTS Sequences (
+       `SequenceName` VARCHAR(32),
+       `NextValue`    BIGINT UNSIGNED NOT NULL DEFAULT 0,
+       CONSTRAINT `Sequences_PK` PRIMARY KEY (SequenceName)
+);
+
+INSERT INTO Sequences (SequenceName, NextValue)
+       SELECT "InventoryTransactions", COALESCE(MAX(CAST(SUBSTRING(TransactionID, 5) AS UNSIGNED)) + 1, 0) FROM InventoryTransactions
+       UNION ALL
+       SELECT "Orders", COALESCE(MAX(CAST(SUBSTRING(OrderID, 5) AS UNSIGNED)) + 1, 0) FROM Orders
+       UNION ALL
+       SELECT "Invoices", COALESCE(MAX(CAST(SUBSTRING(InvoiceID, 5) AS UNSIGNED)) + 1, 0) FROM Invoices;
+
+INSERT INTO SchemaMigrations (Version) VALUES (1);
@@ -0,0 +1,6 @@
+-- Migration 2: index to find an unassigned token without scanning Tokens
+-- (TokenManager.get_token locks it with FOR UPDATE SKIP LOCKED)
+
+CREATE INDEX `Tokens_Assigned` ON Tokens (`Assigned?`, TokenID);
+
+INSERT INTO SchemaMigrations (Version) VALUES (2);
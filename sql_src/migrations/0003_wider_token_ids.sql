@@ -0,0 +1,15 @@
+-- Migration 3: token ids with up to four digits (TOK-00 to TOK-9999) so that
+-- the token pool can hold thousands of live tokens
+
+-- The referencing column is widened together with the referenced one
+SET FOREIGN_KEY_CHECKS = 0;
+
+ALTER TABLE TokensSelectProducts MODIFY `TokenID` CHAR(8);
+
+ALTER TABLE Tokens DROP CHECK `Tokens_PK_FMT`,
+                   MODIFY `TokenID` CHAR(8),
+                   ADD CONSTRAINT `Tokens_PK_FMT` CHECK (TokenID REGEXP "^TOK-[0-9]{2,4}$");
+
+SET FOREIGN_KEY_CHECKS = 1;
+
+INSERT INTO SchemaMigrations (Version) VALUES (3);
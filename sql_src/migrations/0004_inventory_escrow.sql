@@ -0,0 +1,12 @@
+-- Migration 4: slabs of the displayed quantity of the hot products reserved
+-- by each worker, so that their sales do not all update one Inventory row
+
+CREATE TABLE IF NOT EXISTS InventoryEscrow (
+       `ProductID` CHAR(6),
+       `HolderID`  VARCHAR(64),
+       `Quantity`  NUMERIC(9, 3) UNSIGNED NOT NULL DEFAULT 0,
+       CONSTRAINT `InventoryEscrow_PK` PRIMARY KEY (ProductID, HolderID),
+       CONSTRAINT `InventoryEscrow_FK` FOREIGN KEY (ProductID) REFERENCES Inventory (ProductID)
+);
+
+INSERT INTO SchemaMigrations (Version) VALUES (4);
@@ -0,0 +1,13 @@
+-- Migration 5: indexes for the date filtered reports (queried as half-open
+-- ranges of timestamps), the index on (ProductID, Timestamp) replaces the
+-- one created for the foreign key on ProductID
+
+ALTER TABLE InventoryTransactions ADD INDEX `InventoryTransactions_Product_Time` (ProductID, `Timestamp`),
+                                  ADD INDEX `InventoryTransactions_Time` (`Timestamp`),
+                                  DROP INDEX `InventoryTransactions_FK`;
+
+CREATE INDEX `Invoices_Date` ON Invoices (InvoiceDate);
+
+CREATE INDEX `Orders_Date` ON Orders (OrderDate);
+
+INSERT INTO SchemaMigrations (Version) VALUES (5);
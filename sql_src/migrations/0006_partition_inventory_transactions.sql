@@ -0,0 +1,17 @@
+-- Migration 6: InventoryTransactions partitioned by month on Timestamp (a
+-- partitioned table cannot have foreign keys and its primary key must
+-- contain Timestamp). The rows stay in p_future until the monthly
+-- partitions are created by py_src/maintenance.py
+
+ALTER TABLE InventoryTransactions DROP FOREIGN KEY `InventoryTransactions_FK`;
+
+ALTER TABLE InventoryTransactions MODIFY `Timestamp` DATETIME NOT NULL,
+                                  DROP PRIMARY KEY,
+                                  ADD CONSTRAINT `InventoryTransactions_PK` PRIMARY KEY (TransactionID, `Timestamp`);
+
+ALTER TABLE InventoryTransactions PARTITION BY RANGE COLUMNS (`Timestamp`) (
+       PARTITION `p_start` VALUES LESS THAN ('2000-01-01'),
+       PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+INSERT INTO SchemaMigrations (Version) VALUES (6);
@@ -0,0 +1,23 @@
+-- Migration 7: snapshots of the stored and displayed quantities (the
+-- displayed quantity includes the escrow slabs), from which the stock at a
+-- point in time is rebuilt by replaying only the log between the nearest
+-- checkpoint and that time
+
+CREATE TABLE IF NOT EXISTS InventoryCheckpoints (
+       `CheckpointID`      INT UNSIGNED AUTO_INCREMENT,
+       `CreatedAt`         DATETIME NOT NULL,
+       `LastTransactionID` CHAR(14),
+       CONSTRAINT `InventoryCheckpoints_PK` PRIMARY KEY (CheckpointID),
+       INDEX `InventoryCheckpoints_Time` (CreatedAt)
+);
+
+CREATE TABLE IF NOT EXISTS InventoryCheckpointStock (
+       `CheckpointID`      INT UNSIGNED,
+       `ProductID`         CHAR(6),
+       `StoredQuantity`    NUMERIC(9, 3) UNSIGNED,
+       `DisplayedQuantity` NUMERIC(9, 3) UNSIGNED,
+       CONSTRAINT `InventoryCheckpointStock_PK` PRIMARY KEY (CheckpointID, ProductID),
+       CONSTRAINT `InventoryCheckpointStock_FK` FOREIGN KEY (CheckpointID) REFERENCES InventoryCheckpoints (CheckpointID) ON DELETE CASCADE
+);
+
+INSERT INTO SchemaMigrations (Version) VALUES (7);
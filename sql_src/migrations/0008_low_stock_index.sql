@@ -0,0 +1,8 @@
+-- Migration 8: generated column telling if the stored quantity of a
+-- product is below its threshold, indexed so that the low stock products
+-- are listed without scanning the inventory
+
+ALTER TABLE Inventory ADD COLUMN `BelowThreshold?` BOOLEAN AS (`StoredQuantity` <= `StoreThreshold`) STORED,
+                      ADD INDEX `Inventory_BelowThreshold` (`BelowThreshold?`, ProductID);
+
+INSERT INTO SchemaMigrations (Version) VALUES (8);
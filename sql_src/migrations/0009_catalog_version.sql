@@ -0,0 +1,13 @@
+-- Migration 9: version of the product catalog, bumped by every change of
+-- the Products table so that the workers find out that their cached
+-- catalog is stale with one primary key read
+
+CREATE TABLE IF NOT EXISTS CatalogVersion (
+       `CatalogName` VARCHAR(32),
+       `Version`     BIGINT UNSIGNED NOT NULL DEFAULT 0,
+       CONSTRAINT `CatalogVersion_PK` PRIMARY KEY (CatalogName)
+);
+
+INSERT INTO CatalogVersion (CatalogName) VALUES ("Products");
+
+INSERT INTO SchemaMigrations (Version) VALUES (9);
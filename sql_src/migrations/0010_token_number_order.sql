@@ -0,0 +1,9 @@
+-- Migration 10: order the free tokens by their number, the token ids of
+-- more than two digits (TOK-100) sorting after the shorter ones (TOK-99)
+-- instead of between them as strings (TokenManager.get_token)
+
+DROP INDEX `Tokens_Assigned` ON Tokens;
+
+CREATE INDEX `Tokens_Assigned` ON Tokens (`Assigned?`, (CHAR_LENGTH(TokenID)), TokenID);
+
+INSERT INTO SchemaMigrations (Version) VALUES (10);
@@ -0,0 +1,372 @@
+# Fixtures running the managers on a SQLite stand-in of the MySQL database.
+# The schema is translated from sql_src/cms_ddl.sql and the statements of
+# the managers from the MySQL dialect, so the real PySql (pool, savepoints,
+# hooks and transaction log) is exercised without a server.
+# AsyncPySql runs on aiomysql style wrappers of the same connections.
+# > python -m pytest tests
+
+# Import the required modules
+import asyncio
+import decimal
+import datetime
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+import MySQLdb
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from CmsLib import *
+from CmsLib.ConnectionPool import ConnectionPool
+
+# The modules of the managers (the package exports their classes)
+inventory_module = sys.modules["CmsLib.InventoryManager"]
+product_module = sys.modules["CmsLib.ProductManager"]
+token_module = sys.modules["CmsLib.TokenManager"]
+
+# Schema of the database
+DDL_PATH = os.path.join(os.path.dirname(__file__), "..", "sql_src", "cms_ddl.sql")
+
+# The NUMERIC columns are read as Decimal and the DATETIME columns as
+# datetime, as from MySQLdb
+sqlite3.register_adapter(decimal.Decimal, float)
+sqlite3.register_converter("NUMERIC", lambda value: decimal.Decimal(value.decode()))
+sqlite3.register_converter("DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+# (pattern, replacement) of the MySQL statements run by the managers
+STATEMENT_RULES = [(re.compile(r"\s+FOR UPDATE( SKIP LOCKED)?|\s+LOCK IN SHARE MODE"), ""),
+                   (re.compile(r"ON DUPLICATE KEY UPDATE"), "ON CONFLICT DO UPDATE SET"),
+                   (re.compile(r"VALUES\((`\w+`)\)"), r"excluded.\1"),
+                   (re.compile(r"^(\s*INSERT INTO [^(]*\([^)]*\)\s*)\((SELECT[\s\S]*)\)\s*$"), r"\1\2"),
+                   (re.compile(r"NOW\(\)"), "CURRENT_TIMESTAMP"),
+                   (re.compile(r"%s"), "?")]
+
+# (pattern, replacement) of the MySQL schema
+SCHEMA_RULES = [(re.compile(r"^(DROP|CREATE) DATABASE.*$|^USE .*$", re.M), ""),
+                (re.compile(r"ENUM \([^)]*\)"), "TEXT"),
+                (re.compile(r"(`\w+`)(\s+NUMERIC\([\d, ]+\)) UNSIGNED"), r"\1\2 CHECK (\1 >= 0)"),
+                (re.compile(r" UNSIGNED"), ""),
+                (re.compile(r"\"([^\"]*)\""), r"'\1'"),
+                (re.compile(r",\s*INDEX `\w+` \((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\)"), ""),
+                (re.compile(r"\)\s*(--[^\n]*\s*)*PARTITION BY[\s\S]*?\n\);"), ");"),
+                (re.compile(r"INT AUTO_INCREMENT,"), "INTEGER PRIMARY KEY AUTOINCREMENT,"),
+                (re.compile(r",\s*CONSTRAINT `InventoryCheckpoints_PK` PRIMARY KEY \(CheckpointID\)"), "")]
+
+# @brief This function translates a MySQL statement to SQLite
+# @param sql_stmt The sql statement (string)
+# @retval The SQLite statement (string)
+def translate(sql_stmt):
+    for pattern, replacement in STATEMENT_RULES:
+        sql_stmt = pattern.sub(replacement, sql_stmt)
+    return sql_stmt
+
+# @brief This function returns the schema of cms_ddl.sql in SQLite
+def sqlite_schema():
+    with open(DDL_PATH) as ddl:
+        schema = ddl.read()
+    for pattern, replacement in SCHEMA_RULES:
+        schema = pattern.sub(replacement, schema)
+    return schema
+
+# @brief This function evaluates REGEXP as MySQL
+def regexp(pattern, value):
+    return value is not None and re.search(pattern, value) is not None
+
+# @brief This function connects to a SQLite database as the managers expect
+def sqlite_connect(path):
+    connection = sqlite3.connect(path, timeout = 5, isolation_level = None,
+                                 detect_types = sqlite3.PARSE_DECLTYPES, check_same_thread = False)
+    connection.create_function("REGEXP", 2, regexp)
+    connection.create_function("CHAR_LENGTH", 1, lambda value: None if value is None else len(value), deterministic = True)
+    connection.execute("PRAGMA foreign_keys = ON")
+    return connection
+
+# @brief This class is a MySQLdb style cursor over a SQLite connection
+class SqliteCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.__rows = []
+
+    # @brief This method runs a statement, raising the MySQLdb errors
+    def __execute(self, function, sql_stmt, params):
+        self.connection.begin()
+        try:
+            cursor = function(translate(sql_stmt), params)
+        except sqlite3.IntegrityError as error:
+            raise MySQLdb.IntegrityError(1062, str(error))
+        except sqlite3.OperationalError as error:
+            if "locked" in str(error):
+                raise MySQLdb.OperationalError(1205, str(error))
+            raise MySQLdb.ProgrammingError(1064, "{} in {}".format(error, sql_stmt))
+
+        self.description = cursor.description
+        self.__rows = [tuple(row) for row in cursor.fetchall()] if cursor.description else []
+        self.rowcount = len(self.__rows) if cursor.description else cursor.rowcount
+
+    def execute(self, sql_stmt, params = None):
+        self.__execute(self.connection.raw.execute, sql_stmt, tuple(params or ()))
+
+    def executemany(self, sql_stmt, params):
+        params = [tuple(row) for row in params]
+        if params:
+            self.__execute(self.connection.raw.executemany, sql_stmt, params)
+
+    def fetchall(self):
+        rows, self.__rows = tuple(self.__rows), []
+        return rows
+
+    def fetchone(self):
+        return self.__rows.pop(0) if self.__rows else None
+
+    def fetchmany(self, size):
+        rows, self.__rows = self.__rows[:size], self.__rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+# @brief This class is a MySQLdb style connection to a SQLite database,
+#        which begins a transaction before the first statement (as InnoDB
+#        with autocommit off)
+class SqliteConnection:
+
+    def __init__(self, path):
+        self.raw = sqlite_connect(path)
+        self.in_transaction = False
+
+    def begin(self):
+        if not self.in_transaction:
+            self.raw.execute("BEGIN")
+            self.in_transaction = True
+
+    def cursor(self, cursor_class = None):
+        return SqliteCursor(self)
+
+    def commit(self):
+        if self.in_transaction:
+            self.in_transaction = False
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.in_transaction:
+            self.in_transaction = False
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        self.raw.close()
+
+# @brief This class hands out the ids of the sequences from memory (a
+#        SQLite writer cannot reserve a block while another connection is
+#        in a write transaction)
+class MemorySequences:
+
+    def __init__(self):
+        self.pool = ConnectionPool(lambda: None)
+        self.__next = {}
+        self.__lock = threading.Lock()
+
+    def next_values(self, name, count):
+        with self.__lock:
+            start = self.__next.get(name, 1)
+            self.__next[name] = start + count
+        return list(range(start, start + count))
+
+    def next_value(self, name):
+        return self.next_values(name, 1)[0]
+
+# @brief This class is an aiomysql style cursor over a SQLite connection
+class AsyncSqliteCursor:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    async def execute(self, sql_stmt, params = None):
+        self.cursor.execute(sql_stmt, params)
+
+    async def executemany(self, sql_stmt, params):
+        self.cursor.executemany(sql_stmt, params)
+
+    async def fetchall(self):
+        return self.cursor.fetchall()
+
+    async def fetchone(self):
+        return self.cursor.fetchone()
+
+    async def close(self):
+        self.cursor.close()
+
+# @brief This class is an aiomysql style connection to a SQLite database
+class AsyncSqliteConnection:
+
+    def __init__(self, path):
+        self.connection = SqliteConnection(path)
+        self.closed = False
+
+    async def cursor(self):
+        return AsyncSqliteCursor(self.connection.cursor())
+
+    async def commit(self):
+        self.connection.commit()
+
+    async def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.connection.close()
+
+# @brief This class is an aiomysql style pool of connections to a SQLite
+#        database
+class AsyncSqlitePool:
+
+    def __init__(self, path):
+        self.path = path
+        self.__idle = []
+
+    async def acquire(self):
+        return self.__idle.pop() if self.__idle else AsyncSqliteConnection(self.path)
+
+    def release(self, connection):
+        if not connection.closed:
+            self.__idle.append(connection)
+
+    def close(self):
+        for connection in self.__idle:
+            connection.close()
+        self.__idle = []
+
+    async def wait_closed(self):
+        pass
+
+# @brief This class is the asyncio counterpart of MemorySequences
+class AsyncMemorySequences:
+
+    def __init__(self):
+        self.pool = AsyncSqlitePool(None)
+        self.__sequences = MemorySequences()
+
+    async def next_values(self, name, count):
+        return self.__sequences.next_values(name, count)
+
+    async def next_value(self, name):
+        return self.__sequences.next_value(name)
+
+# @brief This function reads rows in a transaction of their own
+# @param pysql PySql object
+# @param sql_stmt The sql query (string)
+# @param params Parameters of the query (tuple)
+# @retval Rows of the result (tuple of tuples)
+def query(pysql, sql_stmt, params = None):
+    with pysql.transaction(commit = False):
+        pysql.run(sql_stmt, params)
+        return pysql.result
+
+# @brief This fixture returns a function creating databases with the schema
+#        of cms_ddl.sql (from the name of the database)
+@pytest.fixture
+def make_database(tmp_path):
+    def make_database(name):
+        path = str(tmp_path / "{}.db".format(name))
+        connection = sqlite_connect(path)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(sqlite_schema())
+        connection.close()
+        return path
+
+    return make_database
+
+# @brief This fixture creates a database with the schema of cms_ddl.sql
+# @retval Path of the database file
+@pytest.fixture
+def database(make_database):
+    return make_database("cms")
+
+# @brief This fixture resets the process wide state of the managers
+@pytest.fixture(autouse = True)
+def manager_state():
+    yield
+    product_module.product_catalog.invalidate()
+    token_module.token_pool.invalidate()
+    del inventory_module.low_stock_listeners[:]
+
+# @brief This fixture returns a function writing a .yaml file with the given
+#        settings (sqlite_path is the database of the pools, by default the
+#        database fixture)
+@pytest.fixture
+def make_config(database, tmp_path):
+    configs = []
+
+    def make_config(**settings):
+        db_details = {"mysql_host": "localhost",
+                      "mysql_user": "cms",
+                      "mysql_password": "cms",
+                      "mysql_db": "CMS",
+                      "retry_backoff": 0.001,
+                      "sqlite_path": database}
+        db_details.update(settings)
+        config = tmp_path / "db{}.yaml".format(len(configs))
+        config.write_text(yaml.dump(db_details))
+        configs.append(config)
+        return str(config)
+
+    return make_config
+
+# @brief This fixture returns a function creating PySql objects on the
+#        SQLite database, with the given settings of the .yaml file
+@pytest.fixture
+def make_pysql(make_config, monkeypatch):
+    monkeypatch.setattr(PySql, "_PySql__create_pool",
+                        staticmethod(lambda connect_args, db_details: ConnectionPool(lambda: SqliteConnection(db_details['sqlite_path']),
+                                                                                     max_size = db_details.get('pool_size', 8))))
+    created = []
+
+    def make_pysql(**settings):
+        pysql = PySql(None, make_config(**settings))
+        pysql.sequences = MemorySequences()
+        created.append(pysql)
+        return pysql
+
+    yield make_pysql
+    for pysql in created:
+        pysql.close()
+
+# @brief This fixture creates a PySql object on the SQLite database
+@pytest.fixture
+def pysql(make_pysql):
+    return make_pysql()
+
+# @brief This fixture returns a function creating AsyncPySql objects on the
+#        SQLite database, with the given settings of the .yaml file (the
+#        pools of the escrow and of the transaction log are the ones of
+#        make_pysql)
+@pytest.fixture
+def make_async_pysql(make_config, make_pysql):
+    created = []
+
+    def make_async_pysql(**settings):
+        pysql = AsyncPySql(make_config(**settings))
+        pysql.IntegrityError = MySQLdb.IntegrityError
+        pysql.pool = AsyncSqlitePool(pysql.db_details['sqlite_path'])
+        pysql.sequences = AsyncMemorySequences()
+        created.append(pysql)
+        return pysql
+
+    yield make_async_pysql
+    for pysql in created:
+        asyncio.run(pysql.close())
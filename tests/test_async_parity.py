@@ -0,0 +1,192 @@
+# Import the required modules
+import asyncio
+import datetime
+
+from CmsLib import *
+from conftest import sqlite_connect, token_module
+
+# Async counterpart of each manager
+ASYNC_MANAGERS = {TokenManager: AsyncTokenManager,
+                  CounterManager: AsyncCounterManager,
+                  InvoiceManager: AsyncInvoiceManager}
+
+# Tables compared after the scenarios
+TABLES = ["Tokens", "TokensSelectProducts", "Inventory", "InventoryEscrow",
+          "InventoryTransactions", "Invoices", "ProductsInInvoices"]
+
+# (manager, method, arguments) of the billing of a customer
+SCENARIO = [(TokenManager, "add_tokens", (3, )),
+            (TokenManager, "add_tokens", (0, )),
+            (TokenManager, "remove_token", ("TOK-01", )),
+            (TokenManager, "add_token", ()),
+            (TokenManager, "get_token", ()),
+            (TokenManager, "put_token", ("TOK-02", )),
+            (TokenManager, "remove_token", ("TOK-00", )),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "RIC-01", 2)),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "RIC-01", 1.5)),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "RIC-01", 1000)),
+            (CounterManager, "add_counter_to_token", ("TOK-02", "RIC-01", 1)),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "RIC-01", -1)),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "OIL-01", 1)),
+            (CounterManager, "add_inventory_to_counter", ("DAL-01", 30)),
+            (CounterManager, "add_inventory_to_counter", ("DAL-01", 1000)),
+            (CounterManager, "add_inventory_to_counter", ("OIL-01", 1)),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "DAL-01", 4)),
+            (CounterManager, "add_token_to_counter", ("TOK-00", "DAL-01")),
+            (CounterManager, "add_token_to_counter", ("TOK-00", "DAL-01")),
+            (CounterManager, "add_counter_to_token", ("TOK-00", "DAL-01", 3)),
+            (TokenManager, "put_token", ("TOK-00", )),
+            (TokenManager, "get_token_details", ("TOK-00", )),
+            (TokenManager, "token_has_products", ("TOK-00", )),
+            (TokenManager, "is_token_assigned", ("TOK-02", )),
+            (TokenManager, "get_all_tokens_status", ()),
+            (InvoiceManager, "generate_invoice", (["TOK-00"], "bitcoin")),
+            (InvoiceManager, "generate_invoice", (["TOK-02"], "cash")),
+            (InvoiceManager, "generate_invoice", (["TOK-00"], "cash")),
+            (InvoiceManager, "give_additional_discount", ("INV-0000000001", 5)),
+            (InvoiceManager, "give_additional_discount", ("INV-0000000002", 5)),
+            (InvoiceManager, "get_invoice_details", ("INV-0000000001", )),
+            (TokenManager, "remove_token", ("TOK-00", ))]
+
+# @brief This function adds the products of the scenarios to a database
+# @param path Path of the database file
+def seed(path):
+    connection = sqlite_connect(path)
+    connection.executemany("INSERT INTO `Products` VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           [("RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5, 10),
+                            ("DAL-01", "Dal", "Toor dal", 120, "kg", 2.5, 2.5, 0)])
+    connection.executemany("INSERT INTO `Inventory` (`ProductID`, `StoredQuantity`, `DisplayedQuantity`, `StoreThreshold`) \
+                            VALUES (?, ?, ?, ?)",
+                           [("RIC-01", 50, 10, 5),
+                            ("DAL-01", 40, 0, 20)])
+    connection.close()
+
+# @brief This function returns the rows of the compared tables, without the
+#        times
+# @param path Path of the database file
+def dump(path):
+    connection = sqlite_connect(path)
+    # Read all the tables in one snapshot (the escrow settles in the
+    # background)
+    connection.execute("BEGIN")
+    tables = {table: normalize(connection.execute("SELECT * FROM `{}` ORDER BY 1, 2".format(table)).fetchall())
+              for table in TABLES}
+    connection.close()
+    return tables
+
+# @brief This function replaces the times in results, which differ between
+#        the runs
+def normalize(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return "<time>"
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+# @brief This function runs steps through the managers
+def run_sync(pysql, steps):
+    return [getattr(manager, method)(pysql, *args) for manager, method, args in steps]
+
+# @brief This function runs steps through the async managers
+def run_async(pysql, steps):
+    async def run():
+        return [await getattr(ASYNC_MANAGERS[manager], method)(pysql, *args) for manager, method, args in steps]
+
+    return asyncio.run(run())
+
+# @brief This function runs steps through the sync and the async managers on
+#        two databases with the same products
+# @param make_database Fixture creating the databases
+# @param make_pysql Fixture creating the PySql object
+# @param make_async_pysql Fixture creating the AsyncPySql object
+# @param steps (manager, method, arguments) (list of tuples)
+# @param settings Settings of the .yaml files
+# @param prepare Function called with the path of each database after the seed
+# @retval ((pysql, path, results, tables, notifications), ...) of the sync
+#         and async runs
+def run_both(make_database, make_pysql, make_async_pysql, steps, settings = {}, prepare = None):
+    runs = []
+    for name, make, run in (("sync", make_pysql, run_sync), ("async", make_async_pysql, run_async)):
+        path = make_database(name)
+        seed(path)
+        if prepare is not None:
+            prepare(path)
+
+        # The token pool and the listeners are shared by the process
+        token_module.token_pool.invalidate()
+        notifications = []
+        listener = lambda *args: notifications.append(normalize(args))
+        InventoryManager.add_low_stock_listener(listener)
+        pysql = make(sqlite_path = path, **settings)
+        try:
+            results = normalize(run(pysql, steps))
+        finally:
+            InventoryManager.remove_low_stock_listener(listener)
+        runs.append((pysql, path, results, dump(path), notifications))
+    return runs
+
+# @brief This test runs the billing of a customer through both variants
+def test_billing_parity(make_database, make_pysql, make_async_pysql):
+    (sync_pysql, _, *sync_run), (async_pysql, _, *async_run) = run_both(make_database, make_pysql, make_async_pysql, SCENARIO)
+
+    assert async_run == sync_run
+    results, tables, notifications = sync_run
+    assert results[:7] == [["TOK-00", "TOK-01", "TOK-02"], 1, 0, "TOK-01", "TOK-00", 2, 2]
+    assert results[7:21] == [0, 0, 4, 1, 2, 3, 0, 3, 2, 0, 0, 1, 0, 1]
+    assert results[25:30] == [3, 1, "INV-0000000001", 0, 1]
+    # The stored quantity of the dal crossed its threshold
+    assert notifications == [["DAL-01", True, 10, 20]]
+    assert [row[1] for row in tables["InventoryTransactions"]] == ["COUNTER_SUB", "COUNTER_SUB", "INVENTORY_TO_COUNTER",
+                                                                   "COUNTER_SUB", "COUNTER_ADD", "COUNTER_SUB"]
+    # Each transaction wrote its log with the buffer
+    assert async_pysql.transaction_log.stats() == sync_pysql.transaction_log.stats()
+
+# @brief This test adds a token added meanwhile by another process
+def test_add_token_skips_token_added_elsewhere(make_database, make_pysql, make_async_pysql):
+    steps = [(TokenManager, "add_token", ()),
+             (TokenManager, "get_all_tokens_status", ()),
+             (TokenManager, "add_token", ())]
+
+    runs = []
+    for name, make, run in (("sync", make_pysql, run_sync), ("async", make_async_pysql, run_async)):
+        path = make_database(name)
+        token_module.token_pool.invalidate()
+        pysql = make(sqlite_path = path)
+        assert run(pysql, steps[:1]) == ["TOK-00"]
+        # Another process adds the next token once the pool is loaded
+        connection = sqlite_connect(path)
+        connection.execute("INSERT INTO `Tokens` (`TokenID`) VALUES ('TOK-01')")
+        connection.close()
+        runs.append(normalize(run(pysql, steps[1:])))
+
+    assert runs[0] == runs[1] == [[["TOK-00", 0], ["TOK-01", 0]], "TOK-02"]
+
+# @brief This test sells a hot product from an escrow slab through both
+#        variants
+def test_escrow_parity(make_database, make_pysql, make_async_pysql):
+    steps = [(TokenManager, "add_token", ()),
+             (TokenManager, "get_token", ()),
+             (CounterManager, "add_counter_to_token", ("TOK-00", "RIC-01", 2))]
+    settings = {"escrow": {"products": {"RIC-01": 5}, "holder": "till"}}
+
+    def fill_slab(path):
+        connection = sqlite_connect(path)
+        connection.execute("INSERT INTO `InventoryEscrow` VALUES ('RIC-01', 'till/0', 5)")
+        connection.close()
+
+    runs = run_both(make_database, make_pysql, make_async_pysql, steps, settings, fill_slab)
+    for pysql, path, results, tables, notifications in runs:
+        assert results == ["TOK-00", "TOK-00", 0]
+        assert pysql.escrow.stats()["slab_sales"] == 1
+        # The slab may have been topped up from the counter already
+        displayed = {row[0]: row[2] for row in tables["Inventory"]}
+        held = sum(row[2] for row in tables["InventoryEscrow"])
+        assert displayed["RIC-01"] + held == 13
+
+    # The slabs are returned to the counter on close
+    runs[0][0].close()
+    asyncio.run(runs[1][0].close())
+    tables = [dump(path) for _, path, _, _, _ in runs]
+    assert tables[0] == tables[1]
+    assert tables[0]["InventoryEscrow"] == []
+    assert {row[0]: row[2] for row in tables[0]["Inventory"]}["RIC-01"] == 13
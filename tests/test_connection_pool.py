@@ -0,0 +1,72 @@
+# Import the required modules
+import threading
+import time
+
+import pytest
+
+from CmsLib.ConnectionPool import ConnectionPool, PoolClosedError, PoolTimeoutError
+
+# @brief This class is a connection which records that it was closed
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+# @brief This test times out the checkout of a full pool and hands the
+#        connection checked in to the waiting thread
+def test_checkout_waits_then_times_out():
+    pool = ConnectionPool(FakeConnection, max_size = 1, timeout = 0.1)
+    connection = pool.checkout()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.checkout()
+    assert pool.stats()["timeouts"] == 1
+
+    threading.Timer(0.05, pool.checkin, (connection, )).start()
+    pool.timeout = 5
+    assert pool.checkout() is connection
+    assert pool.stats()["waits"] == 1
+
+# @brief This test reuses a connection until max_lifetime and then opens a
+#        new one
+def test_connection_recycled_after_lifetime():
+    pool = ConnectionPool(FakeConnection, max_lifetime = 0.05)
+    connection = pool.checkout()
+    pool.checkin(connection)
+    assert pool.checkout() is connection
+    pool.checkin(connection)
+
+    time.sleep(0.1)
+    assert pool.checkout() is not connection
+    assert connection.closed
+    assert pool.stats()["recycled"] == 1
+
+# @brief This test closes the idle connections on close, the connections in
+#        use when they are checked in, and refuses the checkouts
+def test_closed_pool_refuses_checkout():
+    pool = ConnectionPool(FakeConnection, max_size = 2)
+    idle, in_use = pool.checkout(), pool.checkout()
+    pool.checkin(idle)
+
+    # A thread waiting for a connection is woken up by the close
+    waiter = ConnectionPool(FakeConnection, max_size = 1)
+    waiter.checkout()
+    errors = []
+    thread = threading.Thread(target = lambda: errors.append(pytest.raises(PoolClosedError, waiter.checkout)))
+    thread.start()
+    time.sleep(0.05)
+    waiter.close()
+    thread.join(5)
+    assert len(errors) == 1
+
+    pool.close()
+    assert idle.closed and not in_use.closed
+    with pytest.raises(PoolClosedError):
+        pool.checkout()
+
+    pool.checkin(in_use)
+    assert in_use.closed
+    assert pool.stats()["size"] == 0
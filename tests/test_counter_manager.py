@@ -0,0 +1,33 @@
+# Import the required modules
+from CmsLib import *
+from conftest import query
+
+# @brief This test adds a basket whose product is partly sold by a concurrent
+#        sale between the read of the quantities and their decrement, which
+#        fails only the lines no longer sufficient
+def test_add_items_after_concurrent_sale(pysql, monkeypatch):
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+    assert OrderManager.receive_order(pysql, OrderManager.place_order(pysql, [("RIC-01", 20)])) == 0
+    assert CounterManager.add_inventory_to_counter(pysql, "RIC-01", 10) == 0
+    token_id = TokenManager.add_token(pysql)
+    assert TokenManager.get_token(pysql) == token_id
+
+    # Another till sells 4 after the quantities are read, just before the
+    # savepoint of the decrement of the basket
+    run = pysql.run
+
+    def run_with_sale(sql_stmt, params = None):
+        if sql_stmt.startswith("SAVEPOINT"):
+            run("UPDATE `Inventory` SET `DisplayedQuantity` = `DisplayedQuantity` - 4")
+        run(sql_stmt, params)
+
+    monkeypatch.setattr(pysql, "run", run_with_sale)
+    codes = CounterManager.add_items_to_token(pysql, token_id, [("RIC-01", 4), ("RIC-01", 3), ("RIC-01", 2)])
+    monkeypatch.undo()
+
+    assert codes == [0, 4, 0]
+    assert float(query(pysql, "SELECT `DisplayedQuantity` FROM `Inventory`")[0][0]) == 0
+    assert float(query(pysql, "SELECT `Quantity` FROM `TokensSelectProducts`")[0][0]) == 6
+    assert [float(row[0]) for row in query(pysql, "SELECT `Quantity` FROM `InventoryTransactions` \
+                                                   WHERE `TransactionType` = 'COUNTER_SUB' \
+                                                   ORDER BY `TransactionID`")] == [4, 2]
@@ -0,0 +1,48 @@
+# Import the required modules
+from CmsLib import *
+from conftest import query
+
+# @brief This function adds a product sold from slabs of 5, with 20 on the
+#        counter
+# @param make_pysql Fixture creating the PySql object
+# @param slabs (HolderID, Quantity) of the slabs already held (list of tuples)
+# @retval pysql PySql object
+def make_escrow(make_pysql, slabs):
+    pysql = make_pysql(escrow = {"products": {"RIC-01": 5}, "holder": "till"})
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+    assert OrderManager.receive_order(pysql, OrderManager.place_order(pysql, [("RIC-01", 20)])) == 0
+    assert CounterManager.add_inventory_to_counter(pysql, "RIC-01", 20) == 0
+    for holder_id, quantity in slabs:
+        pysql.run_transaction(lambda pysql: pysql.run("INSERT INTO `InventoryEscrow` VALUES ('RIC-01', %s, %s)",
+                                                      (holder_id, quantity)))
+    return pysql
+
+# @brief This function returns the displayed quantity and the slabs
+def stock(pysql):
+    displayed = query(pysql, "SELECT `DisplayedQuantity` FROM `Inventory`")[0][0]
+    slabs = query(pysql, "SELECT `HolderID`, `Quantity` FROM `InventoryEscrow` ORDER BY 1")
+    return float(displayed), [(holder_id, float(quantity)) for holder_id, quantity in slabs]
+
+# @brief This test tops up a low slab and trims a slab holding more than the
+#        slab size (e.g. after the slab size was lowered)
+def test_settle_tops_up_and_trims(make_pysql):
+    pysql = make_escrow(make_pysql, [("till/0", 1), ("till/1", 8)])
+
+    pysql.escrow._InventoryEscrow__settle("RIC-01", "till/0")
+    assert stock(pysql) == (16, [("till/0", 5), ("till/1", 8)])
+
+    pysql.escrow._InventoryEscrow__settle("RIC-01", "till/1")
+    assert stock(pysql) == (19, [("till/0", 5), ("till/1", 5)])
+    assert pysql.escrow.stats()["settlements"] == 2
+
+# @brief This test returns the slabs stranded by a process which exited
+#        without returning them, leaving the slabs of other holders to
+#        return_slabs with all_holders
+def test_return_stranded_slabs(make_pysql):
+    pysql = make_escrow(make_pysql, [("till/0", 2), ("host:123/0", 4), ("host:123/1", 3)])
+
+    assert pysql.escrow.return_slabs() == 2
+    assert stock(pysql) == (22, [("host:123/0", 4), ("host:123/1", 3)])
+
+    assert pysql.escrow.return_slabs(all_holders = True) == 7
+    assert stock(pysql) == (29, [])
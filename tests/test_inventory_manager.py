@@ -0,0 +1,20 @@
+# Import the required modules
+from CmsLib import *
+
+# @brief This test receives an order of a product below its threshold with a
+#        low stock listener registered (the quantities of the order are read
+#        as Decimal from OrdersOfProducts)
+def test_receive_order_notifies_low_stock(pysql):
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+    order_id = OrderManager.place_order(pysql, [("RIC-01", 100)])
+    assert OrderManager.receive_order(pysql, order_id) == 0
+    assert InventoryManager.sub_product_from_inventory(pysql, "RIC-01", 95) == 0
+
+    notifications = []
+    InventoryManager.add_low_stock_listener(lambda *args: notifications.append(args))
+    order_id = OrderManager.place_order(pysql, [("RIC-01", 20)])
+    assert OrderManager.receive_order(pysql, order_id) == 0
+
+    assert len(notifications) == 1
+    product_id, below, quantity, threshold = notifications[0]
+    assert (product_id, below, float(quantity), float(threshold)) == ("RIC-01", False, 25, 10)
@@ -0,0 +1,27 @@
+# Import the required modules
+import os
+import sys
+
+import pytest
+
+from CmsLib import *
+from conftest import query
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "py_src"))
+import migrate
+
+# @brief This test stops a migration on a failed statement and runs it
+#        again, which resumes at the failed statement
+def test_migration_resumes_after_failure(pysql):
+    statements = ["CREATE TABLE `First` (`A` INT)",
+                  "CREATE TABLE `Second` (`B` INT",
+                  "INSERT INTO `SchemaMigrations` (`Version`) VALUES (99)"]
+    with pytest.raises(TransactionError):
+        pysql.run_transaction(migrate.apply_migration, 99, statements)
+    assert query(pysql, "SELECT `Step` FROM `SchemaMigrationSteps` WHERE `Version` = 99") == ((1, ), )
+
+    # The first statement would fail if it was run again
+    statements[1] = "CREATE TABLE `Second` (`B` INT)"
+    pysql.run_transaction(migrate.apply_migration, 99, statements)
+    assert 99 in pysql.run_transaction(migrate.get_applied_versions)
+    assert len(query(pysql, "SELECT `Step` FROM `SchemaMigrationSteps` WHERE `Version` = 99")) == 3
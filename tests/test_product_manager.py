@@ -0,0 +1,59 @@
+# Import the required modules
+from CmsLib import *
+from CmsLib.ConnectionPool import ConnectionPool
+from conftest import SqliteConnection, query, sqlite_connect
+
+HEADER = "ProductID,Name,Description,UnitPrice,UnitType,SGST,CGST"
+
+# @brief This test imports a product list without a discount column, which
+#        keeps the discounts of the products
+def test_import_products_keeps_discount(pysql):
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5, 10) == 0
+
+    report = ProductManager.import_products(pysql, [HEADER,
+                                                    "RIC-01,Rice,Basmati rice,85,kg,2.5,2.5",
+                                                    "DAL-01,Dal,Toor dal,120,kg,2.5,2.5"])
+    assert (report["written"], report["errors"]) == (2, [])
+
+    rows = query(pysql, "SELECT `ProductID`, `UnitPrice`, `CurrentDiscount` FROM `Products` ORDER BY `ProductID`")
+    assert [(product_id, float(price), float(discount)) for product_id, price, discount in rows] == \
+           [("DAL-01", 120, 0), ("RIC-01", 85, 10)]
+
+# @brief This test imports rows out of the range of the columns, which are
+#        reported without failing the rest of the chunk
+def test_import_products_reports_out_of_range(pysql):
+    report = ProductManager.import_products(pysql, [HEADER + ",CurrentDiscount",
+                                                    "RIC-01,Rice,,1000000,kg,2.5,2.5,0",
+                                                    "DAL-01,Dal,,120,kg,100,2.5,0",
+                                                    "OIL-01,Oil,,150,ltrs,2.5,2.5,100",
+                                                    "SUG-01,{},,40,kg,2.5,2.5,0".format("S" * 65),
+                                                    "SAL-01,Salt,,20,kg,2.5,2.5,5"])
+    assert report["written"] == 1
+    assert report["errors"] == [(2, "Unit price too large"),
+                                (3, "SGST and CGST not valid"),
+                                (4, "Current discount not valid"),
+                                (5, "Name or description too long")]
+
+# @brief This class sends the read only transactions to one replica
+class StaleReplica:
+
+    def __init__(self, pool):
+        self.pools = {"stale": pool}
+
+    def choose(self):
+        return "stale", self.pools["stale"]
+
+# @brief This test reads the catalog after a product was added while the
+#        read replica has not replicated it yet
+def test_catalog_reads_primary_after_local_change(pysql, database, tmp_path):
+    # Copy the database before the product is added
+    stale_path = str(tmp_path / "stale.db")
+    source, copy = sqlite_connect(database), sqlite_connect(stale_path)
+    source.backup(copy)
+    source.close()
+    copy.close()
+    pysql.replicas = StaleReplica(ConnectionPool(lambda: SqliteConnection(stale_path)))
+
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+    assert ProductManager.product_exists(pysql, "RIC-01")
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 1
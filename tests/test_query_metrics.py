@@ -0,0 +1,42 @@
+# Import the required modules
+import CmsLib.QueryMetrics as query_metrics
+from CmsLib.QueryMetrics import QueryMetrics, fingerprint
+
+# @brief This test checks that the statements differing by the number of
+#        their parameters share a fingerprint
+def test_fingerprint_collapses_parameters():
+    assert fingerprint("SELECT `Name` FROM `Products` WHERE `ProductID` IN (%s)") == \
+           fingerprint("SELECT `Name` FROM `Products` WHERE `ProductID` IN (%s, %s, %s)")
+    assert fingerprint("INSERT INTO `T` (`A`, `B`) VALUES (%s, %s), (%s, %s)") == \
+           fingerprint("INSERT INTO `T` (`A`, `B`) VALUES (%s, %s), (%s, %s), (%s, %s)")
+    assert fingerprint("UPDATE `Products` SET `UnitPrice` = CASE `ProductID` WHEN %s THEN %s WHEN %s THEN %s END") == \
+           fingerprint("UPDATE `Products` SET `UnitPrice` = CASE `ProductID` WHEN %s THEN %s WHEN %s THEN %s WHEN %s THEN %s END")
+    assert fingerprint("SAVEPOINT `SP_1`") == fingerprint("SAVEPOINT `SP_7`")
+
+# @brief This test checks that the series are labelled by hash and capped
+def test_series_are_bounded():
+    metrics = QueryMetrics(None, max_series = 2)
+    for count in range(1, 50):
+        metrics.observe("M.a", "SELECT 1 FROM `T` WHERE `X` IN ({})".format(", ".join(["%s"] * count)), 0.001, 1)
+    metrics.observe("M.b", "SELECT 2", 0.001, 1)
+    metrics.observe("M.c", "SELECT 3", 0.001, 1)
+
+    counts = [line for line in metrics.render() if line.startswith("cms_query_duration_seconds_count")]
+    assert len(counts) == 3
+    assert all("SELECT" not in line for line in counts)
+    assert 'method="M.c",statement="other"' in counts[-1]
+    assert "cms_query_series_overflow_total 1" in metrics.render()
+    assert sorted(metrics.statements().values()) == ["SELECT 1 FROM `T` WHERE `X` IN (...)", "SELECT 2"]
+
+# @brief This test checks that a statement is fingerprinted only once
+def test_fingerprint_cached(monkeypatch):
+    fingerprinted = []
+    monkeypatch.setattr(query_metrics, "fingerprint", lambda sql_stmt: fingerprinted.append(sql_stmt) or fingerprint(sql_stmt))
+    monkeypatch.setattr(query_metrics, "FINGERPRINT_CACHE_SIZE", 2)
+    metrics = QueryMetrics(None)
+    for sql_stmt in ["SELECT 1", "SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3", "SELECT 1"]:
+        metrics.observe("M.a", sql_stmt, 0.001, 1)
+
+    # The oldest statement is dropped past the cache size
+    assert fingerprinted == ["SELECT 1", "SELECT 2", "SELECT 3", "SELECT 1"]
+    assert sorted(metrics.statements().values()) == ["SELECT 1", "SELECT 2", "SELECT 3"]
@@ -0,0 +1,23 @@
+# Import the required modules
+from CmsLib.StatementCache import StatementCache
+
+# @brief This test counts the lookups of a statement per manager method
+def test_counts_per_method():
+    cache = StatementCache()
+    for method in ["M.a", "M.b", "M.a"]:
+        assert cache.get("SELECT  1", method) == "SELECT 1"
+
+    assert cache.stats() == {"SELECT 1": {"M.a": {"hits": 1, "misses": 1},
+                                          "M.b": {"hits": 1, "misses": 0}}}
+
+# @brief This test keeps the counts of a normalized statement until no
+#        cached statement is normalized to it
+def test_eviction_keeps_shared_counts():
+    cache = StatementCache(max_size = 2)
+    cache.get("SELECT  1", "M.a")
+    cache.get("SELECT   1", "M.a")
+    cache.get("SELECT 2", "M.a")
+    assert set(cache.stats()) == {"SELECT 1", "SELECT 2"}
+
+    cache.get("SELECT 3", "M.a")
+    assert set(cache.stats()) == {"SELECT 2", "SELECT 3"}
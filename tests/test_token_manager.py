@@ -0,0 +1,37 @@
+# Import the required modules
+from CmsLib import *
+
+# @brief This class is a PySql in a transaction which checks that the token
+#        pool is not locked while the Tokens table is read
+class UnlockedReadPySql:
+
+    def __init__(self, token_pool, rows):
+        self.token_pool = token_pool
+        self.rows = rows
+        self.reads = 0
+
+    def run(self, sql_stmt, params = None):
+        assert not self.token_pool._TokenPool__lock.locked()
+        self.reads += 1
+        self.result = self.rows
+
+    def after_rollback(self, callback):
+        pass
+
+# @brief This test hands out the free tokens in the order of their numbers,
+#        past the two digit ids
+def test_get_token_orders_by_number(pysql):
+    assert len(TokenManager.add_tokens(pysql, 101)) == 101
+
+    token_ids = [TokenManager.get_token(pysql) for _ in range(101)]
+    assert token_ids == [TokenPool.token_id(number) for number in range(101)]
+
+# @brief This test reads the tokens in use without holding the lock of the
+#        token pool
+def test_token_pool_reads_unlocked():
+    token_pool = TokenPool()
+    pysql = UnlockedReadPySql(token_pool, [("TOK-00", ), ("TOK-02", )])
+
+    assert token_pool.take(pysql, 2) == [1, 3]
+    assert token_pool.take(pysql, 1) == [4]
+    assert pysql.reads == 1
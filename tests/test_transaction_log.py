@@ -0,0 +1,77 @@
+# Import the required modules
+import datetime
+import time
+
+import MySQLdb
+import pytest
+
+from CmsLib import *
+from CmsLib.ConnectionPool import ConnectionPool
+from conftest import SqliteConnection, query
+
+# @brief This class is a connection whose statements all fail
+class BrokenConnection:
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql_stmt, params = None):
+        raise MySQLdb.OperationalError(2013, "Lost connection to MySQL server during query")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+# @brief This test writes the log in the background, stamped by the server
+def test_background_log_uses_server_time(make_pysql):
+    pysql = make_pysql(transaction_log = "background")
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+    OrderManager.receive_order(pysql, OrderManager.place_order(pysql, [("RIC-01", 10)]))
+    pysql.transaction_log.flush()
+
+    rows = query(pysql, "SELECT `TransactionType`, `Timestamp` FROM `InventoryTransactions`")
+    assert [row[0] for row in rows] == ["INVENTORY_ADD"]
+    # SQLite gives the time in UTC
+    assert abs(rows[0][1] - datetime.datetime.utcnow()) < datetime.timedelta(seconds = 5)
+
+# @brief This test stamps the background log when the movements commit, not
+#        when their rows are written
+def test_background_log_stamped_at_commit(make_pysql, database):
+    pysql = make_pysql(transaction_log = "background")
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+
+    # The writer connects 2 seconds after the commit
+    def connect():
+        time.sleep(2)
+        return SqliteConnection(database)
+
+    pysql.transaction_log.pool = ConnectionPool(connect)
+    OrderManager.receive_order(pysql, OrderManager.place_order(pysql, [("RIC-01", 10)]))
+    committed_at = datetime.datetime.utcnow()
+    pysql.transaction_log.flush()
+
+    rows = query(pysql, "SELECT `Timestamp` FROM `InventoryTransactions`")
+    assert committed_at - datetime.timedelta(seconds = 5) < rows[0][0] <= committed_at
+
+# @brief This test refuses the checkpoints which could miss queued log rows
+#        or run in the transaction of the caller
+def test_checkpoint_refused(make_pysql):
+    with pytest.raises(RuntimeError):
+        InventoryManager.create_checkpoint(make_pysql(transaction_log = "background"))
+
+    pysql = make_pysql()
+    with pytest.raises(Exception, match = "inside a transaction"):
+        pysql.run_transaction(lambda pysql: InventoryManager.create_checkpoint(pysql))
+
+# @brief This test reports the rows dropped by the background writer
+def test_background_log_reports_dropped_rows(make_pysql):
+    pysql = make_pysql(transaction_log = "background")
+    assert ProductManager.add_product(pysql, "RIC-01", "Rice", "Basmati rice", 80, "kg", 2.5, 2.5) == 0
+    pysql.transaction_log.pool = ConnectionPool(BrokenConnection)
+    OrderManager.receive_order(pysql, OrderManager.place_order(pysql, [("RIC-01", 10)]))
+    pysql.transaction_log.flush()
+
+    assert pysql.transaction_log.stats()["dropped"] == 1
+    assert "cms_transaction_log_dropped_total 1" in pysql.render_metrics()